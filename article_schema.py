@@ -0,0 +1,191 @@
+# Article schema shared by the XLSX and XML exporters.
+# Both build an 'article' record and turn it into a MongoDB document,
+# so documents from both sources have the same shape
+
+from operator import itemgetter
+
+# dictionary for Excel column titles
+excel_titles = {
+    "id": "ID",
+    "doi": "DOI",
+
+    "title_ru": "Заголовок статьи",
+    "title_en": "Заголовок статьи (англ.)",
+
+    "abstract_ru": "Абстракт (краткое содержание)",
+    "abstract_en": "Абстракт (краткое содержание) (англ.)",
+
+    "keywords_ru": "Ключевые слова",
+    "keywords_en": "Ключевые слова (англ.)",
+
+    "authors_list_ru": "Список авторов (краткий)",
+    "authors_list_en": "Список авторов (краткий) (англ.)",
+
+    "authors_info_ru": "Список авторов (полный)",
+    "authors_info_en": "Список авторов (полный) (англ.)",
+
+    "rubric": "Рубрика",
+
+    "volume": "Том",
+    "month": "Месяц издания",
+
+    "references_ru": "Список литературы",
+    "references_en": "Список литературы (англ.)",
+    "pages": "Номера страниц"
+}
+
+# Order of values in a projected row
+row_fields = ("id", "doi", "rubric",
+              "title_ru", "title_en",
+              "abstract_ru", "abstract_en",
+              "authors_list_ru", "authors_list_en",
+              "authors_info_ru", "authors_info_en",
+              "keywords_ru", "keywords_en",
+              "references_ru", "references_en",
+              "pages", "volume", "month")
+
+
+class article(object):
+    """Compact article record"""
+
+    __slots__ = ("id", "doi", "rubric",
+                 "eissn", "volume", "year", "month", "issue",
+                 "title_ru", "title_en",
+                 "abstract_ru", "abstract_en",
+                 "authors_list_ru", "authors_list_en",
+                 "authors_info_ru", "authors_info_en",
+                 "keywords_ru", "keywords_en",
+                 "references_ru", "references_en",
+                 "first_page", "last_page")
+
+    def __init__(self) -> None:
+        for field in self.__slots__:
+            setattr(self, field, None)
+
+    def to_document(self) -> dict:
+        """MongoDB document of the article"""
+        return {
+            "_id": self.id,
+            "doi": self.doi,
+
+            "journal": {
+                "eISSN": self.eissn,
+                "volume": self.volume,
+                "year": self.year,
+                "month": self.month,
+                "issue": self.issue
+            },
+
+            "title": {
+                "ru": self.title_ru,
+                "en": self.title_en
+            },
+
+            "authors_list": {
+                "ru": self.authors_list_ru,
+                "en": self.authors_list_en
+            },
+
+            "authors_info": {
+                "ru": self.authors_info_ru,
+                "en": self.authors_info_en
+            },
+
+            "abstract": {
+                "ru": self.abstract_ru,
+                "en": self.abstract_en
+            },
+
+            "rubric": self.rubric,
+
+            "keywords": {
+                "ru": self.keywords_ru,
+                "en": self.keywords_en
+            },
+
+            "references": {
+                "ru": self.references_ru,
+                "en": self.references_en
+            },
+
+            "pages": {
+                "first": self.first_page,
+                "last": self.last_page
+            },
+
+            "flags": {
+                "crossref_xml_generated": False,
+                "drupal_json_generated": False
+            }
+        }
+
+
+def page_number(value: 'Page value') -> 'Integer or None':
+    """Convert a page number, None if it is missing or incorrect"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def row_projector(header: 'Row of column titles') -> 'Callable':
+    """Resolve column titles of a sheet once and return a function
+       that projects a row onto a tuple of values in 'row_fields' order"""
+    titles = {}
+    for col, title in enumerate(header):
+        titles[title] = col
+    return itemgetter(*[titles[excel_titles[field]] for field in row_fields])
+
+
+def article_from_row(values: tuple) -> article:
+    """Build an article record from a projected row of cell values"""
+
+    (id, doi, rubric,
+     title_ru, title_en,
+     abstract_ru, abstract_en,
+     authors_list_ru, authors_list_en,
+     authors_info_ru, authors_info_en,
+     keywords_ru, keywords_en,
+     references_ru, references_en,
+     pages, volume, month) = values
+
+    record = article()
+
+    # Article info
+
+    record.id = str(id)
+    record.doi = str(doi)
+    record.rubric = str(rubric)
+
+    record.title_ru = str(title_ru)
+    record.title_en = str(title_en)
+
+    record.abstract_ru = str(abstract_ru)
+    record.abstract_en = str(abstract_en)
+
+    record.authors_list_ru = str(authors_list_ru).split(', ')
+    record.authors_list_en = str(authors_list_en).split(', ')
+
+    record.authors_info_ru = str(authors_info_ru)
+    record.authors_info_en = str(authors_info_en)
+
+    record.keywords_ru = str(keywords_ru).split(', ')
+    record.keywords_en = str(keywords_en).split(', ')
+
+    record.references_ru = str(references_ru).split('\n')
+    record.references_en = str(references_en).split('\n')
+
+    pages = str(pages).split(' ')
+    record.first_page = page_number(pages[0])
+    record.last_page = page_number(pages[1]) if len(pages) > 1 else None
+
+    # Journal info
+
+    eissn, year, issue = record.id.split('-')[:3]
+    record.eissn = eissn
+    record.volume = int(volume)
+    record.year = int(year)
+    record.month = int(month)
+    record.issue = int(issue)
+
+    return record
@@ -0,0 +1,588 @@
+# Benchmarks for the import scripts.
+# Every benchmark checks that the optimized code path gives the same
+# output as the reference one before timing it.
+# Results are printed as JSON lines.
+
+import argparse
+import json
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from glob import glob
+from os import makedirs, path
+import xml.etree.ElementTree as ET
+from bson import BSON
+from openpyxl import load_workbook, Workbook
+from transliterate import translit
+import textprocessing_module as tp
+from transliteration_module import translit_ru
+from article_schema import excel_titles, row_fields, article_from_row
+
+# Chains of individual functions as they have been applied
+# by the process_*_field functions, used as a reference
+LEGACY_STACKS = {
+    "title": [tp.remove_wordwraps, tp.remove_linebreaks,
+              tp.remove_extra_spaces, tp.remove_trailing_dots],
+    "authors_list": [tp.remove_wordwraps, tp.remove_linebreaks,
+                     tp.remove_extra_spaces, tp.replace_semicolon_to_comma,
+                     tp.arrange_spaces_around_commas],
+    "authors_info": [tp.remove_wordwraps, tp.remove_linebreaks,
+                     tp.remove_extra_spaces],
+    "abstract": [tp.remove_wordwraps, tp.remove_linebreaks,
+                 tp.remove_extra_spaces],
+    "keywords": [tp.remove_wordwraps, tp.remove_phrase_before_colon,
+                 tp.remove_linebreaks, tp.remove_extra_spaces,
+                 tp.replace_semicolon_to_comma,
+                 tp.arrange_spaces_around_commas, tp.remove_trailing_dots],
+    "rubric": [tp.remove_wordwraps, tp.remove_linebreaks,
+               tp.remove_extra_spaces, tp.remove_trailing_dots, str.upper],
+    "references": [tp.remove_extra_spaces_in_list],
+    "pages": [tp.remove_extra_spaces]
+}
+
+
+def sample_strings(pattern: str) -> list:
+    """Collect all string cell values from the sample workbooks"""
+    values = []
+    for file in sorted(glob(pattern)):
+        wb = load_workbook(file, read_only=True)
+        for row in wb.active.values:
+            values += [value for value in row if type(value) is str]
+        wb.close()
+    return values
+
+
+def apply_legacy_stack(field: str, value: str) -> str:
+    for function in LEGACY_STACKS[field]:
+        value = function(value)
+    return value
+
+
+def benchmark_normalize(pattern: str, repeat: int) -> list:
+    """Compare fused field normalizers with the chains of
+       individual functions on every string cell of the samples"""
+    values = sample_strings(pattern)
+    results = []
+
+    for field in tp.NORMALIZERS:
+        legacy = [apply_legacy_stack(field, value) for value in values]
+        if tp.normalize_column(field, values) != legacy:
+            raise AssertionError('Normalized values differ for "' +
+                                 field + '" field')
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for value in values:
+                apply_legacy_stack(field, value)
+        legacy_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            tp.normalize_column(field, values)
+        fused_time = time.perf_counter() - started
+
+        cells = len(values) * repeat
+        results.append({
+            "benchmark": "normalize",
+            "field": field,
+            "cells": cells,
+            "legacy_us_per_cell": legacy_time / cells * 1e6,
+            "fused_us_per_cell": fused_time / cells * 1e6,
+            "speedup": legacy_time / fused_time
+        })
+
+    return results
+
+
+def benchmark_translit(pattern: str, xml_pattern: str, repeat: int) -> list:
+    """Compare transliteration_module with the 'transliterate' library
+       on every string of the sample workbooks and XML files"""
+    values = sample_strings(pattern)
+    for file in sorted(glob(xml_pattern)):
+        values += [element.text for element in ET.parse(file).iter()
+                   if element.text and element.text.strip()]
+
+    expected = [translit(value, 'ru', reversed=True) for value in values]
+    translit_ru.cache_clear()
+    if [translit_ru(value) for value in values] != expected:
+        raise AssertionError('Transliterated values differ')
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for value in values:
+            translit(value, 'ru', reversed=True)
+    library_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        translit_ru.cache_clear()
+        for value in values:
+            translit_ru(value)
+    uncached_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for value in values:
+            translit_ru(value)
+    cached_time = time.perf_counter() - started
+
+    strings = len(values) * repeat
+    return [{
+        "benchmark": "translit",
+        "strings": strings,
+        "library_us_per_string": library_time / strings * 1e6,
+        "uncached_us_per_string": uncached_time / strings * 1e6,
+        "cached_us_per_string": cached_time / strings * 1e6,
+        "speedup": library_time / uncached_time
+    }]
+
+
+# Runs correct_xlsx() in a fresh interpreter and reports
+# its wall time and peak resident set size
+CORRECT_RUNNER = '''
+import json, resource, sys, time
+sys.path.insert(0, sys.argv[1])
+from correct_xlsx import correct_xlsx
+started = time.perf_counter()
+correct_xlsx(streaming=sys.argv[2] == 'streaming')
+print(json.dumps({
+    "seconds": time.perf_counter() - started,
+    "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+}))
+'''
+
+
+def read_values(file: str) -> list:
+    """Values of the active sheet without trailing empty cells"""
+    wb = load_workbook(file, read_only=True)
+    rows = []
+    for row in wb.active.iter_rows(values_only=True):
+        row = list(row)
+        while row and row[-1] is None:
+            row.pop()
+        rows.append(row)
+    wb.close()
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+
+def benchmark_correct(pattern: str, copies: int) -> list:
+    """Compare in-place and streaming modes of correct_xlsx()
+       by wall time and peak memory on copies of the samples"""
+    code_dir = path.dirname(path.abspath(__file__))
+    results = []
+    outputs = {}
+
+    for mode in ('in-place', 'streaming'):
+        with tempfile.TemporaryDirectory() as work_dir:
+            makedirs(work_dir + "/incoming_xlsx")
+            for file in sorted(glob(pattern)):
+                name = path.splitext(path.basename(file))[0]
+                for copy in range(copies):
+                    shutil.copy(file, work_dir + "/incoming_xlsx/" +
+                                name + " " + str(copy) + ".xlsx")
+
+            output = subprocess.run(
+                [sys.executable, '-c', CORRECT_RUNNER, code_dir, mode],
+                cwd=work_dir, check=True, stdout=subprocess.PIPE,
+                universal_newlines=True).stdout
+            result = json.loads(output.splitlines()[-1])
+
+            outputs[mode] = {path.basename(file): read_values(file)
+                             for file in
+                             glob(work_dir + "/corrected_xlsx/*.xlsx")}
+
+        result.update({"benchmark": "correct",
+                       "mode": mode,
+                       "files": len(outputs[mode])})
+        results.append(result)
+
+    if outputs['in-place'] != outputs['streaming']:
+        raise AssertionError('Corrected workbooks differ between modes')
+
+    return results
+
+
+# Column titles of the synthetic workbooks
+PIPELINE_HEADER = [excel_titles[field] for field in row_fields]
+
+
+class MemoryCollection(object):
+    """In-process stand-in for a MongoDB collection, so the pipeline
+       can be benchmarked offline. Documents are encoded to BSON
+       as the driver would do before sending them, but only
+       their content hashes are kept"""
+
+    def __init__(self) -> None:
+        self.documents = {}
+        self.round_trips = 0
+        self.bytes_sent = 0
+
+    def find(self, filter: dict, projection: dict = None) -> list:
+        self.round_trips += 1
+        found = []
+        for _id in filter["_id"]["$in"]:
+            if _id in self.documents:
+                found.append({"_id": _id,
+                              "content_hash": self.documents[_id]})
+        return found
+
+    def write_documents(self, documents: list) -> None:
+        self.round_trips += 1
+        for document in documents:
+            self.bytes_sent += len(BSON.encode(document))
+            self.documents[document["_id"]] = document["content_hash"]
+
+
+def synthetic_id(eissn: str, number: int) -> str:
+    """Unique article ID of the synthetic issue: 100 articles per issue,
+       100 issues per year"""
+    return '-'.join([eissn,
+                     str(2000 + number // 10000).zfill(4),
+                     str(number // 100 % 100).zfill(2),
+                     str(number % 100).zfill(2)])
+
+
+def template_rows(pattern: str) -> list:
+    """Article rows of the sample workbooks in 'PIPELINE_HEADER' order"""
+    rows = []
+    for file in sorted(glob(pattern)):
+        wb = load_workbook(file, read_only=True)
+        values = wb.active.iter_rows(values_only=True)
+        titles = {title: col for col, title in enumerate(next(values))}
+        for row in values:
+            row = list(row) + [None] * (len(titles) - len(row))
+            row = [row[titles[title]] for title in PIPELINE_HEADER]
+            if tp.id_value_is_valid(row[0]):
+                rows.append(row)
+        wb.close()
+    return rows
+
+
+def generate_xlsx(file: str, templates: list, size: int) -> None:
+    """Write a workbook of 'size' articles cycling over the templates.
+       Values are left uncorrected, so normalization has work to do"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(PIPELINE_HEADER)
+    for number in range(size):
+        row = list(templates[number % len(templates)])
+        row[0] = synthetic_id(row[0][:8], number)
+        ws.append(row)
+    wb.save(file)
+
+
+def generate_xml(file: str, pattern: str, size: int) -> None:
+    """Write an XML issue of 'size' articles cycling over
+       the articles of the sample issues"""
+    samples = [ET.parse(sample).getroot() for sample in sorted(glob(pattern))]
+    articles = [ET.tostring(element, encoding='utf-8')
+                for sample in samples for element in sample.iter('Article')]
+
+    with open(file, 'wb') as output:
+        output.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<journal>\n')
+        for element in samples[0]:
+            if element.tag != 'Article':
+                output.write(ET.tostring(element, encoding='utf-8'))
+        for number in range(size):
+            output.write(articles[number % len(articles)])
+        output.write(b'</journal>\n')
+
+
+def benchmark_collection(mongo_uri: str) -> 'Mongo collection':
+    """Empty collection of a local mongod, or the in-process stand-in"""
+    if not mongo_uri:
+        return MemoryCollection()
+    from mongo_module import create_client
+    collection = create_client(mongo_uri).benchmark.articles
+    collection.drop()
+    return collection
+
+
+def run_xlsx_pipeline(file: str, mongo_uri: str, batch_size: int) -> dict:
+    """Import a workbook the way import_xlsx.py does,
+       timing every stage separately. Return seconds by stage"""
+    from correct_xlsx import normalize_row, validate_row
+    from mongo_module import flush_batch
+    from article_schema import row_projector
+
+    collection = benchmark_collection(mongo_uri)
+    seconds = dict.fromkeys(('load', 'normalize', 'validate',
+                             'build', 'write'), 0.0)
+    clock = time.perf_counter
+    batch = []
+    articles = 0
+
+    started = clock()
+    wb = load_workbook(file, read_only=True)
+    rows = wb.active.iter_rows(values_only=True)
+    header = next(rows)
+    titles = {title: col for col, title in enumerate(header)}
+    project = row_projector(header)
+    seconds['load'] += clock() - started
+
+    while True:
+        started = clock()
+        row = next(rows, None)
+        loaded = clock()
+        seconds['load'] += loaded - started
+        if row is None:
+            break
+
+        row = list(row)
+        normalize_row(row, titles)
+        normalized = clock()
+        seconds['normalize'] += normalized - loaded
+
+        incorrect = validate_row(row, titles)
+        validated = clock()
+        seconds['validate'] += validated - normalized
+        if "id" in incorrect:
+            continue
+
+        batch.append(article_from_row(project(row)).to_document())
+        articles += 1
+        built = clock()
+        seconds['build'] += built - validated
+
+        if len(batch) >= batch_size:
+            flush_batch(collection, batch)
+            batch = []
+            seconds['write'] += clock() - built
+
+    started = clock()
+    flush_batch(collection, batch)
+    seconds['write'] += clock() - started
+    wb.close()
+
+    return {"articles": articles, "seconds": seconds}
+
+
+def run_xml_pipeline(file: str, mongo_uri: str, batch_size: int) -> dict:
+    """Import an XML issue the way export_from_XML_to_mongo.py does.
+       Parsing and document building are a single stage there"""
+    from export_from_XML_to_mongo import iter_articles
+    from mongo_module import flush_batch
+
+    collection = benchmark_collection(mongo_uri)
+    seconds = {"parse": 0.0, "write": 0.0}
+    clock = time.perf_counter
+    batch = []
+    articles = 0
+
+    documents = iter_articles(file)
+    while True:
+        started = clock()
+        document = next(documents, None)
+        parsed = clock()
+        seconds['parse'] += parsed - started
+        if document is None:
+            break
+
+        batch.append(document)
+        articles += 1
+        if len(batch) >= batch_size:
+            flush_batch(collection, batch)
+            batch = []
+            seconds['write'] += clock() - parsed
+
+    started = clock()
+    flush_batch(collection, batch)
+    seconds['write'] += clock() - started
+
+    return {"articles": articles, "seconds": seconds}
+
+
+def run_pipeline(source: str, file: str, mongo_uri: str,
+                 batch_size: int) -> dict:
+    """Run one pipeline and add throughput and peak memory to its result"""
+    if source == 'xlsx':
+        result = run_xlsx_pipeline(file, mongo_uri, batch_size)
+    else:
+        result = run_xml_pipeline(file, mongo_uri, batch_size)
+
+    total = sum(result["seconds"].values())
+    result.update({
+        "total_seconds": total,
+        "rows_per_second": result["articles"] / total if total else None,
+        "stage_rows_per_second": {
+            stage: result["articles"] / seconds if seconds else None
+            for stage, seconds in result["seconds"].items()},
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    })
+    return result
+
+
+# Runs run_pipeline() in a fresh interpreter, so the peak
+# resident set size belongs to a single run
+PIPELINE_RUNNER = """
+import json, sys
+sys.path.insert(0, sys.argv[1])
+from benchmark import run_pipeline
+print(json.dumps(run_pipeline(sys.argv[2], sys.argv[3], sys.argv[4],
+                              int(sys.argv[5]))))
+"""
+
+
+def git_revision() -> 'String or None':
+    """Commit the benchmarked code belongs to"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=path.dirname(path.abspath(__file__)), check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_pipeline(pattern: str, xml_pattern: str, sizes: list,
+                       sources: list, work_dir: str, mongo_uri: str,
+                       batch_size: int) -> list:
+    """Import synthetic issues of every size stage by stage.
+       Generated files are kept in 'work_dir' and reused"""
+    code_dir = path.dirname(path.abspath(__file__))
+    revision = git_revision()
+    templates = template_rows(pattern) if 'xlsx' in sources else None
+    results = []
+
+    if not path.exists(work_dir):
+        makedirs(work_dir)
+
+    for size in sizes:
+        for source in sources:
+            file = path.join(work_dir, 'synthetic-' + str(size) +
+                             '.' + source)
+            generate_seconds = 0.0
+            if not path.exists(file):
+                started = time.perf_counter()
+                if source == 'xlsx':
+                    generate_xlsx(file, templates, size)
+                else:
+                    generate_xml(file, xml_pattern, size)
+                generate_seconds = time.perf_counter() - started
+
+            output = subprocess.run(
+                [sys.executable, '-c', PIPELINE_RUNNER, code_dir, source,
+                 file, mongo_uri or '', str(batch_size)],
+                cwd=work_dir, check=True, stdout=subprocess.PIPE,
+                universal_newlines=True).stdout
+            result = json.loads(output.splitlines()[-1])
+
+            result.update({"benchmark": "pipeline",
+                           "source": source,
+                           "size": size,
+                           "sink": "mongod" if mongo_uri else "memory",
+                           "batch_size": batch_size,
+                           "generate_seconds": generate_seconds,
+                           "revision": revision})
+            results.append(result)
+
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmarks for the import scripts')
+    subparsers = arg_parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    normalize_parser = subparsers.add_parser(
+        'normalize', help='Field normalizers against the chained functions')
+    normalize_parser.add_argument('--samples',
+                                  default='samples/*.xlsx',
+                                  help='Glob of workbooks to take values from')
+    normalize_parser.add_argument('--repeat',
+                                  type=int,
+                                  default=20,
+                                  help='Number of passes over the values')
+
+    translit_parser = subparsers.add_parser(
+        'translit', help='Transliteration against the transliterate library')
+    translit_parser.add_argument('--samples',
+                                 default='samples/*.xlsx',
+                                 help='Glob of workbooks to take values from')
+    translit_parser.add_argument('--xml-samples',
+                                 default='samples/*.xml',
+                                 help='Glob of XML files to take values from')
+    translit_parser.add_argument('--repeat',
+                                 type=int,
+                                 default=20,
+                                 help='Number of passes over the values')
+
+    correct_parser = subparsers.add_parser(
+        'correct', help='In-place and streaming modes of correct_xlsx')
+    correct_parser.add_argument('--samples',
+                                default='samples/*.xlsx',
+                                help='Glob of workbooks to correct')
+    correct_parser.add_argument('--copies',
+                                type=int,
+                                default=5,
+                                help='Number of copies of each workbook')
+
+    pipeline_parser = subparsers.add_parser(
+        'pipeline', help='Whole import pipeline on synthetic issues')
+    pipeline_parser.add_argument('--samples',
+                                 default='samples/*.xlsx',
+                                 help='Glob of workbooks used as templates')
+    pipeline_parser.add_argument('--xml-samples',
+                                 default='samples/*.xml',
+                                 help='Glob of XML files used as templates')
+    pipeline_parser.add_argument('--sizes',
+                                 type=int,
+                                 nargs='+',
+                                 default=[1000, 10000],
+                                 help='Numbers of articles in synthetic '
+                                      'issues, up to 1000000')
+    pipeline_parser.add_argument('--sources',
+                                 nargs='+',
+                                 choices=['xlsx', 'xml'],
+                                 default=['xlsx', 'xml'],
+                                 help='Kinds of issues to import')
+    pipeline_parser.add_argument('--work-dir',
+                                 default='benchmark_data',
+                                 help='Directory for generated issues')
+    pipeline_parser.add_argument('--mongo-uri',
+                                 help='Local mongod to write into, '
+                                      'an in-process stand-in by default')
+    pipeline_parser.add_argument('--batch-size',
+                                 type=int,
+                                 default=500,
+                                 help='Number of articles sent at once')
+    pipeline_parser.add_argument('--output',
+                                 help='Also append results to this file')
+
+    arguments = arg_parser.parse_args()
+
+    if arguments.benchmark == 'normalize':
+        results = benchmark_normalize(arguments.samples, arguments.repeat)
+    elif arguments.benchmark == 'translit':
+        results = benchmark_translit(arguments.samples,
+                                     arguments.xml_samples,
+                                     arguments.repeat)
+    elif arguments.benchmark == 'correct':
+        results = benchmark_correct(path.abspath(arguments.samples),
+                                    arguments.copies)
+    elif arguments.benchmark == 'pipeline':
+        results = benchmark_pipeline(path.abspath(arguments.samples),
+                                     path.abspath(arguments.xml_samples),
+                                     arguments.sizes, arguments.sources,
+                                     path.abspath(arguments.work_dir),
+                                     arguments.mongo_uri,
+                                     arguments.batch_size)
+
+    for result in results:
+        print(json.dumps(result))
+
+    if getattr(arguments, 'output', None):
+        with open(arguments.output, 'a') as output:
+            for result in results:
+                output.write(json.dumps(result) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -2,161 +2,306 @@
 # and try to correct them based on set of regular expressions
 
 from os import listdir, path, makedirs, rename, environ
+import argparse
 import logging
 from openpyxl import load_workbook, Workbook
-from textprocessing_module import (process_abstract_field,
-                                   process_authors_field,
-                                   process_authors_list_field,
-                                   process_keywords_field,
-                                   process_rubric_field,
-                                   process_title_field,
-                                   process_references_field,
-                                   process_pages_field,
-                                   id_is_valid,
-                                   volume_is_valid,
-                                   month_is_valid)
-from transliterate import translit, get_available_language_codes
-
-
-def correct_xlsx() -> None:
-
-    # setup folders
-    incoming_dir = "incoming_xlsx"
-    outgoing_dir = "corrected_xlsx"
-    trash_dir = "trash"
-
-    # setup logging
-    logging.basicConfig(filename='app.log',
-                        level=logging.INFO,
-                        format='%(asctime)s | %(levelname)s | %(message)s',
-                        datefmt='%d/%m/%Y %H:%M:%S')
+from textprocessing_module import (normalize_abstract,
+                                   normalize_authors,
+                                   normalize_authors_list,
+                                   normalize_keywords,
+                                   normalize_rubric,
+                                   normalize_title,
+                                   normalize_references,
+                                   normalize_pages,
+                                   id_value_is_valid,
+                                   volume_value_is_valid,
+                                   month_value_is_valid)
+from transliteration_module import translit_ru
+from parallel_module import map_files
+from article_schema import excel_titles
+from metrics_module import (add_time, timed, timed_iter, instrumented_run,
+                            add_profile_argument, file_scope, add_stats)
+from time import perf_counter
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+# Number of rows of a sheet sent to a worker process at once,
+# and number of chunks waiting for each worker
+CHUNK_SIZE = 200
+CHUNKS_PER_WORKER = 2
+
+# Text processing functions by Excel column.
+# Stored in textprocessing_module.py
+column_normalizers = [
+    ("title_ru", normalize_title),
+    ("title_en", normalize_title),
+    ("authors_list_ru", normalize_authors_list),
+    ("authors_list_en", normalize_authors_list),
+    ("authors_info_ru", normalize_authors),
+    ("authors_info_en", normalize_authors),
+    ("abstract_ru", normalize_abstract),
+    ("abstract_en", normalize_abstract),
+    ("keywords_ru", normalize_keywords),
+    ("keywords_en", normalize_keywords),
+    ("rubric", normalize_rubric),
+    ("pages", normalize_pages),
+    ("references_ru", normalize_references)
+]
+
+
+def normalize_row(row: list, titles: dict) -> None:
+    """Normalize text values of a row (a list of cell values) in place"""
+
+    # Every field is timed as a stage of its own, so the slowest
+    # normalizer of textprocessing_module can be told apart
+    started = perf_counter()
+    for field, normalize in column_normalizers:
+        col = titles[excel_titles[field]]
+        if type(row[col]) is str:
+            row[col] = normalize(row[col])
+        finished = perf_counter()
+        add_time("normalize." + field, finished - started, 1)
+        started = finished
+
+    references_ru = titles[excel_titles['references_ru']]
+    references_en = titles[excel_titles['references_en']]
+    if type(row[references_ru]) is str and not row[references_en]:
+        with timed("transliterate", 1):
+            row[references_en] = translit_ru(row[references_ru])
+
+
+def validate_row(row: list, titles: dict) -> list:
+    """Return names of the fields of a row with incorrect values"""
+
+    incorrect = []
+
+    if not id_value_is_valid(row[titles[excel_titles['id']]]):
+        incorrect.append("id")
+
+    if not volume_value_is_valid(row[titles[excel_titles['volume']]]):
+        incorrect.append("volume")
+
+    if not month_value_is_valid(row[titles[excel_titles['month']]]):
+        incorrect.append("month")
+
+    return incorrect
+
+
+def correct_row(row: list, titles: dict) -> list:
+    """Correct values of a row (a list of cell values) in place.
+       Return names of the fields with incorrect values"""
+    normalize_row(row, titles)
+    with timed("validate", 1):
+        return validate_row(row, titles)
+
+
+def log_add(file: str, field: str, row: int, value: 'Cell value') -> str:
+    return ('Incorrect value. File: "' + file + '". ' +
+            'Field: "' + field + '". ' +
+            'Row: "' + str(row+2) + '". ' +
+            'Value: "' + str(value) + '"')
+
+
+def correct_valid_row(row: list, titles: dict) -> 'List or None':
+    """Correct a row if it has a valid ID. Return names of the fields
+       with incorrect values, or None if the row has been left as is"""
+    if id_value_is_valid(row[titles[excel_titles['id']]]):
+        return correct_row(row, titles)
+    return None
+
+
+def correct_chunk(titles: dict, rows: list) -> tuple:
+    """Correct a chunk of rows in a worker process. Return (row,
+       incorrect fields) pairs and metrics of the chunk"""
+    with file_scope() as stats:
+        results = [(row, correct_valid_row(row, titles)) for row in rows]
+    return results, stats
+
+
+def correct_in_chunks(titles: dict, rows: 'Iterable', workers: int,
+                      chunk_size: int = CHUNK_SIZE) -> 'Iterator':
+    """Correct rows in chunks of 'chunk_size' in worker processes.
+       Yield (row, incorrect fields) pairs in the original order.
+       Only a few chunks per worker are in flight at any time"""
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if chunk:
+                futures.append(executor.submit(correct_chunk, titles, chunk))
+            if futures and (not chunk or
+                            len(futures) >= workers * CHUNKS_PER_WORKER):
+                results, stats = futures.popleft().result()
+                add_stats(stats)
+                yield from results
+            elif not chunk:
+                return
+
+
+def correct_rows(file: str, rows: 'Iterable',
+                 workers: int = 1) -> 'Iterator':
+    """Yield corrected rows as lists of cell values.
+       The first row holds column titles. With more than one worker
+       the rows are corrected in chunks in worker processes"""
+
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+
+    # Collect column titles from Excel file.
+    # With this column order is not important
+    header = list(header)
+    titles = {}
+    for col, title in enumerate(header):
+        titles[title] = col
+    yield header
+
+    # Streamed rows may lack trailing empty cells
+    width = len(header)
+    rows = (list(row) + [None] * (width - len(row)) for row in rows)
+
+    if workers > 1:
+        results = correct_in_chunks(titles, rows, workers)
+    else:
+        results = ((row, correct_valid_row(row, titles)) for row in rows)
+
+    for i, (row, incorrect) in enumerate(results, 1):
+        if incorrect is not None:
+            logging.info("# Processing a file")
+            for field in incorrect:
+                logging.info(log_add(file, field, i,
+                                     row[titles[excel_titles[field]]]))
+        yield row
 
-    logging.info("### XLSX Correction Script started")
 
-    def log_add(file: str, field: str, row: int, cell: 'Excel cell') -> str:
-        return ('Incorrect value. File: "' + file + '". ' +
-                'Field: "' + field + '". ' +
-                'Row: "' + str(row+2) + '". ' +
-                'Value: "' + str(cell.value) + '"')
+def create_corrected_workbook(wb: 'Workbook') -> tuple:
+    """Create a write-only copy of a read-only workbook.
+       Every sheet except the active one is copied as values.
+       Return the copy and its still empty active sheet"""
 
+    corrected_wb = Workbook(write_only=True)
 
-    # dictionary for Excel column titles
-    excel_titles = {
-        "id": "ID",
-        "doi": "DOI",
+    for ws in wb.worksheets:
+        corrected_ws = corrected_wb.create_sheet(ws.title)
+        if ws is wb.active:
+            corrected_active = corrected_ws
+        else:
+            for row in ws.iter_rows(values_only=True):
+                corrected_ws.append(row)
 
-        "title_ru": "Заголовок статьи",
-                    "title_en": "Заголовок статьи (англ.)",
+    corrected_wb.active = wb.worksheets.index(wb.active)
+    return corrected_wb, corrected_active
 
-                    "abstract_ru": "Абстракт (краткое содержание)",
-                    "abstract_en": "Абстракт (краткое содержание) (англ.)",
 
-                    "keywords_ru": "Ключевые слова",
-                    "keywords_en": "Ключевые слова (англ.)",
+def correct_file(file: str, incoming_dir: str, outgoing_dir: str,
+                 streaming: bool = False, row_workers: int = 1) -> None:
+    """Correct a single file and save it into 'outgoing_dir'.
+       Rows are corrected in 'row_workers' processes if there is
+       more than one"""
 
-                    "authors_list_ru": "Список авторов (краткий)",
-                    "authors_list_en": "Список авторов (краткий) (англ.)",
+    logging.info("# Processing a file")
 
-                    "authors_info_ru": "Список авторов (полный)",
-                    "authors_info_en": "Список авторов (полный) (англ.)",
+    if streaming:
 
-                    "rubric": "Рубрика",
+        # Rows are read lazily and written straight into
+        # a write-only workbook, so memory use does not depend
+        # on the file size. Styles are not preserved
+        with timed("load"):
+            wb = load_workbook(incoming_dir + "/" + file, read_only=True)
+            corrected_wb, corrected_ws = create_corrected_workbook(wb)
 
-                    "volume": "Том",
-                    "month": "Месяц издания",
+        rows = timed_iter("read", wb.active.iter_rows(values_only=True))
+        for row in correct_rows(file, rows, row_workers):
+            corrected_ws.append(row)
 
-                    "references_ru": "Список литературы",
-                    "references_en": "Список литературы (англ.)",
-                    "pages": "Номера страниц"
-    }
+        with timed("save"):
+            corrected_wb.save(outgoing_dir + "/" + file)
+        wb.close()
 
-    # Scan current directory for ".xlsx" files
-    for file in listdir(incoming_dir):
-        if file.endswith(".xlsx"):
-            logging.info("# Processing a file")
+    else:
 
-            # load an Excel file into memory
+        # load an Excel file into memory
+        with timed("load"):
             wb = load_workbook(incoming_dir + "/" + file)
 
-            # set active worksheet
-            ws = wb.active
-
-            # Iterate through columns. Column[0].value is the column title.
-            # Perform string replacements / value checking based on column title.
-            # Text replacement functions stored in textprocessing_module.py
-
-            for i, row in enumerate(ws.rows):
-
-                # Collect column titles from Excel file.
-                # With this column order is not important
-                if i == 0:
-                    titles = {}
-                    for col, title in enumerate(row):
-                        titles[title.value] = col
+        # set active worksheet
+        ws = wb.active
 
-                else:
+        # Perform string replacements / value checking based
+        # on column title and write changed values back
+        rows = timed_iter("read", ws.values)
+        for cells, row in zip(ws.rows,
+                              correct_rows(file, rows, row_workers)):
+            for cell, corrected in zip(cells, row):
+                if cell.value != corrected:
+                    cell.value = corrected
 
-                    if id_is_valid(row[titles[excel_titles['id']]]):
-                        logging.info("# Processing a file")
-                        process_title_field(
-                            row[titles[excel_titles['title_ru']]])
-                        process_title_field(
-                            row[titles[excel_titles['title_en']]])
-
-                        process_authors_list_field(
-                            row[titles[excel_titles['authors_list_ru']]])
-                        process_authors_list_field(
-                            row[titles[excel_titles['authors_list_en']]])
-
-                        process_authors_field(
-                            row[titles[excel_titles['authors_info_ru']]])
-                        process_authors_field(
-                            row[titles[excel_titles['authors_info_en']]])
-
-                        process_abstract_field(
-                            row[titles[excel_titles['abstract_ru']]])
-                        process_abstract_field(
-                            row[titles[excel_titles['abstract_en']]])
-
-                        process_keywords_field(
-                            row[titles[excel_titles['keywords_ru']]])
-                        process_keywords_field(
-                            row[titles[excel_titles['keywords_en']]])
+        with timed("save"):
+            wb.save(outgoing_dir + "/" + file)
 
-                        process_rubric_field(
-                            row[titles[excel_titles['rubric']]])
 
-                        process_pages_field(row[titles[excel_titles['pages']]])
+def correct_xlsx(streaming: bool = False, workers: int = 1,
+                 row_workers: int = 1) -> None:
 
-                        process_references_field(
-                            row[titles[excel_titles['references_ru']]])
+    # setup folders
+    incoming_dir = "incoming_xlsx"
+    outgoing_dir = "corrected_xlsx"
+    trash_dir = "trash"
 
-                        if type(row[titles[excel_titles['references_ru']]].value) is str and not row[titles[excel_titles['references_en']]].value:
-                            row[titles[excel_titles['references_en']]].value = translit(row[titles[excel_titles['references_ru']]].value, 'ru', reversed=True)
+    # setup logging
+    logging.basicConfig(filename='app.log',
+                        level=logging.INFO,
+                        format='%(asctime)s | %(levelname)s | %(message)s',
+                        datefmt='%d/%m/%Y %H:%M:%S')
 
-                        if not id_is_valid(row[titles[excel_titles['id']]]):
-                            logging.info(
-                                log_add(file, "id", i, row[titles[excel_titles['id']]]))
+    logging.info("### XLSX Correction Script started")
 
-                        if not volume_is_valid(row[titles[excel_titles['volume']]]):
-                            logging.info(
-                                log_add(file, "volume", i, row[titles[excel_titles['volume']]]))
+    if not path.exists(outgoing_dir):
+        makedirs(outgoing_dir)
 
-                        if not volume_is_valid(row[titles[excel_titles['month']]]):
-                            logging.info(log_add(file, "month", i,
-                                                 row[titles[excel_titles['month']]]))
+    if not path.exists(incoming_dir + "/" + trash_dir):
+        makedirs(incoming_dir + "/" + trash_dir)
 
-            if not path.exists(outgoing_dir):
-                makedirs(outgoing_dir)
-            wb.save(outgoing_dir + "/" + file)
+    # Scan current directory for ".xlsx" files
+    files = [file for file in listdir(incoming_dir) if file.endswith(".xlsx")]
 
-            if not path.exists(incoming_dir + "/" + trash_dir):
-                makedirs(incoming_dir + "/" + trash_dir)
+    # Files are corrected in worker processes if there is more than one,
+    # but only moved into 'Trash' directory here after they succeed
+    for file, _, error in map_files(correct_file, files,
+                                    (incoming_dir, outgoing_dir, streaming,
+                                     row_workers),
+                                    workers):
+        if error:
+            logging.error(file + " has not been corrected: " + error)
+            continue
 
-            rename(incoming_dir + "/" + file, incoming_dir +
-                   "/" + trash_dir + "/" + file)
-            logging.info(file + " has been corrected")
+        rename(incoming_dir + "/" + file, incoming_dir +
+               "/" + trash_dir + "/" + file)
+        logging.info(file + " has been corrected")
 
 
 if __name__ == "__main__":
-    correct_xlsx()
+    arg_parser = argparse.ArgumentParser(
+        description='Correct XLSX files from the "incoming_xlsx" directory')
+    arg_parser.add_argument('--streaming',
+                            action='store_true',
+                            help='Stream rows into a write-only workbook '
+                                 'to keep memory use flat')
+    arg_parser.add_argument('--workers',
+                            type=int,
+                            default=1,
+                            help='Number of files processed in parallel')
+    arg_parser.add_argument('--row-workers',
+                            type=int,
+                            default=1,
+                            help='Number of processes correcting rows '
+                                 'of a single file in chunks')
+    add_profile_argument(arg_parser)
+    arguments = arg_parser.parse_args()
+
+    with instrumented_run('correct_xlsx', arguments.profile):
+        correct_xlsx(arguments.streaming, arguments.workers,
+                     arguments.row_workers)
@@ -0,0 +1,118 @@
+# Index of article IDs across the XLSX files of a run.
+# Resubmitted issues often repeat articles of files still waiting
+# in the incoming directory. Before anything is written, the IDs of
+# all files are collected with the row they are in and a hash of
+# the row content, and every ID is written only once.
+#
+# Precedence: the version in the most recently modified file wins.
+# Files modified at the same time are ordered by name, the later
+# name winning. Inside a file the last row with the ID wins,
+# as it did when every row was upserted in turn.
+#
+# A file whose rows have lost is finished (recorded in the manifest
+# and moved to trash) only after every file that won them has been
+# written. Otherwise it stays in the incoming directory, so its rows
+# are not lost if the winning file never makes it
+
+from hashlib import sha256
+from os import stat
+import json
+import logging
+from openpyxl import load_workbook
+from textprocessing_module import id_value_is_valid
+from article_schema import row_projector
+
+
+def row_hash(values: tuple) -> str:
+    """Return SHA-256 of the projected cell values of a row"""
+    serialized = json.dumps(values, ensure_ascii=False,
+                            separators=(',', ':'), default=str)
+    return sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def file_ids(file_path: str) -> list:
+    """Return (ID, row number, row hash) of every row of the active
+       sheet with a valid ID. Rows are numbered as in Excel"""
+    wb = load_workbook(file_path, read_only=True)
+    rows = wb.active.iter_rows(values_only=True)
+    header = next(rows, None)
+
+    ids = []
+    if header is not None:
+        width = len(header)
+        project = row_projector(header)
+        for number, row in enumerate(rows, 2):
+            if len(row) < width:
+                row += (None,) * (width - len(row))
+            values = project(row)
+            if id_value_is_valid(values[0]):
+                ids.append((values[0], number, row_hash(values)))
+    wb.close()
+    return ids
+
+
+def precedence(files: list, directory: str) -> list:
+    """Order files from the lowest precedence to the highest"""
+    return sorted(files, key=lambda file:
+                  (stat(directory + "/" + file).st_mtime, file))
+
+
+def index_ids(files: list, directory: str) -> dict:
+    """Map every ID to its (file, row, hash) occurrences,
+       from the lowest precedence to the highest"""
+    index = {}
+    for file in precedence(files, directory):
+        for article_id, number, digest in file_ids(directory + "/" + file):
+            index.setdefault(article_id, []).append((file, number, digest))
+    return index
+
+
+def resolve_duplicates(index: dict) -> tuple:
+    """Return rows that lose to another version of their ID as
+       {file: set of row numbers}, (ID, lost, kept) triples for
+       the lost rows whose content differs from the kept one, and
+       the files that won rows of every other file as {file: set}"""
+    excluded = {}
+    conflicts = []
+    winners = {}
+    for article_id, occurrences in index.items():
+        kept = occurrences[-1]
+        for lost in occurrences[:-1]:
+            excluded.setdefault(lost[0], set()).add(lost[1])
+            if lost[0] != kept[0]:
+                winners.setdefault(lost[0], set()).add(kept[0])
+            if lost[2] != kept[2]:
+                conflicts.append((article_id, lost, kept))
+    return excluded, conflicts, winners
+
+
+def log_conflicts(conflicts: list) -> None:
+    """Log rows dropped in favour of a different version of the article"""
+    for article_id, lost, kept in conflicts:
+        logging.warning('Conflicting duplicate ID. ID: "' + article_id +
+                        '". Dropped: "' + lost[0] + '" row ' +
+                        str(lost[1]) + '. Kept: "' + kept[0] + '" row ' +
+                        str(kept[1]))
+
+
+def duplicate_rows(files: list, directory: str) -> tuple:
+    """Index IDs of the files of a run and return rows which must not
+       be written as {file: set of row numbers}, and the files that
+       won rows of other files as {file: set of files}. Conflicting
+       rows are logged. A single file is written as it is"""
+    if len(files) < 2:
+        return {}, {}
+
+    excluded, conflicts, winners = resolve_duplicates(
+        index_ids(files, directory))
+    log_conflicts(conflicts)
+    if excluded:
+        logging.info(str(sum(len(rows) for rows in excluded.values())) +
+                     " duplicate rows will not be written, " +
+                     str(len(conflicts)) + " of them with different content")
+    return excluded, winners
+
+
+def unsettled(file: str, winners: dict, succeeded: set) -> list:
+    """Files that won rows of the file but have not been written"""
+    return sorted(winners.get(file, set()) - succeeded)
@@ -1,27 +1,155 @@
 # Export article data from XLSX-files to MongoDB
 
-from os import listdir, rename, environ
+from os import listdir, rename
+import argparse
 import logging
-import ssl
-from pymongo import MongoClient
 from openpyxl import load_workbook
-from textprocessing_module import id_is_valid
-
-
-def export_to_mongo() -> None:
-
-    # setup credentials
-    mongo_conection_string = environ['MONGO_DEV_URI']
+from textprocessing_module import id_value_is_valid
+from mongo_module import (DEFAULT_BATCH_SIZE, upsert_in_batches,
+                          get_database, new_counts, add_writers_argument)
+from manifest_module import (file_hash, load_manifest, save_manifest,
+                             add_to_manifest, format_counts,
+                             load_checkpoint, save_checkpoint,
+                             clear_checkpoint)
+from parallel_module import map_files
+from duplicates_module import duplicate_rows, unsettled
+from near_duplicates_module import (flag_near_duplicates,
+                                    add_near_duplicates_argument)
+from staging_module import (StagingCollection, dump_path,
+                            add_stage_arguments)
+from article_schema import row_projector, article_from_row
+from metrics_module import (timed, timed_iter, instrumented_run,
+                            add_profile_argument)
+
+
+def log_failed(file: str, failed: list) -> None:
+    """Log articles that have not been acknowledged by MongoDB"""
+    for article_id, reason in failed:
+        logging.error('Article has not been exported. File: "' +
+                      file + '". ID: "' + str(article_id) +
+                      '". Reason: "' + reason + '"')
+    logging.error(file + " has not been exported to MongoDB")
+
+
+def worksheet_documents(ws: 'Excel worksheet',
+                        excluded: set = frozenset(),
+                        start: int = 0,
+                        positions: list = None) -> 'Iterator':
+    """Yield documents of the articles of a worksheet with valid IDs.
+       Rows whose Excel numbers are in 'excluded' or not after 'start'
+       are left out. Row numbers of the yielded documents are appended
+       to 'positions' if it is given"""
+
+    for i, row in enumerate(timed_iter("read",
+                                       ws.iter_rows(values_only=True))):
+
+        # Resolve column titles from Excel file once per sheet.
+        # With this column order is not important
+
+        if i == 0:
+            width = len(row)
+            project = row_projector(row)
+
+        elif i + 1 > start:
+
+            # Streamed rows may lack trailing empty cells
+            if len(row) < width:
+                row += (None,) * (width - len(row))
+
+            values = project(row)
+            if id_value_is_valid(values[0]) and i + 1 not in excluded:
+
+                print(str(values[0]))
+                with timed("build", 1):
+                    document = article_from_row(values).to_document()
+                if positions is not None:
+                    positions.append(i + 1)
+                yield document
+
+
+def checkpoint_saver(digest: str, file: str, positions: list) -> 'Callable':
+    """Return a callback of upsert_in_batches which saves the position
+       of the last document written so far as the checkpoint of a file"""
+    def committed(written: int) -> None:
+        save_checkpoint(digest, file, positions[written - 1])
+    return committed
+
+
+def export_file(file: str, incoming_dir: str,
+                batch_size: int = DEFAULT_BATCH_SIZE,
+                writers: int = 0,
+                duplicates: dict = None,
+                staging_dir: str = None,
+                staging_format: str = "bson",
+                near_duplicates: bool = False) -> list:
+    """Export a single file to MongoDB. Return counts of inserted,
+       updated and skipped articles and a list of (_id, reason)
+       pairs for failed ones. 'duplicates' holds the rows of the files
+       of the run that lose to another version of their ID.
+       A checkpoint is saved after every written batch and an
+       interrupted export of the same file resumes after it.
+       With 'staging_dir' the documents go into a local dump instead,
+       always from the first row. With 'near_duplicates' written
+       articles are checked for possible duplicates in the collection"""
+
+    positions = []
+    written = None
+    if staging_dir:
+        collection = StagingCollection(dump_path(staging_dir,
+                                                 incoming_dir + "/" + file,
+                                                 staging_format))
+        start, committed = 0, None
+    else:
+        collection = get_database().articles
+        digest = file_hash(incoming_dir + "/" + file)
+        start = load_checkpoint(digest)
+        if start:
+            logging.info(file + " is resumed after row " + str(start))
+        committed = checkpoint_saver(digest, file, positions)
+        if near_duplicates:
+            written = flag_near_duplicates
+
+    # The workbook is only read, so it is streamed row by row
+    # as plain tuples of cell values instead of Cell objects
+    with timed("load"):
+        wb = load_workbook(incoming_dir + "/" + file, read_only=True)
+
+    # Articles are upserted in batches, failed ones are collected
+    # as (_id, reason) pairs and reported after the whole file.
+    # With writer threads the batches are written while
+    # the rest of the sheet is being read
+    excluded = (duplicates or {}).get(file, frozenset())
+    counts = new_counts()
+    if excluded:
+        counts["duplicates"] = len(excluded)
+    failed = None
+    try:
+        failed = upsert_in_batches(collection,
+                                   worksheet_documents(wb.active, excluded,
+                                                       start, positions),
+                                   batch_size, counts, writers, committed,
+                                   written)
+    finally:
+        wb.close()
+        if staging_dir:
+            collection.close(keep=failed == [])
+
+    return counts, failed
+
+
+def export_to_mongo(batch_size: int = DEFAULT_BATCH_SIZE,
+                    workers: int = 1,
+                    force: bool = False,
+                    writers: int = 0,
+                    restart: bool = False,
+                    staging_dir: str = None,
+                    staging_format: str = "bson",
+                    near_duplicates: bool = False) -> None:
 
     # setup folders
     incoming_dir = "corrected_xlsx"
     trash_dir = "trash"
 
-    # setup DB connection
-    client = MongoClient(mongo_conection_string, ssl_cert_reqs=ssl.CERT_NONE)
-    db = client.rvph
-    collection = db.articles
-
     # setup logging
     logging.basicConfig(filename='app.log',
                         level=logging.INFO,
@@ -31,210 +159,126 @@ def export_to_mongo() -> None:
     logstring = "### Export data from XLSX to MongoDB Script started"
     logging.info(logstring)
 
-    # dictionary for Excel column titles
-    excel_titles = {
-        "id": "ID",
-        "doi": "DOI",
-
-        "title_ru": "Заголовок статьи",
-                    "title_en": "Заголовок статьи (англ.)",
-
-                    "abstract_ru": "Абстракт (краткое содержание)",
-                    "abstract_en": "Абстракт (краткое содержание) (англ.)",
-
-                    "keywords_ru": "Ключевые слова",
-                    "keywords_en": "Ключевые слова (англ.)",
-
-                    "authors_list_ru": "Список авторов (краткий)",
-                    "authors_list_en": "Список авторов (краткий) (англ.)",
+    # Load supplementary journal info (journal title, site etc.)
+    # from "journal_info" DB. Staging works without MongoDB
 
-                    "authors_info_ru": "Список авторов (полный)",
-                    "authors_info_en": "Список авторов (полный) (англ.)",
+    journal_info = {}
 
-                    "rubric": "Рубрика",
+    if not staging_dir:
+        db = get_database()
+        for journal in db.journal_info.find({}):
+            journal_info[journal["_id"]] = journal
 
-                    "volume": "Том",
-                    "month": "Месяц издания",
+    # Actual import. Files are exported in worker processes
+    # if there is more than one, each with its own MongoDB client
 
-                    "references_ru": "Список литературы",
-                    "references_en": "Список литературы (англ.)",
-                    "pages": "Номера страниц"
-    }
+    files = [file for file in listdir(incoming_dir) if file.endswith(".xlsx")]
 
-    # Load supplementary journal info (journal title, site etc.)
-    # from "journal_info" DB
+    # Files which have already been imported with the same content
+    # are skipped entirely, unless the import is forced
+    manifest = load_manifest()
+    hashes = {file: file_hash(incoming_dir + "/" + file) for file in files}
 
-    journal_info = {}
-
-    for journal in db.journal_info.find({}):
-        journal_info[journal["_id"]] = journal
-
-    class article(object):
-        def __init__(self) -> None:
-            self.id = None
-            self.doi = None
-            self.title = {}
-            self.journal = {}
-            self.journal['eISSN'] = None
-            self.journal['volume'] = None
-            self.journal['issue'] = None
-            self.journal['year'] = None
-            self.authors_list = {}
-            self.authors_info = {}
-            self.abstract = {}
-            self.keywords = {}
-            self.references = {}
-            self.pages = {}
-
-    article = article()
-
-    # Actual import
-
-    for file in listdir(incoming_dir):
-        if file.endswith(".xlsx"):
-
-            wb = load_workbook(incoming_dir + "/" + file)
-            ws = wb.active
-
-            for i, row in enumerate(ws.rows):
-
-                # Collect column titles from Excel file.
-                # With this column order is not important
-
-                if i == 0:
-                    titles = {}
-                    for row_number, title in enumerate(row):
-                        titles[title.value] = row_number
-
-                else:
-
-                    if id_is_valid(row[titles[excel_titles['id']]]):
-
-                        # Article info
-
-                        article.id = str(row[titles[excel_titles['id']]].value)
-                        article.doi = str(
-                            row[titles[excel_titles['doi']]].value)
-                        article.rubric = str(
-                            row[titles[excel_titles['rubric']]].value)
-
-                        article.title['ru'] = str(
-                            row[titles[excel_titles['title_ru']]].value)
-                        article.title['en'] = str(
-                            row[titles[excel_titles['title_en']]].value)
-
-                        article.abstract['ru'] = str(
-                            row[titles[excel_titles['abstract_ru']]].value)
-                        article.abstract['en'] = str(
-                            row[titles[excel_titles['abstract_en']]].value)
-
-                        article.authors_list['ru'] = str(
-                            row[titles[excel_titles['authors_list_ru']]].value).split(', ')
-                        article.authors_list['en'] = str(
-                            row[titles[excel_titles['authors_list_en']]].value).split(', ')
-
-                        article.authors_info['ru'] = str(
-                            row[titles[excel_titles['authors_info_ru']]].value)
-                        article.authors_info['en'] = str(
-                            row[titles[excel_titles['authors_info_en']]].value)
-
-                        article.keywords['ru'] = str(
-                            row[titles[excel_titles['keywords_ru']]].value).split(', ')
-                        article.keywords['en'] = str(
-                            row[titles[excel_titles['keywords_en']]].value).split(', ')
-
-                        article.references['ru'] = str(
-                            row[titles[excel_titles['references_ru']]].value).split('\n')
-                        article.references['en'] = str(
-                            row[titles[excel_titles['references_en']]].value).split('\n')
-
-                        print(str(row[titles[excel_titles['id']]].value))
-                        try:
-                            article.pages['first'] = int(
-                                str(row[titles[excel_titles['pages']]].value).split(' ')[0])
-                        except:
-                            article.pages['first'] = None
-                        try:
-                            article.pages['last'] = int(
-                                str(row[titles[excel_titles['pages']]].value).split(' ')[1])
-                        except:
-                            article.pages['last'] = None
-
-                        # Journal info
-
-                        article.journal['eISSN'] = article.id.split('-')[0]
-                        article.journal['volume'] = int(
-                            row[titles[excel_titles['volume']]].value)
-                        article.journal['year'] = int(article.id.split('-')[1])
-                        article.journal['month'] = int(
-                            row[titles[excel_titles['month']]].value)
-                        article.journal['issue'] = int(
-                            article.id.split('-')[2])
-
-                        query = {
-                            "_id": article.id,
-                            "doi": article.doi,
-
-                            "journal": {
-                                "eISSN": article.journal['eISSN'],
-                                "volume": article.journal['volume'],
-                                "year": article.journal['year'],
-                                "month": article.journal['month'],
-                                "issue": article.journal['issue']
-                            },
-
-                            "title": {
-                                "ru": article.title['ru'],
-                                "en": article.title['en']
-                            },
-
-                            "authors_list": {
-                                "ru": article.authors_list['ru'],
-                                "en": article.authors_list['en']
-                            },
-
-                            "authors_info": {
-                                "ru": article.authors_info['ru'],
-                                "en": article.authors_info['en']
-                            },
-
-                            "abstract": {
-                                "ru": article.abstract['ru'],
-                                "en": article.abstract['en']
-                            },
-
-                            "rubric": article.rubric,
-
-                            "keywords": {
-                                "ru": article.keywords['ru'],
-                                "en": article.keywords['en']
-                            },
-
-                            "references": {
-                                "ru": article.references['ru'],
-                                "en": article.references['en']
-                            },
-                            "pages": {
-                                "first": article.pages['first'],
-                                "last": article.pages['last']
-                            },
-
-                            "flags": {
-                                "crossref_xml_generated": False,
-                                "drupal_json_generated": False
-                            }
-                        }
-
-                        collection.replace_one(
-                            {"_id": article.id}, query, upsert=True)
-
-            # Move parsed file into 'Trash' directory
+    if not force:
+        for file in [file for file in files if hashes[file] in manifest]:
+            files.remove(file)
             rename(incoming_dir + "/" + file, incoming_dir +
                    "/" + trash_dir + "/" + file)
-
-            logstring = file + " has been exported to MongoDB"
-            logging.info(logstring)
-
+            logging.info(file + " has not changed since the last import")
+
+    # Interrupted exports are replayed from the first row
+    if restart and not staging_dir:
+        for file in files:
+            clear_checkpoint(hashes[file])
+
+    # An article found in several files is written only once
+    with timed("index"):
+        duplicates, winners = duplicate_rows(files, incoming_dir)
+
+    def finish(file: str, counts: dict) -> None:
+        # Staged files get into the manifest when their dumps are loaded
+        if not staging_dir:
+            add_to_manifest(manifest, hashes[file], file, counts)
+            save_manifest(manifest)
+            clear_checkpoint(hashes[file])
+
+        # Move parsed file into 'Trash' directory
+        rename(incoming_dir + "/" + file, incoming_dir +
+               "/" + trash_dir + "/" + file)
+
+        if staging_dir:
+            logstring = (file + " has been staged into " + staging_dir +
+                         ". Articles: " + str(counts["inserted"]) + ".")
+        else:
+            logstring = (file + " has been exported to MongoDB. " +
+                         format_counts(counts))
+        logging.info(logstring)
+
+    succeeded = set()
+    deferred = []
+    for file, result, error in map_files(export_file, files,
+                                         (incoming_dir, batch_size, writers,
+                                          duplicates, staging_dir,
+                                          staging_format, near_duplicates),
+                                         workers):
+
+        # Keep the file in place if it has failed or any of
+        # its batches has not been acknowledged
+        if error:
+            logging.error(file + " has not been exported to MongoDB: " +
+                          error)
+            continue
+
+        counts, failed = result
+        if failed:
+            log_failed(file, failed)
+            continue
+
+        succeeded.add(file)
+        if file in winners:
+            deferred.append((file, counts))
+        else:
+            finish(file, counts)
+
+    # Files with rows left to other files are finished only
+    # after those files, otherwise their rows would be lost
+    for file, counts in deferred:
+        waiting = unsettled(file, winners, succeeded)
+        if waiting:
+            clear_checkpoint(hashes[file])
+            logging.error(file + " is kept in " + incoming_dir +
+                          ": its duplicate rows have not been written "
+                          "from " + ", ".join(waiting))
+        else:
+            finish(file, counts)
 
 if __name__ == "__main__":
-    export_to_mongo()
+    arg_parser = argparse.ArgumentParser(
+        description='Export corrected XLSX files to MongoDB')
+    arg_parser.add_argument('--batch-size',
+                            type=int,
+                            default=DEFAULT_BATCH_SIZE,
+                            help='Number of articles sent to MongoDB at once')
+    arg_parser.add_argument('--workers',
+                            type=int,
+                            default=1,
+                            help='Number of files processed in parallel')
+    arg_parser.add_argument('--force',
+                            action='store_true',
+                            help='Export files even if they have already '
+                                 'been imported without changes')
+    arg_parser.add_argument('--restart',
+                            action='store_true',
+                            help='Export interrupted files from the first '
+                                 'row instead of their checkpoints')
+    add_writers_argument(arg_parser)
+    add_stage_arguments(arg_parser)
+    add_near_duplicates_argument(arg_parser)
+    add_profile_argument(arg_parser)
+    arguments = arg_parser.parse_args()
+
+    with instrumented_run('export_from_XLSX_to_mongo', arguments.profile):
+        export_to_mongo(arguments.batch_size, arguments.workers,
+                        arguments.force, arguments.writers,
+                        arguments.restart, arguments.stage,
+                        arguments.stage_format, arguments.near_duplicates)
@@ -1,10 +1,23 @@
 import sys
-from os import environ
 import argparse
+from glob import glob
 import xml.etree.ElementTree as ET
 import json
-from pymongo import MongoClient
-from transliterate import translit, get_available_language_codes
+from itertools import islice
+from pymongo import UpdateOne, ASCENDING
+from transliteration_module import translit_ru_list
+from mongo_module import (DEFAULT_BATCH_SIZE, upsert_in_batches, new_counts,
+                          add_writers_argument, get_database)
+from manifest_module import (file_hash, load_manifest, save_manifest,
+                             add_to_manifest, format_counts,
+                             load_checkpoint, save_checkpoint,
+                             clear_checkpoint)
+from article_schema import article, page_number
+from staging_module import StagingCollection, dump_path, add_stage_arguments
+from near_duplicates_module import (flag_near_duplicates,
+                                    add_near_duplicates_argument)
+from metrics_module import (timed, timed_iter, file_scope, add_file,
+                            instrumented_run, add_profile_argument)
 
 def strip_strings_in_dict(obj):
     for key in obj:
@@ -14,159 +27,380 @@ def strip_strings_in_dict(obj):
         if type(obj[key]) == str:
             obj[key] = obj[key].strip()
 
-def convert_xml_to_json(xml_file):
+def text_of(fields, tag):
+    """Text of a field element, None if there is no such element"""
+    element = fields.get(tag)
+    return element.text if element is not None else None
 
-    tree = ET.parse(xml_file)
+def items_of(fields, tag):
+    """Texts of <item> elements of a list field, None if the list is empty"""
+    element = fields.get(tag)
+    return [item.text for item in element] if element is not None and len(element) else None
 
-    root = tree.getroot()
+# Issue-level fields every XML file must have
+HEADER_FIELDS = ('year', 'issue', 'volume', 'issn', 'date')
 
-    try:
-        year = root.find('year').text
-        issue = root.find('issue').text.zfill(2)
-        volume = root.find('volume').text
-        eissn = root.find('issn').text.replace('-','')
-        month = root.find('date').text
-    except :
-        print('Missing critical fields')
-        exit(1)
+def iter_articles(xml_file):
+    """Yield article documents from the XML file one by one.
+       The file is parsed incrementally and every <Article> element
+       is dropped as soon as its document is built. ValueError is raised
+       if issue-level fields are missing or cannot be parsed"""
+
+    header = {}
+    depth = 0
+    counter = 0
+
+    for event, element in ET.iterparse(xml_file, events=('start', 'end')):
+
+        if event == 'start':
+            depth += 1
+            if depth == 1:
+                root = element
+
+            # Issue-level fields precede the articles
+            elif depth == 2 and element.tag == 'Article' and counter == 0:
+                missing = [tag for tag in HEADER_FIELDS
+                           if tag not in header or not header[tag].text
+                           or not header[tag].text.strip()]
+                if missing:
+                    raise ValueError('Missing critical fields: ' +
+                                     ', '.join(missing))
+                year = header['year'].text.strip()
+                issue = header['issue'].text.strip().zfill(2)
+                eissn = header['issn'].text.strip().replace('-','')
+                date = header['date'].text.strip()
+                try:
+                    numbers = (int(header['volume'].text), int(year),
+                               int(date.split('.')[1]), int(issue))
+                except (ValueError, IndexError):
+                    raise ValueError('Invalid critical fields: volume "' +
+                                     header['volume'].text + '", year "' +
+                                     year + '", issue "' + issue +
+                                     '", date "' + date + '"')
+            continue
+
+        depth -= 1
+        if depth != 1:
+            continue
+
+        if element.tag != 'Article':
+            header.setdefault(element.tag, element)
+            continue
+
+        counter += 1
+
+        # Child elements by tag, so every field is looked up once
+        fields = {}
+        for child in element:
+            fields.setdefault(child.tag, child)
+
+        record = article()
+
+        record.id = '-'.join([eissn, year, issue, str(counter).zfill(2)])
+        record.doi = text_of(fields, 'doi')
+        record.title_ru = text_of(fields, 'title_ru')
+        record.title_en = text_of(fields, 'title_en')
+
+        record.authors_list_ru = items_of(fields, 'authors_list_ru')
+        record.authors_list_en = items_of(fields, 'authors_list_en')
 
-    articles = []
-
-    for counter, article in enumerate(root.findall('Article'), 1):
-
-        id = '-'.join([eissn, year, issue, str(counter).zfill(2)])
-        doi = article.find('doi').text if article.find('doi') != None else None
-        title_ru = article.find('title_ru').text if article.find('title_ru') != None else None
-        title_en = article.find('title_en').text if article.find('title_en') != None else None
-     
-        authors_list_ru = [item.text for item in article.find('authors_list_ru') ] if article.find('authors_list_ru') else None
-        authors_list_en = [item.text for item in article.find('authors_list_en') ] if article.find('authors_list_en') else None
-
-        authors_info_ru = article.find('authors_info_ru').text if article.find('authors_info_ru') != None else None
-        authors_info_en = article.find('authors_info_en').text if article.find('authors_info_en') != None else None
-
-        abstract_ru = article.find('abstract_ru').text if article.find('abstract_ru') != None else None
-        abstract_en = article.find('abstract_en').text if article.find('abstract_en') != None else None
-         
-        rubric = article.find('rubric_ru').text.upper() if article.find('rubric_ru') != None else None
-
-        keywords_ru = [item.text for item in article.find('keywords_ru') ] if article.find('keywords_ru') else None
-        keywords_en = [item.text for item in article.find('keywords_en') ] if article.find('keywords_en') else None
-
-        references_ru = [item.text for item in article.find('references_ru') ] if article.find('references_ru') else None
-        references_en = [item.text for item in article.find('references_en') ] if article.find('references_en') else None
-        
-        first_page = article.find('first_page').text if article.find('first_page') != None else None
-        last_page = article.find('last_page').text if article.find('last_page') != None else None
-
-        buffer = {"_id" : id,
-                  "doi": doi,
-                  "journal": {
-                        "eISSN": eissn,
-                        "volume": int ( volume ),
-                        "year": int ( year ),
-                        "month": int ( month.split('.')[1] ),
-                        "issue": int ( issue )
-                   },
-
-                  "title": { "ru": title_ru,
-                             "en": title_en 
-                     },
-
-                  "authors_list": {
-                        "ru": authors_list_ru,
-                        "en": authors_list_en
-                    },
-
-                  "authors_info": {
-                        "ru": authors_info_ru,
-                        "en": authors_info_en
-                    },
-
-                  "abstract": {
-                        "ru": abstract_ru,
-                        "en": abstract_en
-                    },
-
-                  "rubric": rubric,
-
-                  "keywords": {
-                      "ru": keywords_ru,
-                      "en": keywords_en
-                    },
-     
-                   "references": {
-                       "ru": references_ru,
-                       "en": references_en
-                    },
-                    
-                    "pages": {
-                        "first": first_page,
-                        "last": last_page 
-                    },
-
-                    "flags": {
-                        "crossref_xml_generated": False,
-                    }
-                }
+        record.authors_info_ru = text_of(fields, 'authors_info_ru')
+        record.authors_info_en = text_of(fields, 'authors_info_en')
 
+        record.abstract_ru = text_of(fields, 'abstract_ru')
+        record.abstract_en = text_of(fields, 'abstract_en')
 
+        record.rubric = fields['rubric_ru'].text.upper() if 'rubric_ru' in fields else None
+
+        record.keywords_ru = items_of(fields, 'keywords_ru')
+        record.keywords_en = items_of(fields, 'keywords_en')
+
+        record.references_ru = items_of(fields, 'references_ru')
+        record.references_en = items_of(fields, 'references_en')
+
+        record.first_page = page_number(text_of(fields, 'first_page'))
+        record.last_page = page_number(text_of(fields, 'last_page'))
+
+        record.eissn = eissn
+        record.volume, record.year, record.month, record.issue = numbers
+
+        # The article is not needed anymore
+        root.remove(element)
+
+        buffer = record.to_document()
         strip_strings_in_dict(buffer)    
-        articles.append(buffer) 
-    return articles
-
-def export_to_mongo(collection, payload) -> None:
-    
-    for article in payload:
-        collection.replace_one(
-            {"_id": article["_id"]}, article, upsert=True)
-
-def fill_english_references(collection):
-    collection.update_many({'references.ru.0': 'None'}, {
-                           '$set': {'references.ru': None}})
-    collection.update_many({'references.en.0': 'None'}, {
-                           '$set': {'references.en': None}})
-    articles = collection.find({'references.en': None})
-    print('Found')
-    for article in articles:
-        if article['references']['ru']:
-            transliterated_list = [translit(
-                item, 'ru', reversed=True) for item in article['references']['ru']]
-            collection.update_one({'_id': article['_id']}, {
-                                  '$set': {'references.en': transliterated_list}})
-
-def fill_english_authors(collection):
-    collection.update_many({'authors_list.ru.0': 'None'}, {
-                           '$set': {'authors_list.ru': None}})
-    collection.update_many({'authors_list.en.0': 'None'}, {
-                           '$set': {'authors_list.en': None}})
-    articles = collection.find({'authors_list.en': None})
-    print('Found')
-    for article in articles:
-        if article['authors_list']['ru']:
-            transliterated_list = [translit(
-                item, 'ru', reversed=True) for item in article['authors_list']['ru']]
-            collection.update_one({'_id': article['_id']}, {
-                                  '$set': {'authors_list.en': transliterated_list}})
-   
+        yield buffer
 
-def main():
-    mongo_conection_string = environ['MONGO_DEV_URI']
-    client = MongoClient(mongo_conection_string)
-    db = client.rvph
-    collection = db.articles
+def convert_xml_to_json(xml_file, lazy=False):
+    """Return article documents from the XML file as a list,
+       or as a generator if 'lazy' is set"""
+    articles = iter_articles(xml_file)
+    return articles if lazy else list(articles)
+
+def export_to_mongo(collection, payload, batch_size=DEFAULT_BATCH_SIZE,
+                    counts=None, writers=0, committed=None, written=None):
+    """Upsert new and changed articles from any iterable in batches,
+       return a list of (_id, reason) pairs for failed articles.
+       With writer threads batches are written while parsing goes on.
+       'committed' is called with the number of articles written so far,
+       'written' with the new and changed articles of every batch"""
+    return upsert_in_batches(collection, timed_iter('parse', payload),
+                             batch_size, counts, writers, committed, written)
+
+def fill_english_list(collection, field, ids=None,
+                      batch_size=DEFAULT_BATCH_SIZE):
+    """Fill an empty English list of 'field' with the transliterated
+       Russian one. Only articles with '_id' in 'ids' are updated,
+       or the whole collection if 'ids' is None. Updates are sent
+       as unordered bulk writes of 'batch_size'"""
+
+    if ids is None:
+        # A partial index holds only the articles still waiting
+        # for their English list, so they are found without a scan.
+        # The query has to repeat the filter of the index to use it
+        missing = {field + '.en': {'$type': 'null'}}
+        collection.create_index([(field + '.en', ASCENDING)],
+                                name=field + '_en_missing',
+                                partialFilterExpression=missing)
+        scopes = [{}]
+    else:
+        missing = {field + '.en': None}
+        ids = list(ids)
+        scopes = [{'_id': {'$in': ids[start:start + batch_size]}}
+                  for start in range(0, len(ids), batch_size)]
+
+    for scope in scopes:
+        collection.update_many(dict(scope, **{field + '.ru.0': 'None'}),
+                               {'$set': {field + '.ru': None}})
+        collection.update_many(dict(scope, **{field + '.en.0': 'None'}),
+                               {'$set': {field + '.en': None}})
+
+        documents = collection.find(dict(scope, **missing),
+                                    {field + '.ru': True})
+        requests = []
+        for document in documents:
+            if document[field]['ru']:
+                requests.append(UpdateOne(
+                    {'_id': document['_id']},
+                    {'$set': {field + '.en':
+                              translit_ru_list(document[field]['ru'])}}))
+            if len(requests) >= batch_size:
+                collection.bulk_write(requests, ordered=False)
+                requests = []
+        if requests:
+            collection.bulk_write(requests, ordered=False)
 
-    arg_parser = argparse.ArgumentParser(description='Provide a file to parse')
-    arg_parser.add_argument('file',
+def fill_english_references(collection, ids=None,
+                            batch_size=DEFAULT_BATCH_SIZE):
+    fill_english_list(collection, 'references', ids, batch_size)
+
+def fill_english_authors(collection, ids=None, batch_size=DEFAULT_BATCH_SIZE):
+    fill_english_list(collection, 'authors_list', ids, batch_size)
+
+def fill_english_document(document):
+    """Do for a single document what fill_english_references and
+       fill_english_authors do in MongoDB, used for staged documents"""
+    for field in ('references', 'authors_list'):
+        lists = document[field]
+        for language in ('ru', 'en'):
+            if lists[language] and lists[language][0] == 'None':
+                lists[language] = None
+        if lists['en'] is None and lists['ru']:
+            lists['en'] = translit_ru_list(lists['ru'])
+
+def remember_ids(documents, ids):
+    """Yield documents, adding their '_id' to the 'ids' list"""
+    for document in documents:
+        ids.append(document['_id'])
+        yield document
+
+def checkpoint_saver(digest, file, start):
+    """Callback saving the number of the last written article
+       of a file as its checkpoint"""
+    def committed(written):
+        save_checkpoint(digest, file, start + written)
+    return committed
+
+def expand_patterns(patterns):
+    """Patterns are expanded here as well, so they work without a shell"""
+    files = []
+    for pattern in patterns:
+        files += sorted(glob(pattern)) or [pattern]
+    return files
+
+def export_files(collection, patterns, batch_size=DEFAULT_BATCH_SIZE,
+                 force=False, writers=0, restart=False,
+                 near_duplicates=False):
+    """Export XML files to MongoDB, files already imported
+       without changes are skipped unless 'force' is set.
+       An interrupted file is resumed after the last article
+       of its checkpoint unless 'restart' is set. With
+       'near_duplicates' possible duplicates of the articles are logged.
+       A file that cannot be read is skipped and reported as (None, reason).
+       Return a list of (_id, reason) pairs for failed articles"""
+
+    files = expand_patterns(patterns)
+    manifest = load_manifest()
+    failed = []
+
+    # English lists are filled only for the articles of this run
+    ids = []
+
+    for file in files:
+
+        # Skip the file if it has already been imported with the same content
+        digest = file_hash(file)
+        if digest in manifest and not force:
+            print(file + ' has not changed since the last import')
+            continue
+
+        if restart:
+            clear_checkpoint(digest)
+        start = load_checkpoint(digest)
+        if start:
+            print(file + ' is resumed after article ' + str(start))
+
+        # Articles are parsed lazily and written batch by batch,
+        # unchanged ones are not sent at all. Articles written before
+        # the checkpoint are parsed but not sent, their English lists
+        # are still filled
+        counts = new_counts()
+        try:
+            with file_scope() as stats:
+                file_failed = export_to_mongo(collection,
+                                              islice(remember_ids(
+                                                  convert_xml_to_json(
+                                                      file, lazy=True), ids),
+                                                  start, None),
+                                              batch_size,
+                                              counts,
+                                              writers,
+                                              checkpoint_saver(digest, file,
+                                                               start),
+                                              flag_near_duplicates
+                                              if near_duplicates else None)
+        except (ValueError, ET.ParseError) as error:
+            print(file + ' has not been exported: ' + str(error))
+            failed.append((None, str(error)))
+            continue
+        add_file(file, stats)
+        for article_id, reason in file_failed:
+            print('Article ' + str(article_id) + ' has not been exported: ' + reason)
+        print(file + ': ' + format_counts(counts))
+
+        if not file_failed:
+            add_to_manifest(manifest, digest, file, counts)
+            save_manifest(manifest)
+            clear_checkpoint(digest)
+        failed += file_failed
+
+    with timed('fill_references', len(ids)):
+        fill_english_references(collection, ids, batch_size)
+    with timed('fill_authors', len(ids)):
+        fill_english_authors(collection, ids, batch_size)
+
+    return failed
+
+def stage_files(patterns, staging_dir, staging_format='bson',
+                batch_size=DEFAULT_BATCH_SIZE, writers=0):
+    """Write articles of XML files into local dumps instead of MongoDB.
+       English lists are filled in every document before it is staged.
+       Return a list of (_id, reason) pairs for failed articles,
+       with (None, reason) for a file that cannot be read"""
+    failed = []
+    for file in expand_patterns(patterns):
+        dump = dump_path(staging_dir, file, staging_format)
+        collection = StagingCollection(dump, fill_english_document)
+        counts = new_counts()
+        file_failed = None
+        try:
+            with file_scope() as stats:
+                try:
+                    file_failed = export_to_mongo(collection,
+                                                  convert_xml_to_json(
+                                                      file, lazy=True),
+                                                  batch_size,
+                                                  counts,
+                                                  writers)
+                finally:
+                    collection.close(keep=file_failed == [])
+        except (ValueError, ET.ParseError) as error:
+            print(file + ' has not been staged: ' + str(error))
+            failed.append((None, str(error)))
+            continue
+        add_file(file, stats)
+        print(file + ' -> ' + dump + ': ' + str(counts['inserted']) +
+              ' articles')
+        failed += file_failed
+    return failed
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Provide files to parse')
+    arg_parser.add_argument('files',
                             metavar='file',
                             type=str,
-                            help='A file to parse')
+                            nargs='*',
+                            help='Files or glob patterns (e.g. "xml/*.xml") '
+                                 'to parse')
+    arg_parser.add_argument('--batch-size',
+                            type=int,
+                            default=DEFAULT_BATCH_SIZE,
+                            help='Number of articles sent to MongoDB at once')
+    arg_parser.add_argument('--force',
+                            action='store_true',
+                            help='Export files even if they have already '
+                                 'been imported without changes')
+    arg_parser.add_argument('--fill-all',
+                            action='store_true',
+                            help='Fill empty English references and authors '
+                                 'of the whole collection, not only of '
+                                 'the exported files')
+    arg_parser.add_argument('--restart',
+                            action='store_true',
+                            help='Export interrupted files from the first '
+                                 'article instead of their checkpoints')
+    add_writers_argument(arg_parser)
+    add_stage_arguments(arg_parser)
+    add_near_duplicates_argument(arg_parser)
+    add_profile_argument(arg_parser)
     arguments = arg_parser.parse_args()
 
-    articles_in_json = convert_xml_to_json(arguments.file)
-    export_to_mongo(collection, articles_in_json)
-    fill_english_references(collection)
-    fill_english_authors(collection)
+    if not arguments.files and not arguments.fill_all:
+        arg_parser.error('no files to parse')
+    if arguments.stage and arguments.fill_all:
+        arg_parser.error('--fill-all needs MongoDB, not a staging directory')
+
+    # Staging works without MongoDB
+    if arguments.stage:
+        with instrumented_run('export_from_XML_to_mongo', arguments.profile):
+            failed = stage_files(arguments.files, arguments.stage,
+                                 arguments.stage_format,
+                                 arguments.batch_size, arguments.writers)
+        if failed:
+            exit(1)
+        return
+
+    collection = get_database().articles
+
+    with instrumented_run('export_from_XML_to_mongo', arguments.profile):
+        failed = []
+        if arguments.files:
+            failed = export_files(collection, arguments.files,
+                                  arguments.batch_size, arguments.force,
+                                  arguments.writers, arguments.restart,
+                                  arguments.near_duplicates)
+
+        # One-off migration of the articles imported before
+        # the English lists were filled per run
+        if arguments.fill_all:
+            with timed('fill_references'):
+                fill_english_references(collection, None,
+                                        arguments.batch_size)
+            with timed('fill_authors'):
+                fill_english_authors(collection, None, arguments.batch_size)
+
+    if failed:
+        exit(1)
 
 if __name__ == "__main__":
     main()
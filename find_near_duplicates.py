@@ -0,0 +1,154 @@
+# Find near-duplicate articles in the whole collection.
+# Articles are added to the MinHash index of near_duplicates_module
+# incrementally: only those not indexed yet or changed since they were
+# indexed are read into signatures, so a run after an import costs
+# about as much as the new articles. The pairs found so far are
+# written into a CSV report to be checked by hand
+
+import argparse
+import csv
+import logging
+from mongo_module import DEFAULT_BATCH_SIZE, get_database
+from near_duplicates_module import index_articles
+from metrics_module import instrumented_run, add_profile_argument, timed
+
+REPORT_FIELDS = ("first", "second", "similarity",
+                 "first_title", "second_title", "found")
+
+# Fields signatures are built from
+TEXT_FIELDS = ("title", "abstract", "keywords", "content_hash")
+
+
+def index_batch(db: 'Mongo database', batch: list) -> tuple:
+    """Index articles of a batch which have changed since they were
+       indexed, that is whose hash differs from the one stored with
+       the signature. An article without a hash is indexed once,
+       as after a failed import its hash is cleared.
+       Return numbers of indexed articles and of pairs found"""
+    with timed("minhash_check", len(batch)):
+        indexed = {item["_id"]: item.get("content_hash") for item in
+                   db.minhash_signatures.find(
+                       {"_id": {"$in": [article["_id"]
+                                        for article in batch]}},
+                       {"content_hash": True})}
+    changed = [article for article in batch
+               if article["_id"] not in indexed or
+               indexed[article["_id"]] != article.get("content_hash")]
+    if not changed:
+        return 0, 0
+    return len(changed), len(index_articles(db, changed))
+
+
+def index_collection(db: 'Mongo database',
+                     batch_size: int = DEFAULT_BATCH_SIZE,
+                     rebuild: bool = False) -> tuple:
+    """Bring the index up to date with the 'articles' collection.
+       With 'rebuild' it is built again from scratch.
+       Return numbers of indexed articles and of pairs found"""
+    if rebuild:
+        db.minhash_bands.drop()
+        db.minhash_signatures.drop()
+        db.near_duplicates.drop()
+    db.near_duplicates.create_index("ids")
+
+    indexed = found = 0
+    batch = []
+    for article in db.articles.find({}, {field: True
+                                         for field in TEXT_FIELDS},
+                                    batch_size=batch_size):
+        batch.append(article)
+        if len(batch) >= batch_size:
+            batch_indexed, batch_found = index_batch(db, batch)
+            indexed += batch_indexed
+            found += batch_found
+            batch = []
+    if batch:
+        batch_indexed, batch_found = index_batch(db, batch)
+        indexed += batch_indexed
+        found += batch_found
+    return indexed, found
+
+
+def near_duplicate_report(db: 'Mongo database',
+                          min_similarity: float = 0) -> list:
+    """Pairs of the index with their titles, most similar first"""
+    pairs = list(db.near_duplicates.find(
+        {"similarity": {"$gte": min_similarity}}))
+    ids = list({_id for pair in pairs for _id in pair["ids"]})
+    titles = {}
+    for article in db.articles.find({"_id": {"$in": ids}}, {"title": True}):
+        title = article.get("title") or {}
+        titles[article["_id"]] = title.get("ru") or title.get("en")
+
+    report = []
+    for pair in sorted(pairs, key=lambda pair: (-pair["similarity"],
+                                                pair["_id"])):
+        first, second = pair["ids"]
+        report.append({"first": first, "second": second,
+                       "similarity": round(pair["similarity"], 2),
+                       "first_title": titles.get(first),
+                       "second_title": titles.get(second),
+                       "found": pair.get("found")})
+    return report
+
+
+def write_report(report: list, report_file: str) -> None:
+    """Write the report as CSV readable by Excel"""
+    with open(report_file, 'w', encoding='utf-8-sig', newline='') as output:
+        writer = csv.DictWriter(output, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(report)
+
+
+def find_near_duplicates(batch_size: int = DEFAULT_BATCH_SIZE,
+                         rebuild: bool = False,
+                         report_file: str = 'near_duplicates.csv',
+                         min_similarity: float = 0) -> int:
+    """Update the index and write the report. Return number of pairs"""
+
+    # setup logging
+    logging.basicConfig(filename='app.log',
+                        level=logging.INFO,
+                        format='%(asctime)s | %(levelname)s | %(message)s',
+                        datefmt='%d/%m/%Y %H:%M:%S')
+
+    logging.info("### Near-duplicate search started")
+
+    db = get_database()
+    indexed, found = index_collection(db, batch_size, rebuild)
+    report = near_duplicate_report(db, min_similarity)
+    write_report(report, report_file)
+
+    logging.info("Near-duplicate index updated. Articles indexed: " +
+                 str(indexed) + ". Pairs found: " + str(found) +
+                 ". Pairs in the index: " + str(len(report)) + ".")
+    print(str(indexed) + ' articles indexed, ' + str(len(report)) +
+          ' pairs, see ' + report_file)
+    return len(report)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Find near-duplicate articles stored under different IDs')
+    arg_parser.add_argument('--batch-size',
+                            type=int,
+                            default=DEFAULT_BATCH_SIZE,
+                            help='Number of articles indexed at once')
+    arg_parser.add_argument('--rebuild',
+                            action='store_true',
+                            help='Drop the index and build it again '
+                                 'from the whole collection')
+    arg_parser.add_argument('--report',
+                            default='near_duplicates.csv',
+                            help='CSV report of the pairs')
+    arg_parser.add_argument('--min-similarity',
+                            type=float,
+                            default=0,
+                            help='Lowest estimated similarity of a pair '
+                                 'in the report')
+    add_profile_argument(arg_parser)
+    arguments = arg_parser.parse_args()
+
+    with instrumented_run('find_near_duplicates', arguments.profile):
+        find_near_duplicates(arguments.batch_size, arguments.rebuild,
+                             arguments.report, arguments.min_similarity)
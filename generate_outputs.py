@@ -0,0 +1,362 @@
+# Generate Crossref deposit XML and Drupal JSON for the articles
+# that have not been published yet, as marked by their flags.
+# Articles are streamed from MongoDB and written to disk one by one,
+# so memory use does not depend on the number of articles.
+# Flags are set only after the output file has been written completely
+
+from datetime import datetime
+from os import path, makedirs, remove, replace
+import argparse
+import json
+import logging
+import xml.etree.ElementTree as ET
+from pymongo import ASCENDING
+from mongo_module import DEFAULT_BATCH_SIZE, get_database
+from textprocessing_module import present
+from metrics_module import instrumented_run, add_profile_argument, timed
+
+CROSSREF_NAMESPACE = "http://www.crossref.org/schema/4.4.2"
+CROSSREF_SCHEMA = ("http://www.crossref.org/schema/4.4.2 "
+                   "http://www.crossref.org/schemas/crossref4.4.2.xsd")
+
+# Flag and fields read from MongoDB by output
+OUTPUTS = {
+    "crossref": {
+        "flag": "flags.crossref_xml_generated",
+        "fields": ("doi", "journal", "title", "authors_list",
+                   "pages", "references")
+    },
+    "drupal": {
+        "flag": "flags.drupal_json_generated",
+        "fields": ("doi", "journal", "title", "authors_list",
+                   "authors_info", "abstract", "keywords", "rubric",
+                   "pages", "references")
+    }
+}
+
+
+def unflagged_articles(collection: 'Mongo collection', flag: str,
+                       query: dict, fields: tuple,
+                       batch_size: int) -> 'Cursor':
+    """Stream articles with the flag not set yet in '_id' order.
+       A partial index holds only such articles, so it shrinks
+       as they are flagged and gives the order without a sort in memory"""
+    order = [(flag, ASCENDING), ("_id", ASCENDING)]
+    collection.create_index(order,
+                            name=flag.replace('.', '_') + '_pending',
+                            partialFilterExpression={flag: False})
+    return collection.find(dict(query, **{flag: False}),
+                           {field: True for field in fields},
+                           batch_size=batch_size).sort(order)
+
+
+def journal_of(db: 'Mongo database', eissn: str, cache: dict) -> dict:
+    """Journal info by eISSN, read from MongoDB once per journal.
+       Missing journals are cached as empty dicts"""
+    if eissn not in cache:
+        journal = db.journal_info.find_one({"_id": eissn})
+        if journal is None:
+            journal = db.journal_info.find_one(
+                {"_id": eissn[:4] + '-' + eissn[4:]})
+        cache[eissn] = journal or {}
+    return cache[eissn]
+
+
+def person_name(author: str) -> tuple:
+    """Split an author of a short list into (given name, surname).
+       Both 'Ivanov I.I.' and 'I.I. Ivanov' orders are recognized"""
+    parts = author.split(' ')
+    if len(parts) > 1 and parts[0].endswith('.'):
+        return ' '.join(parts[:-1]), parts[-1]
+    return ' '.join(parts[1:]), parts[0]
+
+
+def sub_element(parent: 'Element', tag: str, text: 'Value' = None,
+                **attributes) -> 'Element':
+    element = ET.SubElement(parent, tag, attributes)
+    if text is not None:
+        element.text = str(text)
+    return element
+
+
+def filled_items(values: list) -> list:
+    """Filled items of a list field, an empty list if there are none"""
+    return [value for value in values or [] if present(value)]
+
+
+def crossref_problems(article: dict, journal: dict) -> list:
+    """Fields a deposit of the article cannot go without"""
+    problems = []
+    if not present(article["doi"]):
+        problems.append("DOI")
+    if not present(article["title"]["en"]) and \
+            not present(article["title"]["ru"]):
+        problems.append("title")
+    if not present(journal.get("site")):
+        problems.append("journal site")
+    for field in ("volume", "issue", "month", "year"):
+        if not present(article["journal"].get(field)):
+            problems.append(field)
+    return problems
+
+
+def crossref_journal(article: dict, journal: dict) -> 'Element':
+    """<journal> element of a deposit with a single article.
+       The article must have no crossref_problems"""
+    info = article["journal"]
+    eissn = info["eISSN"]
+
+    element = ET.Element("journal")
+
+    metadata = sub_element(element, "journal_metadata", language="ru")
+    sub_element(metadata, "full_title", journal.get("title") or eissn)
+    sub_element(metadata, "issn", eissn[:4] + '-' + eissn[4:],
+                media_type="electronic")
+
+    issue = sub_element(element, "journal_issue")
+    date = sub_element(issue, "publication_date", media_type="online")
+    sub_element(date, "month", str(info["month"]).zfill(2))
+    sub_element(date, "year", info["year"])
+    volume = sub_element(issue, "journal_volume")
+    sub_element(volume, "volume", info["volume"])
+    sub_element(issue, "issue", info["issue"])
+
+    item = sub_element(element, "journal_article",
+                       publication_type="full_text")
+
+    title_en, title_ru = article["title"]["en"], article["title"]["ru"]
+    titles = sub_element(item, "titles")
+    sub_element(titles, "title", title_en if present(title_en) else title_ru)
+    if present(title_en) and present(title_ru):
+        sub_element(titles, "original_language_title", title_ru,
+                    language="ru")
+
+    authors = (filled_items(article["authors_list"]["en"]) or
+               filled_items(article["authors_list"]["ru"]))
+    if authors:
+        contributors = sub_element(item, "contributors")
+        for number, author in enumerate(authors):
+            given_name, surname = person_name(author)
+            person = sub_element(contributors, "person_name",
+                                 sequence="first" if number == 0
+                                 else "additional",
+                                 contributor_role="author")
+            if given_name:
+                sub_element(person, "given_name", given_name)
+            sub_element(person, "surname", surname)
+
+    date = sub_element(item, "publication_date", media_type="online")
+    sub_element(date, "month", str(info["month"]).zfill(2))
+    sub_element(date, "year", info["year"])
+
+    if article["pages"]["first"] is not None:
+        pages = sub_element(item, "pages")
+        sub_element(pages, "first_page", article["pages"]["first"])
+        if article["pages"]["last"] is not None:
+            sub_element(pages, "last_page", article["pages"]["last"])
+
+    doi_data = sub_element(item, "doi_data")
+    sub_element(doi_data, "doi", article["doi"])
+    sub_element(doi_data, "resource",
+                journal["site"].rstrip('/') + '/' + article["_id"])
+
+    references = filled_items(article["references"]["ru"])
+    if references:
+        citations = sub_element(item, "citation_list")
+        for number, reference in enumerate(references, 1):
+            citation = sub_element(citations, "citation",
+                                   key="ref" + str(number))
+            sub_element(citation, "unstructured_citation", reference)
+
+    return element
+
+
+def drupal_node(article: dict, journal: dict) -> dict:
+    """Drupal import record of an article"""
+    return {
+        "id": article["_id"],
+        "doi": article["doi"],
+        "journal": dict(article["journal"],
+                        title=journal.get("title"),
+                        site=journal.get("site")),
+        "rubric": article["rubric"],
+        "title": article["title"],
+        "authors_list": article["authors_list"],
+        "authors_info": article["authors_info"],
+        "abstract": article["abstract"],
+        "keywords": article["keywords"],
+        "pages": article["pages"],
+        "references": article["references"]
+    }
+
+
+def write_crossref(articles: 'Iterable', output: 'File',
+                   journal: 'Callable', depositor: str,
+                   email: str, started: datetime) -> list:
+    """Write a deposit file article by article. Articles without
+       a DOI, a title or a journal site are logged and left out.
+       Return '_id's of the written articles"""
+    ids = []
+    output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    output.write('<doi_batch version="4.4.2" xmlns="' + CROSSREF_NAMESPACE +
+                 '" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+                 ' xsi:schemaLocation="' + CROSSREF_SCHEMA + '">\n')
+
+    head = ET.Element("head")
+    sub_element(head, "doi_batch_id", started.strftime('%Y%m%d%H%M%S'))
+    sub_element(head, "timestamp", started.strftime('%Y%m%d%H%M%S'))
+    person = sub_element(head, "depositor")
+    sub_element(person, "depositor_name", depositor)
+    sub_element(person, "email_address", email)
+    sub_element(head, "registrant", depositor)
+    output.write(ET.tostring(head, encoding='unicode') + '\n<body>\n')
+
+    for article in articles:
+        info = journal(article["journal"]["eISSN"])
+        problems = crossref_problems(article, info)
+        if problems:
+            logging.warning('Article has not been deposited. ID: "' +
+                            article["_id"] + '". Missing: ' +
+                            ', '.join(problems))
+            continue
+        element = crossref_journal(article, info)
+        output.write(ET.tostring(element, encoding='unicode') + '\n')
+        ids.append(article["_id"])
+
+    output.write('</body>\n</doi_batch>\n')
+    return ids
+
+
+def write_drupal(articles: 'Iterable', output: 'File',
+                 journal: 'Callable') -> list:
+    """Write a JSON array of Drupal records one by one.
+       Return '_id's of the articles"""
+    ids = []
+    output.write('[')
+    for article in articles:
+        if ids:
+            output.write(',')
+        output.write('\n' + json.dumps(
+            drupal_node(article, journal(article["journal"]["eISSN"])),
+            ensure_ascii=False))
+        ids.append(article["_id"])
+    output.write('\n]\n')
+    return ids
+
+
+def set_flags(collection: 'Mongo collection', flag: str, ids: list,
+              batch_size: int) -> None:
+    """Set the flag of the articles in batches of 'batch_size'"""
+    for start in range(0, len(ids), batch_size):
+        collection.update_many(
+            {"_id": {"$in": ids[start:start + batch_size]}},
+            {"$set": {flag: True}})
+
+
+def generate(outputs: list, output_dir: str = "outputs",
+             eissn: str = None, year: int = None,
+             batch_size: int = DEFAULT_BATCH_SIZE,
+             depositor: str = "", email: str = "",
+             dry_run: bool = False) -> None:
+    """Write the outputs for articles not flagged yet and flag them.
+       A Crossref deposit needs the depositor email"""
+
+    if "crossref" in outputs and not email:
+        raise ValueError("The Crossref deposit needs a depositor email")
+
+    # setup logging
+    logging.basicConfig(filename='app.log',
+                        level=logging.INFO,
+                        format='%(asctime)s | %(levelname)s | %(message)s',
+                        datefmt='%d/%m/%Y %H:%M:%S')
+
+    db = get_database()
+    collection = db.articles
+    cache = {}
+
+    def journal(eissn: str) -> dict:
+        return journal_of(db, eissn, cache)
+
+    query = {}
+    if eissn:
+        query["journal.eISSN"] = eissn.replace('-', '')
+    if year:
+        query["journal.year"] = year
+
+    started = datetime.now()
+    stamp = started.strftime('%Y%m%d-%H%M%S')
+
+    if not path.exists(output_dir):
+        makedirs(output_dir)
+
+    for name in outputs:
+        flag = OUTPUTS[name]["flag"]
+        articles = unflagged_articles(collection, flag, query,
+                                      OUTPUTS[name]["fields"], batch_size)
+        file = output_dir + "/" + name + "-" + stamp + \
+            (".xml" if name == "crossref" else ".json")
+
+        # The file appears under its name only when it is complete
+        with timed("generate_" + name):
+            with open(file + ".tmp", 'w', encoding='utf-8') as output:
+                if name == "crossref":
+                    ids = write_crossref(articles, output, journal,
+                                         depositor, email, started)
+                else:
+                    ids = write_drupal(articles, output, journal)
+
+        if not ids:
+            remove(file + ".tmp")
+            print('No new articles for ' + name)
+            continue
+
+        replace(file + ".tmp", file)
+        print(file + ': ' + str(len(ids)) + ' articles')
+
+        if not dry_run:
+            with timed("flag_" + name, len(ids)):
+                set_flags(collection, flag, ids, batch_size)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Generate Crossref XML and Drupal JSON '
+                    'for new articles')
+    arg_parser.add_argument('outputs',
+                            nargs='*',
+                            choices=sorted(OUTPUTS),
+                            default=sorted(OUTPUTS),
+                            help='Outputs to generate, all by default')
+    arg_parser.add_argument('--output-dir',
+                            default='outputs',
+                            help='Directory for generated files')
+    arg_parser.add_argument('--eissn',
+                            help='Only articles of this journal')
+    arg_parser.add_argument('--year',
+                            type=int,
+                            help='Only articles of this year')
+    arg_parser.add_argument('--batch-size',
+                            type=int,
+                            default=DEFAULT_BATCH_SIZE,
+                            help='Number of articles read or flagged '
+                                 'at once')
+    arg_parser.add_argument('--depositor',
+                            default='Russkiy Vrach Publishing House',
+                            help='Depositor name of the Crossref deposit')
+    arg_parser.add_argument('--email',
+                            default='',
+                            help='Depositor email of the Crossref deposit, '
+                                 'required for "crossref"')
+    arg_parser.add_argument('--dry-run',
+                            action='store_true',
+                            help='Write files without setting the flags')
+    add_profile_argument(arg_parser)
+    arguments = arg_parser.parse_args()
+
+    if "crossref" in arguments.outputs and not arguments.email:
+        arg_parser.error('--email is required for the Crossref deposit')
+
+    with instrumented_run('generate_outputs', arguments.profile):
+        generate(arguments.outputs, arguments.output_dir, arguments.eissn,
+                 arguments.year, arguments.batch_size, arguments.depositor,
+                 arguments.email, arguments.dry_run)
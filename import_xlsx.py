@@ -0,0 +1,329 @@
+# Correct all '.xlsx' files in the "incoming_xlsx" directory
+# and export them to MongoDB in a single pass.
+# Every workbook is read once: rows are corrected, validated
+# and upserted in batches without saving an intermediate file
+
+from os import listdir, path, makedirs, rename
+import argparse
+import logging
+from openpyxl import load_workbook
+from textprocessing_module import id_value_is_valid
+from mongo_module import (DEFAULT_BATCH_SIZE, upsert_in_batches,
+                          get_database, new_counts, add_writers_argument)
+from manifest_module import (file_hash, load_manifest, save_manifest,
+                             add_to_manifest, format_counts,
+                             load_checkpoint, clear_checkpoint)
+from parallel_module import map_files
+from duplicates_module import duplicate_rows, unsettled
+from near_duplicates_module import (flag_near_duplicates,
+                                    add_near_duplicates_argument)
+from staging_module import (StagingCollection, dump_path,
+                            add_stage_arguments)
+from correct_xlsx import correct_rows, create_corrected_workbook
+from export_from_XLSX_to_mongo import log_failed, checkpoint_saver
+from article_schema import row_projector, article_from_row
+from metrics_module import (timed, timed_iter, instrumented_run,
+                            add_profile_argument)
+
+# setup folders
+INCOMING_DIR = "incoming_xlsx"
+CORRECTED_DIR = "corrected_xlsx/trash"
+TRASH_DIR = "trash"
+
+
+def corrected_documents(file: str, wb: 'Workbook',
+                        corrected_ws: 'Excel worksheet' = None,
+                        row_workers: int = 1,
+                        excluded: set = frozenset(),
+                        start: int = 0,
+                        positions: list = None) -> 'Iterator':
+    """Correct rows of the active sheet and yield documents of the
+       articles with valid IDs. Corrected rows are also appended
+       to 'corrected_ws' if it is given. Rows whose Excel numbers
+       are in 'excluded' or not after 'start' are corrected but
+       not yielded. Row numbers of the yielded documents are appended
+       to 'positions' if it is given"""
+
+    rows = correct_rows(file, timed_iter("read",
+                                         wb.active.iter_rows(values_only=True)),
+                        row_workers)
+    header = next(rows, None)
+
+    if header is not None:
+        project = row_projector(header)
+        if corrected_ws is not None:
+            corrected_ws.append(header)
+
+    for number, row in enumerate(rows, 2):
+        if corrected_ws is not None:
+            corrected_ws.append(row)
+
+        if number <= start:
+            continue
+
+        values = project(row)
+        if id_value_is_valid(values[0]) and number not in excluded:
+            with timed("build", 1):
+                document = article_from_row(values).to_document()
+            if positions is not None:
+                positions.append(number)
+            yield document
+
+
+def import_file(file: str, incoming_dir: str, corrected_dir: str,
+                batch_size: int = DEFAULT_BATCH_SIZE,
+                save_corrected: bool = False,
+                writers: int = 0,
+                row_workers: int = 1,
+                duplicates: dict = None,
+                staging_dir: str = None,
+                staging_format: str = "bson",
+                near_duplicates: bool = False) -> list:
+    """Correct a single file and export it to MongoDB. Return counts
+       of inserted, updated and skipped articles and a list of
+       (_id, reason) pairs for failed ones. 'duplicates' holds the rows
+       of the files of the run that lose to another version of their ID.
+       An interrupted import of the same file resumes after the
+       checkpoint of its last written batch. With 'staging_dir'
+       the documents go into a local dump instead. With
+       'near_duplicates' written articles are checked for possible
+       duplicates in the collection"""
+
+    logging.info("# Processing a file")
+
+    positions = []
+    written = None
+    if staging_dir:
+        collection = StagingCollection(dump_path(staging_dir,
+                                                 incoming_dir + "/" + file,
+                                                 staging_format))
+        start, committed = 0, None
+    else:
+        collection = get_database().articles
+        digest = file_hash(incoming_dir + "/" + file)
+        start = load_checkpoint(digest)
+        if start:
+            logging.info(file + " is resumed after row " + str(start))
+        committed = checkpoint_saver(digest, file, positions)
+        if near_duplicates:
+            written = flag_near_duplicates
+
+    with timed("load"):
+        wb = load_workbook(incoming_dir + "/" + file, read_only=True)
+
+        # Corrected workbook is an optional side output
+        corrected_wb = corrected_ws = None
+        if save_corrected:
+            corrected_wb, corrected_ws = create_corrected_workbook(wb)
+
+    # With writer threads the batches are written while
+    # the rest of the sheet is being corrected
+    excluded = (duplicates or {}).get(file, frozenset())
+    counts = new_counts()
+    if excluded:
+        counts["duplicates"] = len(excluded)
+    failed = None
+    try:
+        failed = upsert_in_batches(collection,
+                                   corrected_documents(file, wb, corrected_ws,
+                                                       row_workers, excluded,
+                                                       start, positions),
+                                   batch_size, counts, writers, committed,
+                                   written)
+    finally:
+        wb.close()
+        if staging_dir:
+            collection.close(keep=failed == [])
+
+    # The file has already been exported, so the corrected copy
+    # goes where export_from_XLSX_to_mongo.py would have left it
+    if corrected_wb is not None and not failed:
+        with timed("save"):
+            corrected_wb.save(corrected_dir + "/" + file)
+
+    return counts, failed
+
+
+def import_files(files: list,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 save_corrected: bool = False,
+                 workers: int = 1,
+                 force: bool = False,
+                 writers: int = 0,
+                 row_workers: int = 1,
+                 restart: bool = False,
+                 staging_dir: str = None,
+                 staging_format: str = "bson",
+                 near_duplicates: bool = False) -> list:
+    """Import files of the "incoming_xlsx" directory and move them
+       into its "trash" directory. Interrupted imports are resumed
+       from their checkpoints unless 'restart' is set. With
+       'staging_dir' the files are staged into local dumps instead.
+       With 'near_duplicates' possible duplicates are logged.
+       Return files that have failed"""
+
+    # Files which have already been imported with the same content
+    # are skipped entirely, unless the import is forced
+    manifest = load_manifest()
+    hashes = {file: file_hash(INCOMING_DIR + "/" + file) for file in files}
+    files = list(files)
+    not_imported = []
+
+    if not force:
+        for file in [file for file in files if hashes[file] in manifest]:
+            files.remove(file)
+            rename(INCOMING_DIR + "/" + file, INCOMING_DIR +
+                   "/" + TRASH_DIR + "/" + file)
+            logging.info(file + " has not changed since the last import")
+
+    if restart and not staging_dir:
+        for file in files:
+            clear_checkpoint(hashes[file])
+
+    # An article found in several files is written only once
+    with timed("index"):
+        duplicates, winners = duplicate_rows(files, INCOMING_DIR)
+
+    def finish(file: str, counts: dict) -> None:
+        # Staged files get into the manifest when their dumps are loaded
+        if not staging_dir:
+            add_to_manifest(manifest, hashes[file], file, counts)
+            save_manifest(manifest)
+            clear_checkpoint(hashes[file])
+
+        rename(INCOMING_DIR + "/" + file, INCOMING_DIR +
+               "/" + TRASH_DIR + "/" + file)
+        if staging_dir:
+            logging.info(file + " has been corrected and staged into " +
+                         staging_dir + ". Articles: " +
+                         str(counts["inserted"]) + ".")
+        else:
+            logging.info(file + " has been corrected and exported to "
+                         "MongoDB. " + format_counts(counts))
+
+    # Files are imported in worker processes if there is more than one,
+    # each with its own MongoDB client
+    succeeded = set()
+    deferred = []
+    for file, result, error in map_files(import_file, files,
+                                         (INCOMING_DIR, CORRECTED_DIR,
+                                          batch_size, save_corrected,
+                                          writers, row_workers, duplicates,
+                                          staging_dir, staging_format,
+                                          near_duplicates),
+                                         workers):
+
+        # Keep the file in place if it has failed or any of
+        # its batches has not been acknowledged
+        if error:
+            logging.error(file + " has not been exported to MongoDB: " +
+                          error)
+            not_imported.append(file)
+            continue
+
+        counts, failed = result
+        if failed:
+            log_failed(file, failed)
+            not_imported.append(file)
+            continue
+
+        succeeded.add(file)
+        if file in winners:
+            deferred.append((file, counts))
+        else:
+            finish(file, counts)
+
+    # Files with rows left to other files are finished only
+    # after those files, otherwise their rows would be lost
+    for file, counts in deferred:
+        waiting = unsettled(file, winners, succeeded)
+        if waiting:
+            clear_checkpoint(hashes[file])
+            logging.error(file + " is kept in " + INCOMING_DIR +
+                          ": its duplicate rows have not been written "
+                          "from " + ", ".join(waiting))
+            not_imported.append(file)
+        else:
+            finish(file, counts)
+
+    return not_imported
+
+
+def prepare_directories(save_corrected: bool = False) -> None:
+    """Create the directories the import moves files into"""
+    if save_corrected and not path.exists(CORRECTED_DIR):
+        makedirs(CORRECTED_DIR)
+
+    if not path.exists(INCOMING_DIR + "/" + TRASH_DIR):
+        makedirs(INCOMING_DIR + "/" + TRASH_DIR)
+
+
+def import_xlsx(batch_size: int = DEFAULT_BATCH_SIZE,
+                save_corrected: bool = False,
+                workers: int = 1,
+                force: bool = False,
+                writers: int = 0,
+                row_workers: int = 1,
+                restart: bool = False,
+                staging_dir: str = None,
+                staging_format: str = "bson",
+                near_duplicates: bool = False) -> None:
+
+    # setup logging
+    logging.basicConfig(filename='app.log',
+                        level=logging.INFO,
+                        format='%(asctime)s | %(levelname)s | %(message)s',
+                        datefmt='%d/%m/%Y %H:%M:%S')
+
+    logging.info("### XLSX Import Script started")
+
+    prepare_directories(save_corrected)
+
+    files = [file for file in listdir(INCOMING_DIR) if file.endswith(".xlsx")]
+
+    import_files(files, batch_size, save_corrected, workers, force, writers,
+                 row_workers, restart, staging_dir, staging_format,
+                 near_duplicates)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Correct XLSX files from the "incoming_xlsx" directory '
+                    'and export them to MongoDB')
+    arg_parser.add_argument('--batch-size',
+                            type=int,
+                            default=DEFAULT_BATCH_SIZE,
+                            help='Number of articles sent to MongoDB at once')
+    arg_parser.add_argument('--save-corrected',
+                            action='store_true',
+                            help='Also save corrected workbooks '
+                                 'into "corrected_xlsx/trash"')
+    arg_parser.add_argument('--workers',
+                            type=int,
+                            default=1,
+                            help='Number of files processed in parallel')
+    arg_parser.add_argument('--force',
+                            action='store_true',
+                            help='Import files even if they have already '
+                                 'been imported without changes')
+    arg_parser.add_argument('--row-workers',
+                            type=int,
+                            default=1,
+                            help='Number of processes correcting rows '
+                                 'of a single file in chunks')
+    arg_parser.add_argument('--restart',
+                            action='store_true',
+                            help='Import interrupted files from the first '
+                                 'row instead of their checkpoints')
+    add_writers_argument(arg_parser)
+    add_stage_arguments(arg_parser)
+    add_near_duplicates_argument(arg_parser)
+    add_profile_argument(arg_parser)
+    arguments = arg_parser.parse_args()
+
+    with instrumented_run('import_xlsx', arguments.profile):
+        import_xlsx(arguments.batch_size, arguments.save_corrected,
+                    arguments.workers, arguments.force, arguments.writers,
+                    arguments.row_workers, arguments.restart,
+                    arguments.stage, arguments.stage_format,
+                    arguments.near_duplicates)
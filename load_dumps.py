@@ -0,0 +1,143 @@
+# Load dumps staged with the '--stage' switch of the exporters
+# into MongoDB. Documents are sent in large unordered bulk writes,
+# and only new and changed ones are written, as in a direct import.
+# Dumps are loaded in the order given, so of two dumps with the same
+# article the later one wins. Loaded dumps are recorded in the import
+# manifest, and an interrupted load resumes after its checkpoint
+
+from itertools import islice
+import argparse
+import logging
+from glob import glob
+from mongo_module import (upsert_in_batches, get_database, new_counts,
+                          add_writers_argument)
+from manifest_module import (file_hash, load_manifest, save_manifest,
+                             add_to_manifest, format_counts,
+                             load_checkpoint, save_checkpoint,
+                             clear_checkpoint)
+from staging_module import LOAD_BATCH_SIZE, read_dump
+from near_duplicates_module import (flag_near_duplicates,
+                                    add_near_duplicates_argument)
+from metrics_module import (timed_iter, file_scope, add_file,
+                            instrumented_run, add_profile_argument)
+
+
+def load_dump(collection: 'Mongo collection', dump: str,
+              batch_size: int = LOAD_BATCH_SIZE,
+              writers: int = 0,
+              restart: bool = False,
+              near_duplicates: bool = False) -> tuple:
+    """Load a single dump. Return counts of inserted, updated and
+       skipped articles and a list of (_id, reason) pairs
+       for failed ones. With 'near_duplicates' possible duplicates
+       of the loaded articles are logged"""
+    digest = file_hash(dump)
+    if restart:
+        clear_checkpoint(digest)
+    start = load_checkpoint(digest)
+    if start:
+        logging.info(dump + " is resumed after document " + str(start))
+
+    def committed(written: int) -> None:
+        save_checkpoint(digest, dump, start + written)
+
+    counts = new_counts()
+    failed = upsert_in_batches(collection,
+                               islice(timed_iter("read", read_dump(dump)),
+                                      start, None),
+                               batch_size, counts, writers, committed,
+                               flag_near_duplicates if near_duplicates
+                               else None)
+    return counts, failed
+
+
+def load_dumps(patterns: list, batch_size: int = LOAD_BATCH_SIZE,
+               writers: int = 0, force: bool = False,
+               restart: bool = False,
+               near_duplicates: bool = False) -> list:
+    """Load dumps matching the patterns. Dumps already loaded without
+       changes are skipped unless 'force' is set.
+       Return dumps that have failed"""
+
+    # setup logging
+    logging.basicConfig(filename='app.log',
+                        level=logging.INFO,
+                        format='%(asctime)s | %(levelname)s | %(message)s',
+                        datefmt='%d/%m/%Y %H:%M:%S')
+
+    logging.info("### Dump loading started")
+
+    dumps = []
+    for pattern in patterns:
+        dumps += sorted(glob(pattern)) or [pattern]
+
+    collection = get_database().articles
+    manifest = load_manifest()
+    not_loaded = []
+
+    for dump in dumps:
+        digest = file_hash(dump)
+        if digest in manifest and not force:
+            logging.info(dump + " has already been loaded")
+            continue
+
+        with file_scope() as stats:
+            counts, failed = load_dump(collection, dump, batch_size,
+                                       writers, restart, near_duplicates)
+        add_file(dump, stats)
+
+        if failed:
+            for article_id, reason in failed:
+                logging.error('Article has not been loaded. Dump: "' +
+                              dump + '". ID: "' + str(article_id) +
+                              '". Reason: "' + reason + '"')
+            logging.error(dump + " has not been loaded into MongoDB")
+            not_loaded.append(dump)
+            continue
+
+        add_to_manifest(manifest, digest, dump, counts)
+        save_manifest(manifest)
+        clear_checkpoint(digest)
+        logging.info(dump + " has been loaded into MongoDB. " +
+                     format_counts(counts))
+
+    return not_loaded
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Load staged dumps into MongoDB')
+    arg_parser.add_argument('dumps',
+                            metavar='dump',
+                            nargs='+',
+                            help='Dumps or glob patterns '
+                                 '(e.g. "staging/*.bson")')
+    arg_parser.add_argument('--batch-size',
+                            type=int,
+                            default=LOAD_BATCH_SIZE,
+                            help='Number of articles sent to MongoDB at once')
+    arg_parser.add_argument('--force',
+                            action='store_true',
+                            help='Load dumps even if they have already '
+                                 'been loaded without changes')
+    arg_parser.add_argument('--restart',
+                            action='store_true',
+                            help='Load interrupted dumps from the first '
+                                 'document instead of their checkpoints')
+    add_writers_argument(arg_parser)
+    add_near_duplicates_argument(arg_parser)
+    add_profile_argument(arg_parser)
+    arguments = arg_parser.parse_args()
+
+    with instrumented_run('load_dumps', arguments.profile):
+        not_loaded = load_dumps(arguments.dumps, arguments.batch_size,
+                                arguments.writers, arguments.force,
+                                arguments.restart,
+                                arguments.near_duplicates)
+
+    if not_loaded:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
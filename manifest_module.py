@@ -0,0 +1,111 @@
+# Manifest of imported files and content hashes of article documents.
+# Files are identified by the hash of their content, so a file
+# dropped again without changes is not imported twice.
+# A file that is being imported has a checkpoint with the position
+# of its last written row, so an interrupted import is resumed
+
+from datetime import datetime
+from hashlib import sha256
+from os import path, makedirs, replace, remove
+import json
+
+MANIFEST_FILE = "import_manifest.json"
+
+# One checkpoint file per file hash, so worker processes
+# never write into the same file
+CHECKPOINT_DIR = "import_checkpoints"
+
+# Fields that do not belong to the article content
+NOT_HASHED_FIELDS = ("flags", "content_hash")
+
+
+def file_hash(file_path: str) -> str:
+    """Return SHA-256 of a file content"""
+    digest = sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def document_hash(document: dict) -> str:
+    """Return a stable SHA-256 of an article document content.
+       Flags and the hash itself are not taken into account"""
+    content = {key: value for key, value in document.items()
+               if key not in NOT_HASHED_FIELDS}
+    serialized = json.dumps(content, sort_keys=True, ensure_ascii=False,
+                            separators=(',', ':'), default=str)
+    return sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def load_manifest(manifest_file: str = MANIFEST_FILE) -> dict:
+    """Load the manifest of imported files: file hash -> import info"""
+    if not path.exists(manifest_file):
+        return {}
+    with open(manifest_file, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_manifest(manifest: dict, manifest_file: str = MANIFEST_FILE) -> None:
+    """Save the manifest, replacing the previous one at once"""
+    with open(manifest_file + ".tmp", 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    replace(manifest_file + ".tmp", manifest_file)
+
+
+def add_to_manifest(manifest: dict, digest: str, file: str,
+                    counts: dict) -> None:
+    """Record an imported file with its article counts"""
+    manifest[digest] = {
+        "file": file,
+        "imported": datetime.now().isoformat(timespec='seconds'),
+        "inserted": counts["inserted"],
+        "updated": counts["updated"],
+        "skipped": counts["skipped"]
+    }
+
+
+def format_counts(counts: dict) -> str:
+    text = ('Inserted: ' + str(counts["inserted"]) + '. ' +
+            'Updated: ' + str(counts["updated"]) + '. ' +
+            'Skipped: ' + str(counts["skipped"]) + '.')
+    # Rows left out in favour of another file of the run
+    if counts.get("duplicates"):
+        text += ' Duplicates: ' + str(counts["duplicates"]) + '.'
+    return text
+
+
+def checkpoint_path(digest: str, checkpoint_dir: str = CHECKPOINT_DIR) -> str:
+    return checkpoint_dir + "/" + digest + ".json"
+
+
+def load_checkpoint(digest: str, checkpoint_dir: str = CHECKPOINT_DIR) -> int:
+    """Return the position (row or article number) up to which a file
+       has been written by an interrupted import, 0 if there is none"""
+    checkpoint_file = checkpoint_path(digest, checkpoint_dir)
+    if not path.exists(checkpoint_file):
+        return 0
+    with open(checkpoint_file, encoding='utf-8') as file:
+        return json.load(file)["position"]
+
+
+def save_checkpoint(digest: str, file: str, position: int,
+                    checkpoint_dir: str = CHECKPOINT_DIR) -> None:
+    """Record that a file has been written up to 'position',
+       replacing the previous checkpoint at once"""
+    if not path.exists(checkpoint_dir):
+        makedirs(checkpoint_dir, exist_ok=True)
+    checkpoint_file = checkpoint_path(digest, checkpoint_dir)
+    with open(checkpoint_file + ".tmp", 'w', encoding='utf-8') as output:
+        json.dump({"file": file, "position": position,
+                   "saved": datetime.now().isoformat(timespec='seconds')},
+                  output, ensure_ascii=False)
+    replace(checkpoint_file + ".tmp", checkpoint_file)
+
+
+def clear_checkpoint(digest: str, checkpoint_dir: str = CHECKPOINT_DIR) -> None:
+    """Forget the checkpoint of a file once it is imported completely,
+       or when it has to be replayed from the start"""
+    checkpoint_file = checkpoint_path(digest, checkpoint_dir)
+    if path.exists(checkpoint_file):
+        remove(checkpoint_file)
@@ -0,0 +1,218 @@
+# Timing, row counts and MongoDB traffic of an import run.
+# Every process collects its own numbers. Numbers of a file processed
+# in a worker process are sent to the parent with the result, and the
+# parent writes a summary of the run into "metrics.jsonl"
+
+import cProfile
+import json
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
+from bson import BSON
+from pymongo import monitoring
+
+METRICS_FILE = "metrics.jsonl"
+
+# Number of the largest allocation sites written into app.log
+# after a memory profile
+TOP_ALLOCATIONS = 20
+
+
+def new_stats() -> dict:
+    """Empty numbers: seconds and rows by stage, MongoDB traffic,
+       latency and retries"""
+    return {"stages": {},
+            "mongo": {"round_trips": 0, "bytes_sent": 0,
+                      "seconds": 0.0, "failed": 0,
+                      "retries": 0, "backoff_seconds": 0.0}}
+
+
+# Numbers of the file being processed, or of the run outside of files
+current = new_stats()
+
+# (file, numbers) pairs of the current run
+files = []
+
+# Numbers are also added by writer threads of the pipelined mode
+lock = threading.Lock()
+
+
+def add_time(stage: str, seconds: float, rows: int = 0) -> None:
+    """Add time spent and rows processed in a stage"""
+    with lock:
+        stages = current["stages"]
+        if stage not in stages:
+            stages[stage] = {"seconds": 0.0, "rows": 0}
+        stages[stage]["seconds"] += seconds
+        stages[stage]["rows"] += rows
+
+
+@contextmanager
+def timed(stage: str, rows: int = 0) -> 'Context manager':
+    """Time a block of code as a stage"""
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        add_time(stage, perf_counter() - started, rows)
+
+
+def timed_iter(stage: str, iterable: 'Iterable') -> 'Iterator':
+    """Yield items of an iterable, timing every step as a stage
+       that processes one row"""
+    iterator = iter(iterable)
+    while True:
+        started = perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            add_time(stage, perf_counter() - started)
+            return
+        add_time(stage, perf_counter() - started, 1)
+        yield item
+
+
+@contextmanager
+def file_scope() -> 'Context manager':
+    """Collect numbers of a single file apart from the rest of the run.
+       Yields the numbers of the file"""
+    global current
+    outer = current
+    current = new_stats()
+    try:
+        yield current
+    finally:
+        current = outer
+
+
+def add_file(file: str, stats: dict) -> None:
+    """Record numbers of a processed file"""
+    files.append((file, stats))
+
+
+def merge_stats(total: dict, stats: dict) -> None:
+    """Add numbers of 'stats' to 'total'"""
+    for stage, numbers in stats["stages"].items():
+        if stage not in total["stages"]:
+            total["stages"][stage] = {"seconds": 0.0, "rows": 0}
+        total["stages"][stage]["seconds"] += numbers["seconds"]
+        total["stages"][stage]["rows"] += numbers["rows"]
+    for key, value in stats["mongo"].items():
+        total["mongo"][key] += value
+
+
+def add_retry(delay: float) -> None:
+    """Count a retried MongoDB operation and the delay before it"""
+    with lock:
+        current["mongo"]["retries"] += 1
+        current["mongo"]["backoff_seconds"] += delay
+
+
+def add_stats(stats: dict) -> None:
+    """Add numbers collected in a worker process to the current ones"""
+    with lock:
+        merge_stats(current, stats)
+
+
+class MongoCounter(monitoring.CommandListener):
+    """Count MongoDB round trips, bytes of commands sent and latency.
+       Commands are encoded again to be measured, which costs as much
+       as the write itself, so bytes are counted only if 'count_bytes'
+       is set, as it is for profiled runs"""
+
+    count_bytes = False
+
+    def started(self, event: 'Command started event') -> None:
+        size = len(BSON.encode(event.command)) if self.count_bytes else 0
+        with lock:
+            current["mongo"]["round_trips"] += 1
+            current["mongo"]["bytes_sent"] += size
+
+    def succeeded(self, event: 'Command succeeded event') -> None:
+        with lock:
+            current["mongo"]["seconds"] += event.duration_micros / 1e6
+
+    def failed(self, event: 'Command failed event') -> None:
+        with lock:
+            current["mongo"]["seconds"] += event.duration_micros / 1e6
+            current["mongo"]["failed"] += 1
+
+
+# Listener passed to every MongoClient of the scripts
+mongo_counter = MongoCounter()
+
+
+def write_summary(script: str, started: datetime, seconds: float,
+                  metrics_file: str = METRICS_FILE) -> None:
+    """Append a line per processed file and a line with the totals
+       of the run to the metrics file"""
+    run = started.isoformat(timespec='seconds')
+    total = new_stats()
+    merge_stats(total, current)
+
+    with open(metrics_file, 'a', encoding='utf-8') as output:
+        for file, stats in files:
+            merge_stats(total, stats)
+            output.write(json.dumps({"run": run, "script": script,
+                                     "file": file,
+                                     "stages": stats["stages"],
+                                     "mongo": stats["mongo"]},
+                                    ensure_ascii=False) + "\n")
+        output.write(json.dumps({"run": run, "script": script,
+                                 "files": len(files),
+                                 "seconds": seconds,
+                                 "stages": total["stages"],
+                                 "mongo": total["mongo"]},
+                                ensure_ascii=False) + "\n")
+
+
+def add_profile_argument(arg_parser: 'Argument parser') -> None:
+    """Add the '--profile' switch of the scripts"""
+    arg_parser.add_argument('--profile',
+                            nargs='?',
+                            const='cpu',
+                            choices=['cpu', 'memory'],
+                            help='Save a cProfile ("cpu", the default) or '
+                                 'tracemalloc ("memory") dump of the run')
+
+
+@contextmanager
+def instrumented_run(script: str, profile: str = None) -> 'Context manager':
+    """Collect numbers of a run and write its summary when it ends.
+       'profile' is "cpu" for a cProfile dump or "memory" for
+       a tracemalloc snapshot of the main process"""
+    global current
+    current = new_stats()
+    del files[:]
+
+    started = datetime.now()
+    stamp = started.strftime('%Y%m%d-%H%M%S')
+    clock = perf_counter()
+
+    mongo_counter.count_bytes = profile is not None
+    if profile == 'cpu':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profile == 'memory':
+        tracemalloc.start()
+
+    try:
+        yield
+    finally:
+        mongo_counter.count_bytes = False
+        if profile == 'cpu':
+            profiler.disable()
+            profiler.dump_stats(script + '-' + stamp + '.prof')
+        elif profile == 'memory':
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            logging.info("Memory: peak " + str(peak) + " B")
+            snapshot.dump(script + '-' + stamp + '.tracemalloc')
+            for line in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+                logging.info("Memory: " + str(line))
+
+        write_summary(script, started, perf_counter() - clock)
@@ -0,0 +1,351 @@
+# Helper functions for batched writes into
+# Russkiy Vrach Publishing House article database
+
+from os import environ, getpid
+import queue
+import ssl
+import threading
+import time
+from pymongo import MongoClient, ReplaceOne
+from pymongo.errors import BulkWriteError, PyMongoError, ConnectionFailure
+from manifest_module import document_hash
+import metrics_module
+
+# Number of documents sent to MongoDB in a single round trip
+DEFAULT_BATCH_SIZE = 500
+
+# Number of parsed batches waiting for each writer thread.
+# The parser blocks when the queue is full
+QUEUED_BATCHES_PER_WRITER = 2
+
+# Retries of a batch after a connection error and the delay
+# before the first one, doubled for every next retry
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 0.5
+
+# MongoDB clients by process id. A client must not be shared
+# with forked worker processes, so each process creates its own
+clients = {}
+
+
+def mongo_settings() -> dict:
+    """Connection settings from the environment:
+       MONGO_COMPRESSORS - wire compression, e.g. "snappy,zlib"
+       MONGO_POOL_SIZE - connections per process
+       MONGO_WRITE_CONCERN - e.g. "1" for backfills, "majority"
+       MONGO_SOCKET_TIMEOUT_MS, MONGO_CONNECT_TIMEOUT_MS - timeouts
+       MONGO_TLS_INSECURE - "1" to skip checking the server certificate,
+       by default it is skipped for TLS connections only
+       MONGO_RETRIES, MONGO_RETRY_DELAY - retries of a failed batch"""
+    return {
+        "compressors": environ.get('MONGO_COMPRESSORS'),
+        "pool_size": int(environ.get('MONGO_POOL_SIZE', 0)) or None,
+        "write_concern": environ.get('MONGO_WRITE_CONCERN'),
+        "socket_timeout_ms": int(environ.get('MONGO_SOCKET_TIMEOUT_MS', 0)),
+        "connect_timeout_ms": int(environ.get('MONGO_CONNECT_TIMEOUT_MS', 0)),
+        "tls_insecure": environ.get('MONGO_TLS_INSECURE'),
+        "retries": int(environ.get('MONGO_RETRIES', DEFAULT_RETRIES)),
+        "retry_delay": float(environ.get('MONGO_RETRY_DELAY',
+                                         DEFAULT_RETRY_DELAY))
+    }
+
+
+def uses_tls(uri: str) -> bool:
+    """Whether a connection string asks for TLS. SRV records of
+       the cluster imply it"""
+    options = uri.lower()
+    return (options.startswith("mongodb+srv://") or "ssl=true" in options or
+            "tls=true" in options)
+
+
+def create_client(uri: str = None) -> MongoClient:
+    """Create a client of 'uri', MONGO_DEV_URI by default,
+       with the settings of mongo_settings"""
+    uri = uri or environ['MONGO_DEV_URI']
+    settings = mongo_settings()
+    options = {"event_listeners": [metrics_module.mongo_counter]}
+
+    if settings["compressors"]:
+        options["compressors"] = settings["compressors"]
+    if settings["pool_size"]:
+        options["maxPoolSize"] = settings["pool_size"]
+    if settings["write_concern"]:
+        write_concern = settings["write_concern"]
+        options["w"] = (int(write_concern) if write_concern.isdigit()
+                        else write_concern)
+    if settings["socket_timeout_ms"]:
+        options["socketTimeoutMS"] = settings["socket_timeout_ms"]
+    if settings["connect_timeout_ms"]:
+        options["connectTimeoutMS"] = settings["connect_timeout_ms"]
+        options["serverSelectionTimeoutMS"] = settings["connect_timeout_ms"]
+
+    if settings["tls_insecure"] is None:
+        tls_insecure = uses_tls(uri)
+    else:
+        tls_insecure = settings["tls_insecure"] == "1"
+    if tls_insecure:
+        options["ssl_cert_reqs"] = ssl.CERT_NONE
+
+    return MongoClient(uri, **options)
+
+
+def get_database() -> 'Mongo database':
+    """Return 'rvph' database of the client of the current process"""
+    pid = getpid()
+    if pid not in clients:
+        clients[pid] = create_client()
+    return clients[pid].rvph
+
+
+def with_retries(operation: 'Callable') -> 'Result':
+    """Call an idempotent MongoDB operation, such as an upsert of
+       a batch by '_id'. After a connection error it is retried
+       with exponential backoff, the last error is raised"""
+    settings = mongo_settings()
+    for attempt in range(settings["retries"] + 1):
+        try:
+            return operation()
+        except ConnectionFailure:
+            if attempt == settings["retries"]:
+                raise
+            delay = settings["retry_delay"] * 2 ** attempt
+            metrics_module.add_retry(delay)
+            time.sleep(delay)
+
+
+def new_counts() -> dict:
+    """Counters of inserted, updated and skipped (unchanged) articles"""
+    return {"inserted": 0, "updated": 0, "skipped": 0}
+
+
+def write_batch(collection: 'Mongo collection', batch: list) -> list:
+    """Upsert a batch of documents with one unordered bulk write.
+       Return a list of (_id, reason) pairs for documents that failed.
+       A stand-in collection which takes plain documents, like
+       a staging dump, gets them through its 'write_documents'.
+       It is looked up on the class, as a Mongo collection returns
+       a subcollection for any attribute"""
+    if not batch:
+        return []
+
+    if hasattr(type(collection), "write_documents"):
+        collection.write_documents(batch)
+        return []
+
+    requests = [ReplaceOne({"_id": document["_id"]}, document, upsert=True)
+                for document in batch]
+
+    try:
+        with_retries(lambda: collection.bulk_write(requests, ordered=False))
+    except BulkWriteError as error:
+        failed = [(batch[write_error['index']]["_id"], write_error['errmsg'])
+                  for write_error in error.details.get('writeErrors', [])]
+
+        # A write concern error means that the rest of the batch
+        # has not been acknowledged either
+        for concern_error in error.details.get('writeConcernErrors', []):
+            failed_ids = {_id for _id, _ in failed}
+            failed += [(document["_id"], concern_error['errmsg'])
+                       for document in batch
+                       if document["_id"] not in failed_ids]
+        return failed
+    except PyMongoError as error:
+        return [(document["_id"], str(error)) for document in batch]
+
+    return []
+
+
+def flush_batch(collection: 'Mongo collection', batch: list,
+                counts: dict = None, written: 'Callable' = None) -> list:
+    """Upsert only new and changed documents of a batch.
+       Every document gets a 'content_hash' field, documents with the same
+       hash as the stored one are skipped. Documents loaded from a dump
+       keep the hash they were staged with. Numbers of inserted, updated
+       and skipped documents are added to 'counts'. New and changed
+       documents that have been written are passed to
+       written(collection, documents) if it is given.
+       Return a list of (_id, reason) pairs for documents that failed"""
+    if not batch:
+        return []
+
+    if counts is None:
+        counts = new_counts()
+
+    with metrics_module.timed("hash", len(batch)):
+        for document in batch:
+            if "content_hash" not in document:
+                document["content_hash"] = document_hash(document)
+
+    try:
+        with metrics_module.timed("mongo_find", len(batch)):
+            ids = [document["_id"] for document in batch]
+            stored = with_retries(lambda: {
+                item["_id"]: item.get("content_hash") for item in
+                collection.find({"_id": {"$in": ids}},
+                                {"content_hash": True})})
+    except PyMongoError as error:
+        return [(document["_id"], str(error)) for document in batch]
+
+    changed = [document for document in batch
+               if stored.get(document["_id"]) != document["content_hash"]]
+    counts["skipped"] += len(batch) - len(changed)
+
+    with metrics_module.timed("mongo_write", len(changed)):
+        failed = write_batch(collection, changed)
+    failed_ids = {_id for _id, _ in failed}
+
+    for document in changed:
+        if document["_id"] in failed_ids:
+            continue
+        if document["_id"] in stored:
+            counts["updated"] += 1
+        else:
+            counts["inserted"] += 1
+
+    if written is not None and len(changed) > len(failed_ids):
+        written(collection, [document for document in changed
+                             if document["_id"] not in failed_ids])
+
+    return failed
+
+
+def upsert_pipelined(collection: 'Mongo collection',
+                     documents: 'Iterable of dicts',
+                     batch_size: int = DEFAULT_BATCH_SIZE,
+                     counts: dict = None,
+                     writers: int = 1,
+                     committed: 'Callable' = None,
+                     written: 'Callable' = None) -> list:
+    """Upsert documents in batches of 'batch_size' while they are
+       still being parsed. Batches go through a bounded queue to
+       'writers' threads, so parsing overlaps with MongoDB round trips.
+       Parsing stops at the first failed batch, the rest of the queue
+       is dropped. An exception of a writer is raised here.
+       'committed' and 'written' are called as in upsert_in_batches.
+       Return a list of (_id, reason) pairs for documents that failed"""
+    if counts is None:
+        counts = new_counts()
+
+    batches = queue.Queue(maxsize=writers * QUEUED_BATCHES_PER_WRITER)
+    stop = threading.Event()
+    lock = threading.Lock()
+    failed = []
+    errors = []
+
+    # Batches may be acknowledged out of order. Sizes of the ones
+    # acknowledged after a gap wait until the gap is filled
+    acknowledged = {}
+    progress = {"batches": 0, "documents": 0}
+
+    def write() -> None:
+        while True:
+            item = batches.get()
+            if item is None:
+                return
+            if stop.is_set():
+                continue
+            number, batch = item
+
+            batch_counts = new_counts()
+            try:
+                batch_failed = flush_batch(collection, batch, batch_counts,
+                                           written)
+            except Exception as exception:
+                errors.append(exception)
+                stop.set()
+                continue
+
+            with lock:
+                for key in batch_counts:
+                    counts[key] += batch_counts[key]
+                failed.extend(batch_failed)
+                if not batch_failed and committed is not None:
+                    acknowledged[number] = len(batch)
+                    if number == progress["batches"]:
+                        while progress["batches"] in acknowledged:
+                            progress["documents"] += acknowledged.pop(
+                                progress["batches"])
+                            progress["batches"] += 1
+                        committed(progress["documents"])
+            if batch_failed:
+                stop.set()
+
+    threads = [threading.Thread(target=write, daemon=True)
+               for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        batch = []
+        number = 0
+        for document in documents:
+            if stop.is_set():
+                break
+            batch.append(document)
+            if len(batch) >= batch_size:
+                batches.put((number, batch))
+                batch = []
+                number += 1
+        if batch and not stop.is_set():
+            batches.put((number, batch))
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for _ in threads:
+            batches.put(None)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return failed
+
+
+def upsert_in_batches(collection: 'Mongo collection',
+                      documents: 'Iterable of dicts',
+                      batch_size: int = DEFAULT_BATCH_SIZE,
+                      counts: dict = None,
+                      writers: int = 0,
+                      committed: 'Callable' = None,
+                      written: 'Callable' = None) -> list:
+    """Upsert documents in batches of 'batch_size'. Batches are written
+       by 'writers' threads while parsing goes on if there are any,
+       otherwise between parsing steps. After a batch is acknowledged
+       'committed' is called with the number of leading documents
+       which have all been written, so a checkpoint can be saved.
+       'written' is passed on to flush_batch.
+       Return a list of (_id, reason) pairs for documents that failed"""
+    if writers > 0:
+        return upsert_pipelined(collection, documents, batch_size,
+                                counts, writers, committed, written)
+
+    failed = []
+    batch = []
+    done = 0
+
+    def flush() -> None:
+        nonlocal done
+        failed.extend(flush_batch(collection, batch, counts, written))
+        done += len(batch)
+        if batch and not failed and committed is not None:
+            committed(done)
+
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+
+    flush()
+    return failed
+
+
+def add_writers_argument(arg_parser: 'Argument parser') -> None:
+    """Add the '--writers' switch of the exporters"""
+    arg_parser.add_argument('--writers',
+                            type=int,
+                            default=0,
+                            help='Number of threads writing to MongoDB '
+                                 'while a file is still being parsed. '
+                                 'With 0 parsing and writing take turns')
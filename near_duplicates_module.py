@@ -0,0 +1,250 @@
+# Near-duplicate articles: the same paper stored under different IDs,
+# e.g. an issue exported again in another order, or an article that
+# came both as XLSX and as XML.
+# Every article gets a MinHash signature of the word shingles of its
+# normalized title, abstract and keywords. Signatures are split into
+# bands, and articles sharing a band are candidates, so a new article
+# is compared only with the few articles of its bands instead of the
+# whole collection. The index is kept in MongoDB and updated batch by
+# batch: 'minhash_signatures' holds signatures by article, 'minhash_bands'
+# the articles of every band, and pairs found go to 'near_duplicates'.
+# Batches of a process are indexed one at a time. Files exported in
+# parallel worker processes can miss pairs between each other, those
+# are found by rebuilding the index with find_near_duplicates.py
+
+from datetime import datetime
+from hashlib import blake2b
+import logging
+import re
+import threading
+from pymongo import UpdateOne, ReplaceOne
+from pymongo.errors import PyMongoError
+from textprocessing_module import (normalize_title, normalize_abstract,
+                                   normalize_keywords, present)
+from mongo_module import with_retries
+from metrics_module import timed
+
+# 128 hash functions in 16 bands of 8 rows: articles with Jaccard
+# similarity above about 0.7 share a band with high probability
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# Lowest estimated similarity of a pair reported as near duplicates
+SIMILARITY = 0.8
+
+# Words in a shingle
+SHINGLE_SIZE = 3
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+WORD_RE = re.compile(r'\w+')
+
+# Writer threads of the pipelined mode index their batches in turn
+index_lock = threading.Lock()
+
+
+def permutations(count: int = NUM_PERM) -> list:
+    """(a, b) pairs of the hash functions a * x + b mod p.
+       Derived from their number, so every run uses the same ones"""
+    pairs = []
+    for number in range(count):
+        digest = blake2b(b'minhash' + number.to_bytes(4, 'little'),
+                         digest_size=16).digest()
+        pairs.append((int.from_bytes(digest[:8], 'little') %
+                      (MERSENNE_PRIME - 1) + 1,
+                      int.from_bytes(digest[8:], 'little') % MERSENNE_PRIME))
+    return pairs
+
+
+PERMUTATIONS = permutations()
+
+
+def article_text(document: dict) -> str:
+    """Normalized title, abstract and keywords of an article.
+       Russian values are taken, English ones if there are none"""
+    parts = []
+    for field, normalize in (("title", normalize_title),
+                             ("abstract", normalize_abstract),
+                             ("keywords", normalize_keywords)):
+        values = document.get(field) or {}
+        value = next((values[language] for language in ("ru", "en")
+                      if present(values.get(language))), None)
+        if value is None:
+            continue
+        if type(value) is list:
+            value = ', '.join(item for item in value if item)
+        parts.append(normalize(value))
+    return ' '.join(parts)
+
+
+def shingles(text: str) -> set:
+    """Hashes of the word shingles of a text"""
+    words = WORD_RE.findall(text.casefold())
+    if len(words) < SHINGLE_SIZE:
+        grams = [' '.join(words)] if words else []
+    else:
+        grams = [' '.join(words[start:start + SHINGLE_SIZE])
+                 for start in range(len(words) - SHINGLE_SIZE + 1)]
+    return {int.from_bytes(blake2b(gram.encode('utf-8'),
+                                   digest_size=4).digest(), 'little')
+            for gram in grams}
+
+
+def signature(document: dict) -> list:
+    """MinHash signature of an article, None if it has no text"""
+    hashes = shingles(article_text(document))
+    if not hashes:
+        return None
+    hashes = list(hashes)
+    return [min([(a * value + b) % MERSENNE_PRIME for value in hashes])
+            & MAX_HASH for a, b in PERMUTATIONS]
+
+
+def band_keys(minhash: list) -> list:
+    """'_id's of the bands of a signature in 'minhash_bands'"""
+    keys = []
+    for band in range(BANDS):
+        rows = minhash[band * ROWS:(band + 1) * ROWS]
+        digest = blake2b(repr(rows).encode('ascii'), digest_size=8)
+        keys.append(str(band) + ':' + digest.hexdigest())
+    return keys
+
+
+def similarity(first: list, second: list) -> float:
+    """Jaccard similarity estimated from two signatures"""
+    return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+
+def index_articles(db: 'Mongo database', documents: list) -> list:
+    """Add articles to the index and return (ID, ID, similarity) of
+       the near-duplicate pairs they form with indexed articles or with
+       each other. Articles indexed before are moved to their new bands
+       and lose the pairs they no longer form"""
+    with timed("minhash", len(documents)):
+        signatures = {}
+        for document in documents:
+            minhash = signature(document)
+            if minhash is not None:
+                signatures[document["_id"]] = minhash
+    if not signatures:
+        return []
+
+    keys = {_id: band_keys(minhash) for _id, minhash in signatures.items()}
+    all_keys = list({key for article_keys in keys.values()
+                     for key in article_keys})
+
+    with timed("minhash_lookup", len(signatures)):
+        bands = with_retries(lambda: {
+            band["_id"]: set(band["ids"]) for band in
+            db.minhash_bands.find({"_id": {"$in": all_keys}})})
+        old = with_retries(lambda: {
+            item["_id"]: item["bands"] for item in
+            db.minhash_signatures.find({"_id": {"$in": list(signatures)}},
+                                       {"bands": True})})
+
+        candidates = set().union(*bands.values()) - set(signatures)
+        stored = with_retries(lambda: {
+            item["_id"]: item["signature"] for item in
+            db.minhash_signatures.find({"_id": {"$in": list(candidates)}},
+                                       {"signature": True})})
+
+    # Articles of the batch are compared with the index and
+    # with the articles of the batch before them
+    pairs = []
+    for _id, article_keys in keys.items():
+        for other in sorted(set().union(*[bands.get(key, set())
+                                          for key in article_keys])):
+            if other == _id:
+                continue
+            other_signature = signatures.get(other) or stored.get(other)
+            if other_signature is None:
+                continue
+            estimate = similarity(signatures[_id], other_signature)
+            if estimate >= SIMILARITY:
+                pairs.append((min(_id, other), max(_id, other), estimate))
+        for key in article_keys:
+            bands.setdefault(key, set()).add(_id)
+    pairs = sorted(set(pairs))
+
+    band_updates = []
+    for _id, article_keys in keys.items():
+        for key in set(old.get(_id, ())) - set(article_keys):
+            band_updates.append(UpdateOne({"_id": key},
+                                          {"$pull": {"ids": _id}}))
+        for key in article_keys:
+            band_updates.append(UpdateOne({"_id": key},
+                                          {"$addToSet": {"ids": _id}},
+                                          upsert=True))
+    hashes = {document["_id"]: document.get("content_hash")
+              for document in documents}
+    signature_updates = [ReplaceOne({"_id": _id},
+                                    {"_id": _id, "signature": minhash,
+                                     "bands": keys[_id],
+                                     "content_hash": hashes[_id]},
+                                    upsert=True)
+                         for _id, minhash in signatures.items()]
+    pair_updates = [UpdateOne({"_id": first + '|' + second},
+                              {"$set": {"ids": [first, second],
+                                        "similarity": estimate},
+                               "$setOnInsert": {"found": datetime.now()}},
+                              upsert=True)
+                    for first, second, estimate in pairs]
+
+    # Every write is idempotent, so it is retried as a whole.
+    # Signatures go last: an article counts as indexed only
+    # when its bands and pairs have been written
+    with timed("minhash_write", len(signatures)):
+        with_retries(lambda: db.minhash_bands.bulk_write(band_updates,
+                                                         ordered=False))
+        if old:
+            with_retries(lambda: db.near_duplicates.delete_many(
+                {"ids": {"$in": list(old)},
+                 "_id": {"$nin": [first + '|' + second
+                                  for first, second, _ in pairs]}}))
+        if pair_updates:
+            with_retries(lambda: db.near_duplicates.bulk_write(
+                pair_updates, ordered=False))
+        with_retries(lambda: db.minhash_signatures.bulk_write(
+            signature_updates, ordered=False))
+
+    return pairs
+
+
+def flag_near_duplicates(collection: 'Mongo collection',
+                         documents: list) -> None:
+    """Index articles written by an import and log the near-duplicate
+       pairs they form. Passed as 'written' to upsert_in_batches.
+       If the index cannot be written, 'content_hash' of the articles
+       is cleared. It no longer matches the hash stored with their
+       signatures, so the next import or find_near_duplicates.py
+       indexes them again instead of skipping them as unchanged"""
+    try:
+        with index_lock:
+            pairs = index_articles(collection.database, documents)
+    except PyMongoError as error:
+        ids = [document["_id"] for document in documents]
+        logging.error('Articles have not been checked for duplicates. '
+                      'Reason: "' + str(error) + '"')
+        try:
+            with_retries(lambda: collection.update_many(
+                {"_id": {"$in": ids}}, {"$unset": {"content_hash": ""}}))
+        except PyMongoError:
+            logging.error('Articles have to be indexed again with '
+                          'find_near_duplicates.py. IDs: "' +
+                          '", "'.join(str(_id) for _id in ids) + '"')
+        return
+    for first, second, estimate in pairs:
+        logging.warning('Possible duplicate articles. IDs: "' + first +
+                        '", "' + second + '". Similarity: ' +
+                        str(round(estimate, 2)))
+
+
+def add_near_duplicates_argument(arg_parser: 'Argument parser') -> None:
+    """Add the '--near-duplicates' switch of the importers"""
+    arg_parser.add_argument('--near-duplicates',
+                            action='store_true',
+                            help='Index written articles and log the '
+                                 'possible duplicates among them '
+                                 '(about 6 ms more per article)')
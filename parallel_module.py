@@ -0,0 +1,72 @@
+# Helper functions to process files in a pool of worker processes.
+# Log records of each file are collected in the worker and returned
+# with the result, so only the parent process writes into app.log.
+# Metrics of each file are sent back to the parent the same way
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import metrics_module
+
+
+class RecordCollector(logging.Handler):
+    """Keep (level, message) pairs of log records in memory"""
+
+    def __init__(self) -> None:
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record: 'Log record') -> None:
+        self.records.append((record.levelno, record.getMessage()))
+
+
+collector = None
+
+
+def init_worker() -> None:
+    """Route all log records of a worker process into the collector"""
+    global collector
+    collector = RecordCollector()
+    root = logging.getLogger()
+    root.handlers = [collector]
+    root.setLevel(logging.INFO)
+
+
+def run_task(function: 'Callable', file: str, args: tuple) -> tuple:
+    """Run function(file, *args) in a worker process.
+       Return (file, result, error, log records, metrics)"""
+    collector.records = []
+    with metrics_module.file_scope() as stats:
+        try:
+            result, error = function(file, *args), None
+        except Exception as exception:
+            result, error = None, repr(exception)
+    return file, result, error, collector.records, stats
+
+
+def map_files(function: 'Callable', files: list,
+              args: tuple = (), workers: int = 1) -> 'Iterator':
+    """Call function(file, *args) for every file and yield
+       (file, result, error) tuples in the order of 'files'.
+       'error' is None if the call has succeeded"""
+
+    if workers <= 1:
+        for file in files:
+            with metrics_module.file_scope() as stats:
+                try:
+                    result, error = function(file, *args), None
+                except Exception as exception:
+                    result, error = None, repr(exception)
+            metrics_module.add_file(file, stats)
+            yield file, result, error
+        return
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker) as executor:
+        futures = [executor.submit(run_task, function, file, args)
+                   for file in files]
+        for future in futures:
+            file, result, error, records, stats = future.result()
+            for level, message in records:
+                logging.log(level, message)
+            metrics_module.add_file(file, stats)
+            yield file, result, error
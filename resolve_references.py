@@ -0,0 +1,292 @@
+# Find DOIs of the references of the articles with the Crossref REST API.
+# Every reference is looked up once: results, misses included, are kept
+# in a local cache by normalized citation text. Lookups of a batch of
+# articles run in a bounded thread pool, and the DOIs found are written
+# back into 'references.doi', a list parallel to 'references.ru',
+# with one bulk write per batch
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import environ, path
+import argparse
+import json
+import logging
+import re
+import threading
+import requests
+from pymongo import UpdateOne, ASCENDING
+from mongo_module import DEFAULT_BATCH_SIZE, get_database, with_retries
+from metrics_module import instrumented_run, add_profile_argument, timed
+
+DEFAULT_ENDPOINT = "https://api.crossref.org"
+CACHE_FILE = "reference_cache.jsonl"
+
+# Shorter references are not worth a lookup ("Ibid.", "Ibid. P. 5")
+MIN_REFERENCE_LENGTH = 30
+
+# Lowest relevance score of the best Crossref match accepted
+DEFAULT_MIN_SCORE = 60.0
+
+DOI_RE = re.compile(r'10\.\d{4,9}/[^\s"<>]+')
+NOT_WORD_RE = re.compile(r'\W+')
+
+# A requests session per thread of the pool
+sessions = threading.local()
+
+
+def normalize_citation(reference: str) -> str:
+    """Cache key of a reference: lowercase words separated by spaces"""
+    return NOT_WORD_RE.sub(' ', reference.casefold()).strip()
+
+
+def doi_in_text(reference: str) -> str:
+    """DOI written in the reference itself, None if there is none"""
+    match = DOI_RE.search(reference)
+    return match.group(0).rstrip('.,;)') if match else None
+
+
+def load_cache(cache_file: str = CACHE_FILE) -> dict:
+    """Load lookup results: normalized citation -> DOI or None.
+       Later lines of the file win"""
+    cache = {}
+    if path.exists(cache_file):
+        with open(cache_file, encoding='utf-8') as lines:
+            for line in lines:
+                entry = json.loads(line)
+                cache[entry["key"]] = entry["doi"]
+    return cache
+
+
+def append_to_cache(results: dict, cache_file: str = CACHE_FILE) -> None:
+    """Append new lookup results to the cache file"""
+    resolved = datetime.now().isoformat(timespec='seconds')
+    with open(cache_file, 'a', encoding='utf-8') as output:
+        for key, doi in results.items():
+            output.write(json.dumps({"key": key, "doi": doi,
+                                     "resolved": resolved},
+                                    ensure_ascii=False) + "\n")
+
+
+def lookup(reference: str, endpoint: str, min_score: float,
+           mailto: str = None, timeout: float = 20) -> str:
+    """Return the DOI of the best Crossref match of a reference,
+       None if there is no match good enough. HTTP and network
+       errors are raised, so they are not cached as misses"""
+    if not hasattr(sessions, "session"):
+        sessions.session = requests.Session()
+        if mailto:
+            sessions.session.headers["User-Agent"] = (
+                "RVPH import scripts (mailto:" + mailto + ")")
+
+    params = {"query.bibliographic": reference, "rows": 1,
+              "select": "DOI,score"}
+    if mailto:
+        params["mailto"] = mailto
+    response = sessions.session.get(endpoint.rstrip('/') + "/works",
+                                    params=params, timeout=timeout)
+    response.raise_for_status()
+
+    items = response.json()["message"]["items"]
+    if items and items[0].get("score", 0) >= min_score:
+        return items[0]["DOI"].lower()
+    return None
+
+
+def resolve(references: list, cache: dict, endpoint: str,
+            min_score: float, concurrency: int, mailto: str = None) -> dict:
+    """Look up references missing from the cache, at most 'concurrency'
+       at once. Return results of the successful lookups by key.
+       Failed lookups are logged and left for the next run"""
+    pending = {}
+    for reference in references:
+        key = normalize_citation(reference)
+        if key not in cache and key not in pending:
+            pending[key] = reference
+
+    results = {}
+    if not pending:
+        return results
+
+    def lookup_one(key: str) -> tuple:
+        try:
+            return key, lookup(pending[key], endpoint, min_score,
+                               mailto), None
+        except (requests.RequestException, ValueError, KeyError) as error:
+            return key, None, error
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for key, doi, error in executor.map(lookup_one, pending):
+            if error is not None:
+                logging.warning('Reference has not been looked up: "' +
+                                pending[key] + '". Reason: "' +
+                                repr(error) + '"')
+                continue
+            results[key] = doi
+    return results
+
+
+def reference_dois(references: list, cache: dict) -> list:
+    """DOIs of the references of an article in their order, None for
+       references without one. Returns None if any reference has not
+       been looked up yet"""
+    dois = []
+    for reference in references:
+        if not reference or reference == 'None':
+            dois.append(None)
+            continue
+        doi = doi_in_text(reference)
+        if doi is None and len(reference) >= MIN_REFERENCE_LENGTH:
+            key = normalize_citation(reference)
+            if key not in cache:
+                return None
+            doi = cache[key]
+        dois.append(doi)
+    return dois
+
+
+def lookup_candidates(references: list) -> list:
+    """References of an article that have to be looked up"""
+    return [reference for reference in references
+            if reference and reference != 'None' and
+            len(reference) >= MIN_REFERENCE_LENGTH and
+            doi_in_text(reference) is None]
+
+
+def resolve_batch(collection: 'Mongo collection', articles: list,
+                  cache: dict, endpoint: str, min_score: float,
+                  concurrency: int, mailto: str, cache_file: str,
+                  dry_run: bool) -> tuple:
+    """Resolve references of a batch of articles and write their DOIs
+       back with one bulk write. Return numbers of updated articles
+       and of DOIs found"""
+    candidates = []
+    for article in articles:
+        candidates += lookup_candidates(article["references"]["ru"])
+
+    with timed("crossref_lookup", len(candidates)):
+        results = resolve(candidates, cache, endpoint, min_score,
+                          concurrency, mailto)
+    append_to_cache(results, cache_file)
+    cache.update(results)
+
+    updates = []
+    found = 0
+    for article in articles:
+        dois = reference_dois(article["references"]["ru"], cache)
+        if dois is None:
+            continue
+        found += sum(1 for doi in dois if doi)
+        updates.append(UpdateOne({"_id": article["_id"]},
+                                 {"$set": {"references.doi": dois}}))
+
+    if updates and not dry_run:
+        with timed("write_dois", len(updates)):
+            with_retries(lambda: collection.bulk_write(updates,
+                                                       ordered=False))
+    return len(updates), found
+
+
+def unresolved_batches(collection: 'Mongo collection', query: dict,
+                       batch_size: int) -> 'Iterator':
+    """Yield batches of articles matching the query in '_id' order.
+       Every batch is a new query after the last '_id' of the previous
+       one, so no cursor stays open while references are looked up"""
+    last_id = None
+    while True:
+        page = dict(query)
+        if last_id is not None:
+            page["_id"] = {"$gt": last_id}
+        batch = list(collection.find(page, {"references.ru": True})
+                     .sort("_id", ASCENDING).limit(batch_size))
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]["_id"]
+
+
+def resolve_references(eissn: str = None, year: int = None,
+                       batch_size: int = DEFAULT_BATCH_SIZE,
+                       endpoint: str = DEFAULT_ENDPOINT,
+                       min_score: float = DEFAULT_MIN_SCORE,
+                       concurrency: int = 4,
+                       mailto: str = None,
+                       cache_file: str = CACHE_FILE,
+                       dry_run: bool = False) -> None:
+    """Resolve references of the articles without 'references.doi'"""
+
+    # setup logging
+    logging.basicConfig(filename='app.log',
+                        level=logging.INFO,
+                        format='%(asctime)s | %(levelname)s | %(message)s',
+                        datefmt='%d/%m/%Y %H:%M:%S')
+
+    logging.info("### Reference resolution started")
+
+    collection = get_database().articles
+    query = {"references.ru": {"$ne": None},
+             "references.doi": {"$exists": False}}
+    if eissn:
+        query["journal.eISSN"] = eissn.replace('-', '')
+    if year:
+        query["journal.year"] = year
+
+    cache = load_cache(cache_file)
+
+    updated = found = 0
+    for batch in unresolved_batches(collection, query, batch_size):
+        batch_updated, batch_found = resolve_batch(
+            collection, batch, cache, endpoint, min_score,
+            concurrency, mailto, cache_file, dry_run)
+        updated += batch_updated
+        found += batch_found
+
+    logging.info("References resolved. Articles: " + str(updated) +
+                 ". DOIs found: " + str(found) + ".")
+    print(str(updated) + ' articles, ' + str(found) + ' DOIs found')
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Find DOIs of article references with Crossref')
+    arg_parser.add_argument('--eissn',
+                            help='Only articles of this journal')
+    arg_parser.add_argument('--year',
+                            type=int,
+                            help='Only articles of this year')
+    arg_parser.add_argument('--batch-size',
+                            type=int,
+                            default=DEFAULT_BATCH_SIZE,
+                            help='Number of articles resolved and '
+                                 'written at once')
+    arg_parser.add_argument('--endpoint',
+                            default=environ.get('CROSSREF_API_URL',
+                                                DEFAULT_ENDPOINT),
+                            help='Crossref REST API URL, e.g. of a local '
+                                 'stub server')
+    arg_parser.add_argument('--min-score',
+                            type=float,
+                            default=DEFAULT_MIN_SCORE,
+                            help='Lowest relevance score of a match')
+    arg_parser.add_argument('--concurrency',
+                            type=int,
+                            default=4,
+                            help='Number of lookups running at once')
+    arg_parser.add_argument('--mailto',
+                            help='Contact email sent to Crossref '
+                                 '(the "polite" pool)')
+    arg_parser.add_argument('--cache',
+                            default=CACHE_FILE,
+                            help='Cache file of lookup results')
+    arg_parser.add_argument('--dry-run',
+                            action='store_true',
+                            help='Look references up without writing '
+                                 'DOIs into MongoDB')
+    add_profile_argument(arg_parser)
+    arguments = arg_parser.parse_args()
+
+    with instrumented_run('resolve_references', arguments.profile):
+        resolve_references(arguments.eissn, arguments.year,
+                           arguments.batch_size, arguments.endpoint,
+                           arguments.min_score, arguments.concurrency,
+                           arguments.mailto, arguments.cache,
+                           arguments.dry_run)
@@ -0,0 +1,126 @@
+# Offline staging of article documents.
+# Instead of MongoDB, the exporters can write finished documents into
+# a local dump, one dump per source file. A dump is either
+# length-prefixed BSON (as written by mongodump, so mongorestore reads
+# it too) or JSONL in MongoDB Extended JSON. Next to every dump there
+# is an index of the '_id' of each document with its byte offset.
+# Dumps are loaded into MongoDB later by load_dumps.py
+
+from hashlib import sha256
+from os import path, makedirs, replace, remove
+import threading
+from bson import BSON, decode_file_iter
+from bson import json_util
+
+STAGING_FORMATS = ("bson", "jsonl")
+
+# Number of documents sent to MongoDB at once when a dump is loaded
+LOAD_BATCH_SIZE = 5000
+
+
+class StagingCollection(object):
+    """Stand-in for the 'articles' collection which appends every
+       written document to a dump. Nothing is stored yet, so every
+       document of the source file is written. 'prepare' is applied
+       to a document right before it is staged. Writer threads
+       of the pipelined mode append whole batches one at a time"""
+
+    def __init__(self, dump: str, prepare: 'Callable' = None) -> None:
+        self.dump = dump
+        self.prepare = prepare
+        self.jsonl = dump.endswith(".jsonl")
+        self.offset = 0
+        self.lock = threading.Lock()
+        self.output = open(dump + ".tmp", 'wb')
+        self.index = open(dump + ".idx.tmp", 'w', encoding='utf-8')
+
+    def find(self, filter: dict, projection: dict = None) -> list:
+        return []
+
+    def write_documents(self, documents: list) -> None:
+        with self.lock:
+            self.write(documents)
+
+    def write(self, documents: list) -> None:
+        for document in documents:
+            if self.prepare is not None:
+                self.prepare(document)
+            if self.jsonl:
+                data = (json_util.dumps(document, ensure_ascii=False) +
+                        "\n").encode('utf-8')
+            else:
+                data = BSON.encode(document)
+            self.output.write(data)
+            self.index.write(str(document["_id"]) + "\t" +
+                             str(self.offset) + "\n")
+            self.offset += len(data)
+
+    def close(self, keep: bool = True) -> None:
+        """Close the dump. It appears under its name only if it is
+           kept, a partial dump is removed"""
+        self.output.close()
+        self.index.close()
+        if keep:
+            replace(self.dump + ".idx.tmp", self.dump + ".idx")
+            replace(self.dump + ".tmp", self.dump)
+        else:
+            remove(self.dump + ".idx.tmp")
+            remove(self.dump + ".tmp")
+
+
+def dump_path(staging_dir: str, file: str,
+              staging_format: str = "bson") -> str:
+    """Dump of a source file in the staging directory. Sources with
+       the same name in different directories, like issues of different
+       journals, get different dumps: the name is followed by a short
+       hash of the full path of the source"""
+    if not path.exists(staging_dir):
+        makedirs(staging_dir, exist_ok=True)
+    name = path.splitext(path.basename(file))[0]
+    digest = sha256(path.abspath(file).encode('utf-8')).hexdigest()[:8]
+    return (staging_dir + "/" + name + "-" + digest + "." +
+            staging_format)
+
+
+def read_dump(dump: str) -> 'Iterator':
+    """Yield documents of a dump in the order they were staged"""
+    with open(dump, 'rb') as file:
+        if dump.endswith(".jsonl"):
+            for line in file:
+                yield json_util.loads(line.decode('utf-8'))
+        else:
+            yield from decode_file_iter(file)
+
+
+def read_index(dump: str) -> dict:
+    """Return byte offsets of the documents of a dump by '_id'"""
+    offsets = {}
+    with open(dump + ".idx", encoding='utf-8') as index:
+        for line in index:
+            _id, offset = line.rstrip("\n").rsplit("\t", 1)
+            offsets[_id] = int(offset)
+    return offsets
+
+
+def read_document(dump: str, offset: int) -> dict:
+    """Read a single document of a dump at the offset from its index"""
+    with open(dump, 'rb') as file:
+        file.seek(offset)
+        if dump.endswith(".jsonl"):
+            return json_util.loads(file.readline().decode('utf-8'))
+        size = int.from_bytes(file.read(4), 'little')
+        file.seek(offset)
+        return BSON(file.read(size)).decode()
+
+
+def add_stage_arguments(arg_parser: 'Argument parser') -> None:
+    """Add the '--stage' and '--stage-format' switches of the exporters"""
+    arg_parser.add_argument('--stage',
+                            metavar='DIR',
+                            help='Write documents into local dumps in DIR '
+                                 'instead of MongoDB, to be loaded later '
+                                 'with load_dumps.py')
+    arg_parser.add_argument('--stage-format',
+                            choices=STAGING_FORMATS,
+                            default="bson",
+                            help='Format of the dumps')
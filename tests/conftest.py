@@ -0,0 +1,6 @@
+# The scripts are top-level modules of the repository root
+import sys
+from os import path
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
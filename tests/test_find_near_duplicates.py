@@ -0,0 +1,43 @@
+# Which articles find_near_duplicates.py indexes again
+
+import find_near_duplicates
+
+
+class Signatures(object):
+    def __init__(self, hashes: dict) -> None:
+        self.hashes = hashes
+
+    def find(self, query: dict, projection: dict) -> list:
+        return [{"_id": _id, "content_hash": self.hashes[_id]}
+                if self.hashes[_id] is not None else {"_id": _id}
+                for _id in query["_id"]["$in"] if _id in self.hashes]
+
+
+class Database(object):
+    def __init__(self, hashes: dict) -> None:
+        self.minhash_signatures = Signatures(hashes)
+
+
+def indexed(monkeypatch: 'MonkeyPatch', hashes: dict, batch: list) -> list:
+    articles = []
+    monkeypatch.setattr(find_near_duplicates, "index_articles",
+                        lambda db, documents: articles.extend(documents)
+                        or [])
+    find_near_duplicates.index_batch(Database(hashes), batch)
+    return [article["_id"] for article in articles]
+
+
+def test_only_changed_articles_are_indexed(monkeypatch) -> None:
+    batch = [{"_id": "new", "content_hash": "a"},
+             {"_id": "same", "content_hash": "b"},
+             {"_id": "changed", "content_hash": "c"}]
+    assert indexed(monkeypatch, {"same": "b", "changed": "old"},
+                   batch) == ["new", "changed"]
+
+
+def test_article_without_hash_is_indexed_once(monkeypatch) -> None:
+    # The hash of an article is cleared when an import fails to index it
+    batch = [{"_id": "cleared"}]
+    assert indexed(monkeypatch, {"cleared": "old"}, batch) == ["cleared"]
+    # Its signature is then stored without a hash as well
+    assert indexed(monkeypatch, {"cleared": None}, batch) == []
@@ -0,0 +1,133 @@
+# Reference resolution against a local stub of the Crossref REST API
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import json
+import threading
+import pytest
+import resolve_references
+
+LONG = "Ivanov I.I. A reference long enough to be looked up. 2020. "
+
+
+class StubCrossref(BaseHTTPRequestHandler):
+    """Answers /works with a DOI for references mentioning "found"
+       and a low-score match for the others"""
+    queries = []
+
+    def log_message(self, *arguments) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = parse_qs(url.query)["query.bibliographic"][0]
+        StubCrossref.queries.append((url.path, query))
+        found = "found" in query
+        items = [{"DOI": "10.1000/STUB." + str(len(query)),
+                  "score": 90 if found else 10}]
+        body = json.dumps({"message": {"items": items}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Cursor(object):
+    def __init__(self, documents: list) -> None:
+        self.documents = documents
+
+    def sort(self, key: str, direction: int) -> 'Cursor':
+        self.documents.sort(key=lambda document: document[key])
+        return self
+
+    def limit(self, count: int) -> list:
+        return self.documents[:count]
+
+
+class Articles(object):
+    """Just enough of a collection for resolve_references"""
+
+    def __init__(self, documents: list) -> None:
+        self.documents = {document["_id"]: document
+                          for document in documents}
+        self.finds = 0
+
+    def find(self, query: dict, projection: dict) -> Cursor:
+        self.finds += 1
+        after = query.get("_id", {}).get("$gt", "")
+        return Cursor([document for document in self.documents.values()
+                       if document["_id"] > after and
+                       "doi" not in document["references"]])
+
+    def bulk_write(self, requests: list, ordered: bool = True) -> None:
+        for request in requests:
+            document = self.documents[request._filter["_id"]]
+            document["references"]["doi"] = \
+                request._doc["$set"]["references.doi"]
+
+
+@pytest.fixture
+def endpoint() -> str:
+    StubCrossref.queries = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCrossref)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:" + str(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def articles() -> list:
+    return [{"_id": "25877305-2020-05-" + str(number).zfill(2),
+             "references": {"ru": [LONG + "found " + str(number),
+                                   LONG + "missed " + str(number),
+                                   LONG + "found 1",
+                                   "Ibid.",
+                                   "See https://doi.org/10.1234/abc.5."]}}
+            for number in range(1, 6)]
+
+
+def run(monkeypatch: 'MonkeyPatch', collection: Articles, endpoint: str,
+        cache_file: str) -> None:
+    monkeypatch.setattr(resolve_references, "get_database",
+                        lambda: type("Database", (), {
+                            "articles": collection})())
+    resolve_references.resolve_references(batch_size=2, endpoint=endpoint,
+                                          cache_file=cache_file)
+
+
+def test_references_are_resolved_through_the_endpoint(
+        monkeypatch: 'MonkeyPatch', tmp_path: 'Path', endpoint: str) -> None:
+    monkeypatch.chdir(tmp_path)
+    collection = Articles(articles())
+    run(monkeypatch, collection, endpoint, str(tmp_path / "cache.jsonl"))
+
+    # Every distinct reference is looked up once
+    queries = [query for _, query in StubCrossref.queries]
+    assert sorted(queries) == sorted(set(queries))
+    assert len(queries) == 10
+    assert {path for path, _ in StubCrossref.queries} == {"/works"}
+
+    # Batches of 2 are read by separate queries
+    assert collection.finds == 4
+    first = collection.documents["25877305-2020-05-01"]["references"]
+    assert first["doi"] == ["10.1000/stub." + str(len(LONG + "found 1")),
+                            None,
+                            "10.1000/stub." + str(len(LONG + "found 1")),
+                            None, "10.1234/abc.5"]
+
+
+def test_cache_prevents_repeat_lookups(monkeypatch: 'MonkeyPatch',
+                                       tmp_path: 'Path',
+                                       endpoint: str) -> None:
+    monkeypatch.chdir(tmp_path)
+    cache_file = str(tmp_path / "cache.jsonl")
+    run(monkeypatch, Articles(articles()), endpoint, cache_file)
+    looked_up = len(StubCrossref.queries)
+
+    # The same references in a fresh collection come from the cache,
+    # misses included
+    collection = Articles(articles())
+    run(monkeypatch, collection, endpoint, cache_file)
+    assert len(StubCrossref.queries) == looked_up
+    assert all("doi" in document["references"]
+               for document in collection.documents.values())
@@ -0,0 +1,42 @@
+# Staged dumps of XML issues
+
+import shutil
+from glob import glob
+from os import path, makedirs
+from export_from_XML_to_mongo import stage_files, convert_xml_to_json
+from staging_module import read_dump, read_index
+
+SAMPLES = path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                    "samples")
+
+
+def test_sources_with_the_same_name_get_their_own_dumps(
+        tmp_path: 'Path') -> None:
+    sources = []
+    for journal, issue in (("first", "5-2020.xml"), ("second", "6-2020.xml")):
+        makedirs(str(tmp_path / journal))
+        source = str(tmp_path / journal / "5-2020.xml")
+        shutil.copy(path.join(SAMPLES, issue), source)
+        sources.append(source)
+
+    staging_dir = str(tmp_path / "staging")
+    assert stage_files([str(tmp_path / "*" / "5-2020.xml")], staging_dir,
+                       "bson") == []
+
+    dumps = sorted(glob(path.join(staging_dir, "*.bson")))
+    assert len(dumps) == 2
+    staged = sorted(len(list(read_dump(dump))) for dump in dumps)
+    assert staged == sorted(len(convert_xml_to_json(source))
+                            for source in sources)
+    for dump in dumps:
+        assert len(read_index(dump)) == len(list(read_dump(dump)))
+
+
+def test_restaging_a_source_replaces_its_dump(tmp_path: 'Path') -> None:
+    source = path.join(SAMPLES, "5-2020.xml")
+    staging_dir = str(tmp_path / "staging")
+    for _ in range(2):
+        assert stage_files([source], staging_dir, "jsonl") == []
+    dumps = glob(path.join(staging_dir, "*.jsonl"))
+    assert len(dumps) == 1
+    assert len(list(read_dump(dumps[0]))) == 20
@@ -0,0 +1,44 @@
+# Fused field normalizers must give the same result as the chains
+# of individual functions they replaced
+
+from os import path
+import pytest
+import textprocessing_module as tp
+from benchmark import LEGACY_STACKS, apply_legacy_stack, sample_strings
+
+SAMPLES = path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                    "samples", "*.xlsx")
+
+EDGE_STRINGS = [
+    "", " ", "\n", "-\n", ".", "...", ",", ";", ":", " , ",
+    "  Title with  spaces.  ", "Word-\nwrap", "Line\nbreak\n",
+    "\t tabs\tand nbsp \t", "Trailing dots...", "Dots . . .",
+    "Иванов И.И.; Петров П.П. ;Сидоров С.С.",
+    "A ,B,  C ;D;", ",leading comma", "trailing comma ,",
+    "Ключевые слова: грипп; вакцина.", "a: b: c", ":only colon",
+    "Keywords:\nfirst ;second.", "1. Ref one\n   2. Ref two\n\t3.  Ref  three",
+    "¬softhyphen", "\n".join("  " + str(n) + ".  x  y"
+                                   for n in range(12)),
+    "12-\n15", " 3–5 ", " sep ", "рубрика обзор.",
+]
+
+
+@pytest.fixture(scope="module")
+def values() -> list:
+    return sample_strings(SAMPLES) + EDGE_STRINGS
+
+
+def test_every_field_has_a_legacy_chain() -> None:
+    assert set(tp.NORMALIZERS) == set(LEGACY_STACKS)
+
+
+@pytest.mark.parametrize("field", sorted(tp.NORMALIZERS))
+def test_normalizer_matches_legacy_chain(field: str, values: list) -> None:
+    expected = [apply_legacy_stack(field, value) for value in values]
+    assert [tp.NORMALIZERS[field](value) for value in values] == expected
+
+
+@pytest.mark.parametrize("field", sorted(tp.NORMALIZERS))
+def test_normalize_column_keeps_other_values(field: str) -> None:
+    assert tp.normalize_column(field, [None, 5, " a "]) == \
+        [None, 5, apply_legacy_stack(field, " a ")]
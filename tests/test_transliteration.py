@@ -0,0 +1,42 @@
+# translit_ru must give the same result as the 'transliterate' library
+
+from glob import glob
+from os import path
+import xml.etree.ElementTree as ET
+import pytest
+from transliterate import translit
+from transliteration_module import translit_ru, translit_ru_list
+from benchmark import sample_strings
+
+SAMPLES = path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                    "samples")
+
+EDGE_STRINGS = [
+    "", " ", "Ёлка и ёж", "ЩУКА щука", "Объявление, подъезд, Ь Ъ",
+    "Юлия Яковлева", "Mixed Latin и кириллица 123", "Ivanov I.I., Иванов И.И.",
+    "Ελληνικά и русский", "Ünïcödé ß æ", "Ї Є Ґ і ў",
+    "Emoji 😀 и 𝔘𝔫𝔦𝔠𝔬𝔡𝔢", "𠀀 иероглиф", "́ударе́ние",
+    "tab\tи\nперевод строки", "«кавычки» — тире",
+]
+
+
+def sample_references() -> list:
+    """References, authors and other texts of the sample issues"""
+    values = sample_strings(path.join(SAMPLES, "*.xlsx"))
+    for file in sorted(glob(path.join(SAMPLES, "*.xml"))):
+        values += [element.text for element in ET.parse(file).iter()
+                   if element.text and element.text.strip()]
+    return values
+
+
+@pytest.mark.parametrize("value", EDGE_STRINGS)
+def test_edge_strings(value: str) -> None:
+    assert translit_ru(value) == translit(value, 'ru', reversed=True)
+
+
+def test_samples() -> None:
+    values = sample_references()
+    assert values
+    translit_ru.cache_clear()
+    assert translit_ru_list(values) == \
+        [translit(value, 'ru', reversed=True) for value in values]
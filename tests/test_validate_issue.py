@@ -0,0 +1,70 @@
+# Damaged XML issues must end up in the report, not stop the check
+
+import csv
+from os import path
+import pytest
+from validate_issue import validate_file, write_report
+
+SAMPLE = path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                   "samples", "5-2020.xml")
+
+
+def damaged_issue(directory: 'Path', old: str, new: str) -> str:
+    """Copy of the sample issue with 'old' replaced by 'new'"""
+    with open(SAMPLE, encoding='utf-8') as source:
+        text = source.read()
+    assert old in text
+    file = str(directory / "damaged.xml")
+    with open(file, 'w', encoding='utf-8') as output:
+        output.write(text.replace(old, new, 1))
+    return file
+
+
+def report_rows(file: str, directory: 'Path') -> list:
+    report_file = str(directory / "report.csv")
+    write_report(validate_file(file, None, {}), report_file)
+    with open(report_file, encoding='utf-8-sig') as report:
+        return list(csv.DictReader(report))
+
+
+def test_sample_has_no_problems() -> None:
+    assert validate_file(SAMPLE, {"25877305"}, {}) == []
+
+
+@pytest.mark.parametrize("old, new, field, problem", [
+    ("<year>2020</year>", "", "year", "year is missing in the issue"),
+    ("<issn>2587-7305</issn>", "<issn> </issn>", "issn",
+     "issn is missing in the issue"),
+    ("<volume>31</volume>", "<volume>XXXI</volume>", "volume",
+     "volume is not in 1..99"),
+    ("<date>28.05.20</date>", "<date>May 2020</date>", "month",
+     "month is not in 1..12"),
+])
+def test_damaged_header_is_reported(tmp_path: 'Path', old: str, new: str,
+                                    field: str, problem: str) -> None:
+    rows = report_rows(damaged_issue(tmp_path, old, new), tmp_path)
+    assert any(row["field"] == field and row["problem"] == problem
+               for row in rows)
+
+
+def test_missing_year_is_reported_for_every_article(
+        tmp_path: 'Path') -> None:
+    rows = report_rows(damaged_issue(tmp_path, "<year>2020</year>", ""),
+                       tmp_path)
+    missing_ids = [row for row in rows if row["problem"] == "ID is missing"]
+    assert len(missing_ids) == 20
+
+
+def test_wrong_page_is_reported(tmp_path: 'Path') -> None:
+    rows = report_rows(damaged_issue(tmp_path, "<first_page>3</first_page>",
+                                     "<first_page>iii</first_page>"),
+                       tmp_path)
+    assert [(row["row"], row["field"]) for row in rows] == \
+        [("1", "first_page")]
+
+
+def test_broken_xml_is_reported(tmp_path: 'Path') -> None:
+    file = damaged_issue(tmp_path, "</journal>", "")
+    rows = report_rows(file, tmp_path)
+    assert rows[0]["row"] == "0"
+    assert rows[0]["problem"].startswith("not well-formed XML")
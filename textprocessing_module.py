@@ -3,96 +3,195 @@
 
 import re
 
+# Regular expressions are compiled once at import
+
+SPACES_RE = re.compile(r'\s+')
+LEADING_SPACES_RE = re.compile(r'^\s+')
+TRAILING_SPACES_RE = re.compile(r'\s+$')
+TRAILING_DOTS_RE = re.compile(r'\.+$')
+SPACES_BEFORE_COMMA_RE = re.compile(r'\s+,')
+SPACES_AFTER_COMMA_RE = re.compile(r',\s*')
+PHRASE_BEFORE_COLON_RE = re.compile(r'^.*:\s*')
+LIST_INDENT_RE = re.compile(r'^[ \t]+', re.M)
+LIST_SPACES_RE = re.compile(r'[ \t][ \t]+', re.M)
+
+ID_RE = re.compile(r'........-\d\d\d\d-\d\d-\d\d')
+VOLUME_RE = re.compile(r'^\d{1,2}$')
+MONTH_RE = re.compile(r'^\d{1,2}$')
+
+# Commas in a string with already collapsed whitespace
+COMMA_RE = re.compile(r' ?, ?')
+
+# Reference lists have always been processed with re.M passed
+# as the 'count' argument of sub(), so only the first 8 matches
+# are replaced. The limit is kept to leave the output unchanged
+LIST_SUBSTITUTION_LIMIT = 8
+
 # Individual functions to process text
 
 
 def remove_linebreaks(value: str) -> str:
     """Remove linebreaks (\n) """
-    regexp = re.compile(r'\n')
-    return regexp.sub(' ', value)
+    return value.replace('\n', ' ')
 
 
 def remove_wordwraps(value: str) -> str:
     """Remove wordwraps (-\n) """
-    regexp = re.compile(r'-\n')
-    return regexp.sub('', value)
+    return value.replace('-\n', '')
 
 
 def remove_extra_spaces(value: str) -> str:
-    """Remove leading and trailing space characters and replace any 
+    """Remove leading and trailing space characters and replace any
        multiple whitespace characters to one space character"""
-    regexp = re.compile(r'^\s+')
-    value = regexp.sub('', value)
-    regexp = re.compile(r'\s+$')
-    value = regexp.sub('', value)
-    regexp = re.compile(r'\s+')
-    return regexp.sub(' ', value)
+    value = LEADING_SPACES_RE.sub('', value)
+    value = TRAILING_SPACES_RE.sub('', value)
+    return SPACES_RE.sub(' ', value)
 
 
 def remove_trailing_dots(value: str) -> str:
     """Remove trailing dot(s)"""
-    regexp = re.compile(r'\.+$')
-    return regexp.sub('', value)
+    return TRAILING_DOTS_RE.sub('', value)
 
 
 def replace_semicolon_to_comma(value: str) -> str:
     """Remove semicolons to commas"""
-    regexp = re.compile(r';')
-    return regexp.sub(',', value)
+    return value.replace(';', ',')
 
 
 def arrange_spaces_around_commas(value: str) -> str:
     """Remove unnecessary space before commas and add a single space after"""
-    regexp = re.compile(r'\s+,')
-    value = regexp.sub(',', value)
-    regexp = re.compile(r',\s*')
-    return regexp.sub(', ', value)
+    value = SPACES_BEFORE_COMMA_RE.sub(',', value)
+    return SPACES_AFTER_COMMA_RE.sub(', ', value)
 
 
 def remove_phrase_before_colon(value: str) -> str:
     """Remove a phrase before colon at the beginning of the given string"""
-    regexp = re.compile(r'^.*:\s*')
-    return regexp.sub('', value)
+    return PHRASE_BEFORE_COLON_RE.sub('', value)
 
 
 def remove_extra_spaces_in_list(value: str) -> str:
     """Remove spaces in the beginning of a string in a list"""
-    regexp = re.compile(r'^[ \t]+', re.M)
-    value = regexp.sub('', value, re.M)
-    #regexp = re.compile(r'\n\s+', re.M)
-    #value = regexp.sub('\n', value, re.M)
-    regexp = re.compile(r'¬')
-    value = regexp.sub('', value)
-    regexp = re.compile(r'')
-    value = regexp.sub('-', value)
-    regexp = re.compile(r'[ \t][ \t]+', re.M)
-    return regexp.sub(' ', value, re.M)
+    value = LIST_INDENT_RE.sub('', value, LIST_SUBSTITUTION_LIMIT)
+    # Remove soft hyphen signs and replace hyphens from the Symbol font
+    value = value.replace('¬', '').replace('\uf02d', '-')
+    return LIST_SPACES_RE.sub(' ', value, LIST_SUBSTITUTION_LIMIT)
+
+# Field normalizers. Each one gives the same result as the chain
+# of individual functions above, but in as few passes as possible
+
+
+def collapse_spaces(value: str) -> str:
+    """Same as remove_linebreaks + remove_extra_spaces"""
+    return SPACES_RE.sub(' ', value.strip())
+
+
+def normalize_title(value: str) -> str:
+    """Normalize 'Title' field"""
+    return collapse_spaces(value.replace('-\n', '')).rstrip('.')
+
+
+def normalize_authors_list(value: str) -> str:
+    """Normalize 'Authors list' field"""
+    value = collapse_spaces(value.replace('-\n', '')).replace(';', ',')
+    return COMMA_RE.sub(', ', value)
+
+
+def normalize_authors(value: str) -> str:
+    """Normalize 'Authors info' field"""
+    return collapse_spaces(value.replace('-\n', ''))
+
+
+def normalize_abstract(value: str) -> str:
+    """Normalize 'Abstract' field"""
+    return collapse_spaces(value.replace('-\n', ''))
+
+
+def normalize_keywords(value: str) -> str:
+    """Normalize 'Keywords' field"""
+    value = PHRASE_BEFORE_COLON_RE.sub('', value.replace('-\n', ''), 1)
+    value = collapse_spaces(value).replace(';', ',')
+    return COMMA_RE.sub(', ', value).rstrip('.')
+
+
+def normalize_rubric(value: str) -> str:
+    """Normalize 'Rubric' field"""
+    return normalize_title(value).upper()
+
+
+def normalize_references(value: str) -> str:
+    """Normalize 'References' field"""
+    return remove_extra_spaces_in_list(value)
+
+
+def normalize_pages(value: str) -> str:
+    """Normalize 'Pages' field"""
+    return collapse_spaces(value)
+
+
+# Normalizers by field name (without language suffix)
+NORMALIZERS = {
+    "title": normalize_title,
+    "authors_list": normalize_authors_list,
+    "authors_info": normalize_authors,
+    "abstract": normalize_abstract,
+    "keywords": normalize_keywords,
+    "rubric": normalize_rubric,
+    "references": normalize_references,
+    "pages": normalize_pages
+}
+
+
+def normalize_column(field: str, values: 'Iterable') -> list:
+    """Normalize a whole column of cell values at once.
+       Values other than strings (empty cells, numbers) are kept as is"""
+    normalize = NORMALIZERS[field]
+    return [normalize(value) if type(value) is str else value
+            for value in values]
 
 # Stack of functions to check critical values
 
 
+def id_value_is_valid(value: 'Cell value') -> 'Boolean':
+    """Check ID value"""
+    if type(value) is str:
+        if ID_RE.fullmatch(value):
+            return True
+    return False
+
+
 def id_is_valid(cell: 'Excel cell') -> 'Boolean':
     """Check ID field"""
-    if type(cell.value) is str:
-        if re.compile(r'........-\d\d\d\d-\d\d-\d\d').fullmatch(cell.value):
-            return True
+    return id_value_is_valid(cell.value)
+
+
+def volume_value_is_valid(value: 'Cell value') -> 'Boolean':
+    """Check Volume value"""
+    if VOLUME_RE.fullmatch(str(value)):
+        return True
     return False
 
 
 def volume_is_valid(cell: 'Excel cell') -> 'Boolean':
     """Check Volume field"""
-    regexp = re.compile(r'^\d{1,2}$')
-    if regexp.fullmatch(str(cell.value)):
+    return volume_value_is_valid(cell.value)
+
+
+def month_value_is_valid(value: 'Cell value') -> 'Boolean':
+    """Check Month value"""
+    if MONTH_RE.fullmatch(str(value)):
         return True
     return False
 
 
 def month_is_valid(cell: 'Excel cell') -> 'Boolean':
     """Check Month field"""
-    regexp = re.compile(r'^\d{1,2}$')
-    if regexp.fullmatch(str(cell.value)):
-        return True
-    return False
+    return month_value_is_valid(cell.value)
+
+
+def present(value: 'Field value') -> 'Boolean':
+    """Check that a field of an article document is filled.
+       Empty XLSX cells are stored as 'None' and ['None']"""
+    return value not in (None, '', 'None', [], ['None'])
 
 
 # Stack of texprocessing functions by Excel columns
@@ -102,61 +201,40 @@ def process_title_field(cell: 'Excel cell') -> None:
     # Check whether cell has the type of 'String'
     # to ignore emply cells
     if type(cell.value) is str:
-        cell.value = remove_wordwraps(cell.value)
-        cell.value = remove_linebreaks(cell.value)
-        cell.value = remove_extra_spaces(cell.value)
-        cell.value = remove_trailing_dots(cell.value)
+        cell.value = normalize_title(cell.value)
 
 
 def process_authors_list_field(cell: 'Excel cell') -> None:
     """Stack of texprocessing functions for 'Authors list' field"""
     if type(cell.value) is str:
-        cell.value = remove_wordwraps(cell.value)
-        cell.value = remove_linebreaks(cell.value)
-        cell.value = remove_extra_spaces(cell.value)
-        cell.value = replace_semicolon_to_comma(cell.value)
-        cell.value = arrange_spaces_around_commas(cell.value)
+        cell.value = normalize_authors_list(cell.value)
 
 
 def process_authors_field(cell: 'Excel cell') -> None:
     if type(cell.value) is str:
-        cell.value = remove_wordwraps(cell.value)
-        cell.value = remove_linebreaks(cell.value)
-        cell.value = remove_extra_spaces(cell.value)
+        cell.value = normalize_authors(cell.value)
 
 
 def process_abstract_field(cell: 'Excel cell') -> None:
     if type(cell.value) is str:
-        cell.value = remove_wordwraps(cell.value)
-        cell.value = remove_linebreaks(cell.value)
-        cell.value = remove_extra_spaces(cell.value)
+        cell.value = normalize_abstract(cell.value)
 
 
 def process_keywords_field(cell: 'Excel cell') -> None:
     if type(cell.value) is str:
-        cell.value = remove_wordwraps(cell.value)
-        cell.value = remove_phrase_before_colon(cell.value)
-        cell.value = remove_linebreaks(cell.value)
-        cell.value = remove_extra_spaces(cell.value)
-        cell.value = replace_semicolon_to_comma(cell.value)
-        cell.value = arrange_spaces_around_commas(cell.value)
-        cell.value = remove_trailing_dots(cell.value)
+        cell.value = normalize_keywords(cell.value)
 
 
 def process_rubric_field(cell: 'Excel cell') -> None:
     if type(cell.value) is str:
-        cell.value = remove_wordwraps(cell.value)
-        cell.value = remove_linebreaks(cell.value)
-        cell.value = remove_extra_spaces(cell.value)
-        cell.value = remove_trailing_dots(cell.value)
-        cell.value = cell.value.upper()
+        cell.value = normalize_rubric(cell.value)
 
 
 def process_references_field(cell: 'Excel cell') -> None:
     if type(cell.value) is str:
-        cell.value = remove_extra_spaces_in_list(cell.value)
+        cell.value = normalize_references(cell.value)
 
 
 def process_pages_field(cell: 'Excel cell') -> None:
     if type(cell.value) is str:
-        cell.value = remove_extra_spaces(cell.value)
+        cell.value = normalize_pages(cell.value)
@@ -1,5 +1,4 @@
 #!/bin/bash
 set -e
-python3 correct_xlsx.py
-python3 export_from_XLSX_to_mongo.py
+python3 import_xlsx.py
 exit 0
@@ -0,0 +1,286 @@
+# Check XLSX and XML issues before they are imported.
+# Files are only read: nothing is corrected and nothing is written
+# to MongoDB. Values are checked a whole column at a time and
+# the problems of all files are written into a single CSV or JSON report
+
+from os import environ
+from glob import glob
+import argparse
+import csv
+import json
+import xml.etree.ElementTree as ET
+from openpyxl import load_workbook
+from textprocessing_module import ID_RE, VOLUME_RE, MONTH_RE, normalize_column
+from article_schema import row_fields, row_projector, page_number
+from export_from_XML_to_mongo import HEADER_FIELDS
+from mongo_module import get_database
+
+REPORT_FIELDS = ("file", "row", "id", "field", "value", "problem")
+
+VOLUMES = range(1, 100)
+MONTHS = range(1, 13)
+
+
+def xlsx_columns(file: str) -> tuple:
+    """Read the active sheet of a workbook into columns of 'row_fields'.
+       Return row numbers and columns by field. Empty rows are left out"""
+    wb = load_workbook(file, read_only=True)
+    rows = wb.active.iter_rows(values_only=True)
+    header = next(rows, None)
+
+    numbers = []
+    values = []
+    if header is not None:
+        width = len(header)
+        project = row_projector(header)
+        for number, row in enumerate(rows, 2):
+            if all(value is None for value in row):
+                continue
+            if len(row) < width:
+                row += (None,) * (width - len(row))
+            numbers.append(number)
+            values.append(project(row))
+    wb.close()
+
+    columns = dict(zip(row_fields, zip(*values)))
+    return numbers, {field: list(columns.get(field, ()))
+                     for field in row_fields}
+
+
+def xml_month(date: str) -> str:
+    """Month of an issue date written as DD.MM.YY, the whole
+       date if it is written some other way"""
+    parts = date.split('.') if date else []
+    return parts[1] if len(parts) == 3 else date
+
+
+def xml_columns(file: str) -> tuple:
+    """Read articles of an XML issue into columns as raw text, the way
+       export_from_XML_to_mongo.py builds them but without failing on
+       wrong values. Return article numbers, columns by field and
+       (field, value, problem) triples for the issue-level fields"""
+    columns = {"id": [], "volume": [], "month": [],
+               "first_page": [], "last_page": []}
+    header = {}
+    problems = []
+    depth = 0
+    try:
+        for event, element in ET.iterparse(file, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            if element.tag != 'Article':
+                if element.tag in HEADER_FIELDS:
+                    header.setdefault(element.tag,
+                                      (element.text or '').strip() or None)
+                continue
+
+            number = len(columns["id"]) + 1
+            parts = [(header.get('issn') or '').replace('-', ''),
+                     header.get('year'), (header.get('issue') or '').zfill(2),
+                     str(number).zfill(2)]
+            columns["id"].append('-'.join(parts) if all(parts) else None)
+            columns["volume"].append(header.get('volume'))
+            columns["month"].append(xml_month(header.get('date')))
+            columns["first_page"].append(
+                page_number(element.findtext('first_page')))
+            columns["last_page"].append(
+                page_number(element.findtext('last_page')))
+            element.clear()
+    except ET.ParseError as error:
+        problems.append((None, None, "not well-formed XML: " + str(error)))
+
+    for tag in HEADER_FIELDS:
+        if header.get(tag) is None:
+            problems.append((tag, None, tag + " is missing in the issue"))
+    return list(range(1, len(columns["id"]) + 1)), columns, problems
+
+
+def invalid_ids(ids: list) -> list:
+    """(index, problem) pairs for IDs of a wrong format"""
+    return [(index, "ID is missing" if value is None else "wrong ID format")
+            for index, value in enumerate(ids)
+            if type(value) is not str or not ID_RE.fullmatch(value)]
+
+
+def unknown_eissns(ids: list, eissns: set) -> list:
+    """(index, problem) pairs for IDs with an eISSN prefix
+       missing from 'journal_info'"""
+    return [(index, "eISSN is not in journal_info")
+            for index, value in enumerate(ids)
+            if type(value) is str and value[:8] not in eissns]
+
+
+def out_of_range(values: list, pattern: 'Regex', allowed: range,
+                 name: str) -> list:
+    """(index, problem) pairs for values that are not numbers
+       of the 'allowed' range"""
+    problems = []
+    for index, value in enumerate(values):
+        text = str(value)
+        if not pattern.fullmatch(text) or int(text) not in allowed:
+            problems.append((index, name + " is not in " +
+                             str(allowed.start) + ".." +
+                             str(allowed.stop - 1)))
+    return problems
+
+
+def page_range_problem(first: 'Page number', last: 'Page number') -> str:
+    """Problem of a parsed page range, None if it is correct"""
+    if first is None:
+        return "first page is missing or not a number"
+    if last is not None and last < first:
+        return "last page is before the first one"
+    return None
+
+
+def parse_page(value: str) -> 'Integer or None':
+    return int(value) if value.isdigit() else None
+
+
+def invalid_page_ranges(firsts: list, lasts: list) -> list:
+    """(index, problem) pairs for wrong ranges of parsed page numbers"""
+    problems = []
+    for index, (first, last) in enumerate(zip(firsts, lasts)):
+        problem = page_range_problem(first, last)
+        if problem:
+            problems.append((index, problem))
+    return problems
+
+
+def invalid_pages(pages: list) -> list:
+    """(index, problem) pairs for 'Pages' values which would not be
+       split into first and last pages on import"""
+    problems = []
+    for index, value in enumerate(normalize_column("pages", pages)):
+        parts = str(value).split(' ')
+        first = parse_page(parts[0])
+        last = parse_page(parts[1]) if len(parts) > 1 else None
+        if len(parts) > 1 and last is None:
+            problem = "last page is not a number"
+        elif len(parts) > 2:
+            problem = "more than two page numbers"
+        else:
+            problem = page_range_problem(first, last)
+        if problem:
+            problems.append((index, problem))
+    return problems
+
+
+def validate_file(file: str, eissns: set, seen: dict) -> list:
+    """Return problems of a file as report rows. 'seen' maps IDs
+       of the files checked before to their file and row"""
+    report = []
+    if file.endswith(".xml"):
+        numbers, columns, problems = xml_columns(file)
+        checks = [("first_page", invalid_page_ranges(columns["first_page"],
+                                                     columns["last_page"]))]
+        # Problems of the whole issue go before its articles
+        for field, value, problem in problems:
+            report.append({"file": file, "row": 0, "id": None,
+                           "field": field, "value": value,
+                           "problem": problem})
+    else:
+        numbers, columns = xlsx_columns(file)
+        checks = [("pages", invalid_pages(columns["pages"]))]
+
+    ids = columns["id"]
+    checks += [("id", invalid_ids(ids)),
+               ("volume", out_of_range(columns["volume"], VOLUME_RE,
+                                       VOLUMES, "volume")),
+               ("month", out_of_range(columns["month"], MONTH_RE,
+                                      MONTHS, "month"))]
+    if eissns is not None:
+        checks.append(("id", unknown_eissns(ids, eissns)))
+
+    for field, problems in checks:
+        for index, problem in problems:
+            report.append({"file": file, "row": numbers[index],
+                           "id": ids[index], "field": field,
+                           "value": columns[field][index],
+                           "problem": problem})
+
+    # Duplicates inside the file and against the files checked before
+    for index, value in enumerate(ids):
+        if value is None:
+            continue
+        if value in seen:
+            report.append({"file": file, "row": numbers[index],
+                           "id": value, "field": "id", "value": value,
+                           "problem": "duplicate of " + seen[value]})
+        else:
+            seen[value] = file + " row " + str(numbers[index])
+
+    report.sort(key=lambda item: item["row"])
+    return report
+
+
+def load_eissns() -> set:
+    """eISSNs of the journals in 'journal_info' without dashes"""
+    return {str(journal["_id"]).replace('-', '') for journal in
+            get_database().journal_info.find({}, {"_id": True})}
+
+
+def write_report(report: list, report_file: str) -> None:
+    """Write the report as JSON if the file name ends with '.json',
+       otherwise as CSV readable by Excel"""
+    if report_file.endswith(".json"):
+        with open(report_file, 'w', encoding='utf-8') as output:
+            json.dump(report, output, ensure_ascii=False, indent=2,
+                      default=str)
+        return
+
+    with open(report_file, 'w', encoding='utf-8-sig', newline='') as output:
+        writer = csv.DictWriter(output, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(report)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Check XLSX and XML issues without importing them')
+    arg_parser.add_argument('files',
+                            metavar='file',
+                            nargs='+',
+                            help='Files or glob patterns '
+                                 '(e.g. "incoming_xlsx/*.xlsx")')
+    arg_parser.add_argument('--report',
+                            default='validation_report.csv',
+                            help='Report file, ".csv" or ".json"')
+    arg_parser.add_argument('--eissn',
+                            nargs='+',
+                            help='Known eISSNs, instead of reading '
+                                 'them from "journal_info"')
+    arguments = arg_parser.parse_args()
+
+    files = []
+    for pattern in arguments.files:
+        files += sorted(glob(pattern)) or [pattern]
+
+    # eISSN prefixes are checked only if the journals are known
+    if arguments.eissn:
+        eissns = {eissn.replace('-', '') for eissn in arguments.eissn}
+    elif 'MONGO_DEV_URI' in environ:
+        eissns = load_eissns()
+    else:
+        eissns = None
+        print('MONGO_DEV_URI is not set, eISSNs are not checked')
+
+    report = []
+    seen = {}
+    for file in files:
+        report += validate_file(file, eissns, seen)
+
+    write_report(report, arguments.report)
+    print(str(len(report)) + ' problems in ' + str(len(files)) +
+          ' files, see ' + arguments.report)
+
+    if report:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# Keep a single process running and import files as soon as they are
+# dropped into the "incoming_xlsx" and "incoming_xml" directories.
+# Libraries are imported and the MongoDB client is created once,
+# so a new file does not wait for the next cron run.
+# Changes are detected with inotify if 'inotify_simple' is installed
+# (Linux only), otherwise the directories are polled
+
+from os import listdir, path, makedirs, rename, stat
+import argparse
+import logging
+import signal
+import time
+from mongo_module import (DEFAULT_BATCH_SIZE, get_database,
+                          add_writers_argument)
+from metrics_module import instrumented_run
+from import_xlsx import (INCOMING_DIR, TRASH_DIR, import_files,
+                         prepare_directories)
+from export_from_XML_to_mongo import export_files
+from near_duplicates_module import add_near_duplicates_argument
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+XML_DIR = "incoming_xml"
+
+# Seconds inotify is waited for when no file is settling
+IDLE_SECONDS = 60
+
+# Directories and extensions of the files they receive
+WATCHED = ((INCOMING_DIR, ".xlsx"), (XML_DIR, ".xml"))
+
+running = True
+
+
+def stop(signum: int, frame: 'Stack frame') -> None:
+    """Finish the current file and exit"""
+    global running
+    running = False
+
+
+def create_watcher() -> 'INotify or None':
+    """Watch the incoming directories with inotify if it is available"""
+    if INotify is None:
+        return None
+    watcher = INotify()
+    for directory, _ in WATCHED:
+        watcher.add_watch(directory, flags.CREATE | flags.MODIFY |
+                          flags.CLOSE_WRITE | flags.MOVED_TO)
+    return watcher
+
+
+def wait(watcher: 'INotify or None', seconds: float) -> None:
+    """Sleep until something happens in the directories
+       or 'seconds' pass"""
+    if watcher is None:
+        time.sleep(seconds)
+    else:
+        watcher.read(timeout=int(seconds * 1000))
+
+
+def scan() -> dict:
+    """Return (size, modification time) of every incoming file by path"""
+    files = {}
+    for directory, extension in WATCHED:
+        for file in listdir(directory):
+            if file.endswith(extension) and not file.startswith("~$"):
+                file_path = directory + "/" + file
+                try:
+                    info = stat(file_path)
+                except FileNotFoundError:
+                    continue
+                files[file_path] = (info.st_size, info.st_mtime)
+    return files
+
+
+def import_dropped_file(file_path: str, batch_size: int,
+                        save_corrected: bool, writers: int,
+                        near_duplicates: bool = False) -> bool:
+    """Import a single settled file. Return True if it has succeeded"""
+    directory, file = path.split(file_path)
+
+    if directory == INCOMING_DIR:
+        return not import_files([file], batch_size, save_corrected,
+                                writers=writers,
+                                near_duplicates=near_duplicates)
+
+    failed = export_files(get_database().articles, [file_path],
+                          batch_size, writers=writers,
+                          near_duplicates=near_duplicates)
+    if failed:
+        for article_id, reason in failed:
+            if article_id is None:
+                logging.error(file_path + " cannot be read: " + reason)
+                continue
+            logging.error('Article has not been exported. File: "' +
+                          file_path + '". ID: "' + str(article_id) +
+                          '". Reason: "' + reason + '"')
+        logging.error(file_path + " has not been exported to MongoDB")
+        return False
+
+    rename(file_path, XML_DIR + "/" + TRASH_DIR + "/" + file)
+    logging.info(file_path + " has been exported to MongoDB")
+    return True
+
+
+def watch(batch_size: int = DEFAULT_BATCH_SIZE,
+          save_corrected: bool = False,
+          writers: int = 0,
+          settle: float = 2.0,
+          interval: float = 1.0,
+          poll: bool = False,
+          near_duplicates: bool = False) -> None:
+    """Import files once their size and modification time have not
+       changed for 'settle' seconds, so partially copied files
+       are left alone. A file that has failed is retried
+       only after it changes. With 'near_duplicates' possible
+       duplicates of the imported articles are logged"""
+
+    # setup logging
+    logging.basicConfig(filename='app.log',
+                        level=logging.INFO,
+                        format='%(asctime)s | %(levelname)s | %(message)s',
+                        datefmt='%d/%m/%Y %H:%M:%S')
+
+    prepare_directories(save_corrected)
+    if not path.exists(XML_DIR + "/" + TRASH_DIR):
+        makedirs(XML_DIR + "/" + TRASH_DIR)
+
+    watcher = None if poll else create_watcher()
+    logging.info("### Import watcher started (" +
+                 ("polling" if watcher is None else "inotify") + ")")
+
+    # The client is created before the first file arrives
+    get_database()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Files seen changing: path -> (signature, time it was last seen)
+    pending = {}
+    # Files that have failed: path -> signature they have failed with
+    failed = {}
+
+    while running:
+        now = time.monotonic()
+        ready = []
+
+        for file_path, signature in scan().items():
+            if failed.get(file_path) == signature:
+                continue
+            if file_path not in pending or pending[file_path][0] != signature:
+                pending[file_path] = (signature, now)
+            elif now - pending[file_path][1] >= settle:
+                ready.append(file_path)
+
+        for file_path in [file_path for file_path in pending
+                          if not path.exists(file_path)]:
+            del pending[file_path]
+
+        if ready:
+            with instrumented_run('watch_imports'):
+                for file_path in sorted(ready):
+                    if not running:
+                        break
+                    signature = pending.pop(file_path)[0]
+                    try:
+                        succeeded = import_dropped_file(file_path,
+                                                        batch_size,
+                                                        save_corrected,
+                                                        writers,
+                                                        near_duplicates)
+                    except Exception as exception:
+                        logging.error(file_path + " has not been imported: " +
+                                      repr(exception))
+                        succeeded = False
+                    if not succeeded:
+                        failed[file_path] = signature
+
+        # Wake up sooner while files are settling. inotify wakes
+        # the watcher up itself when a file arrives
+        if pending:
+            wait(watcher, min(interval, settle))
+        else:
+            wait(watcher, interval if watcher is None else IDLE_SECONDS)
+
+    logging.info("### Import watcher stopped")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Import files dropped into "incoming_xlsx" and '
+                    '"incoming_xml" as they arrive')
+    arg_parser.add_argument('--batch-size',
+                            type=int,
+                            default=DEFAULT_BATCH_SIZE,
+                            help='Number of articles sent to MongoDB at once')
+    arg_parser.add_argument('--save-corrected',
+                            action='store_true',
+                            help='Also save corrected workbooks '
+                                 'into "corrected_xlsx/trash"')
+    add_writers_argument(arg_parser)
+    arg_parser.add_argument('--settle',
+                            type=float,
+                            default=2.0,
+                            help='Seconds a file must stay unchanged '
+                                 'before it is imported')
+    arg_parser.add_argument('--interval',
+                            type=float,
+                            default=1.0,
+                            help='Seconds between directory scans')
+    arg_parser.add_argument('--poll',
+                            action='store_true',
+                            help='Poll the directories even if inotify '
+                                 'is available')
+    add_near_duplicates_argument(arg_parser)
+    arguments = arg_parser.parse_args()
+
+    watch(arguments.batch_size, arguments.save_corrected, arguments.writers,
+          arguments.settle, arguments.interval, arguments.poll,
+          arguments.near_duplicates)